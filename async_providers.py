@@ -0,0 +1,113 @@
+import os
+import asyncio
+import httpx
+import pandas as pd
+
+from metrics import metrics
+
+FUGLE_BASE_URL = os.getenv("FUGLE_BASE_URL", "https://api.fugle.tw/marketdata/v1.0")
+FINMIND_BASE_URL = os.getenv("FINMIND_BASE_URL", "https://api.finmindtrade.com/api/v4")
+FINMIND_USER_INFO_URL = os.getenv("FINMIND_USER_INFO_URL", "https://api.web.finmindtrade.com/v2/user_info")
+
+
+def parse_fugle_candles(data):
+    """將富果歷史 K 線回應轉換為 DataFrame (由舊到新)，無資料時回傳 None"""
+    candles = data.get('candles', [])
+    if not candles:
+        return None
+    df = pd.DataFrame(candles)
+    # 重新命名欄位以符合後續邏輯 (Fugle: date, open, high, low, close, volume)
+    df = df.rename(columns={'volume': 'trading_volume'})
+    df.columns = [c.lower() for c in df.columns]
+    # Fugle 的資料通常是從新到舊，需翻轉
+    return df.iloc[::-1].reset_index(drop=True)
+
+
+class AsyncProviderClient:
+    """
+    富果與 FinMind REST API 的非同步用戶端 (httpx.AsyncClient，共用連線池)
+    單一執行緒即可同時進行數百個請求；連線池綁定建立時的事件迴圈，迴圈變更時自動重建
+    """
+    def __init__(self, finmind_token="", fugle_token="", max_connections=None, timeout=10):
+        self.finmind_token = finmind_token
+        self.fugle_token = fugle_token
+        self.max_connections = max_connections or int(os.getenv("ASYNC_MAX_CONNECTIONS", 100))
+        self.timeout = timeout
+        self._client = None
+        self._loop = None
+
+    def _get_client(self):
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            limits = httpx.Limits(max_connections=self.max_connections,
+                                  max_keepalive_connections=self.max_connections)
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=limits)
+            self._loop = loop
+        return self._client
+
+    async def _get(self, provider, endpoint, url, **kwargs):
+        """發出 GET 請求並記錄延遲與結果 (HTTP 錯誤狀態碼記為 http_xxx)"""
+        with metrics.track("provider", provider=provider, endpoint=endpoint) as call:
+            response = await self._get_client().get(url, **kwargs)
+            if response.status_code >= 400:
+                call["outcome"] = f"http_{response.status_code}"
+            return response
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._loop = None
+
+    # --- 富果 ---
+
+    async def fugle_candles(self, symbol, start_date, end_date):
+        """富果歷史日 K，回傳 DataFrame 或 None"""
+        if not self.fugle_token:
+            return None
+        response = await self._get(
+            "fugle", "candles", f"{FUGLE_BASE_URL}/stock/historical/candles/{symbol}",
+            params={"from": start_date, "to": end_date, "fields": "open,high,low,close,volume"},
+            headers={"X-API-KEY": self.fugle_token}
+        )
+        if response.status_code != 200:
+            return None
+        return parse_fugle_candles(response.json())
+
+    # --- FinMind ---
+
+    async def finmind_data(self, dataset, start_date, end_date=None, data_id=None):
+        """
+        FinMind v4 資料集查詢，回傳 DataFrame (欄位與 DataLoader 相同)
+        回應缺少 data 欄位時 (未登入或超過額度) 與 DataLoader 一樣拋出 KeyError('data')
+        """
+        return pd.DataFrame(await self.finmind_rows(dataset, start_date, end_date, data_id))
+
+    async def finmind_rows(self, dataset, start_date, end_date=None, data_id=None):
+        """FinMind v4 資料集查詢，回傳原始資料列 (list of dict)，不建立 DataFrame"""
+        params = {"dataset": dataset, "start_date": start_date}
+        if end_date:
+            params["end_date"] = end_date
+        if data_id:
+            params["data_id"] = data_id
+        headers = {"Authorization": f"Bearer {self.finmind_token}"} if self.finmind_token else {}
+        with metrics.track("provider", provider="finmind", endpoint=dataset) as call:
+            response = await self._get_client().get(f"{FINMIND_BASE_URL}/data", params=params, headers=headers)
+            payload = response.json()
+            if "data" not in payload:
+                # 未登入或超過額度 (HTTP 200 但無資料)
+                call["outcome"] = f"http_{response.status_code}" if response.status_code >= 400 else "no_data"
+        return payload["data"]
+
+    async def taiwan_stock_daily(self, stock_id, start_date, end_date):
+        """TaiwanStockPrice 日 K"""
+        return await self.finmind_data("TaiwanStockPrice", start_date, end_date, data_id=stock_id)
+
+    async def order_book_rows(self, date_str):
+        """TaiwanStockStatisticsOfOrderBookAndTrade 全市場每 5 秒委託成交統計，回傳原始資料列 (依時間排序)"""
+        return await self.finmind_rows("TaiwanStockStatisticsOfOrderBookAndTrade", date_str, date_str)
+
+    async def user_info(self):
+        """FinMind 帳號使用量，回傳原始 JSON"""
+        response = await self._get("finmind", "user_info", FINMIND_USER_INFO_URL, params={"token": self.finmind_token})
+        return response.json()
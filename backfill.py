@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from datetime import date, timedelta
+
+from quote_store import HistoryRecord
+
+log = logging.getLogger(__name__)
+
+
+class HistoryBackfill:
+    """
+    多年日 K 回補作業 (寫入本地歷史資料庫)
+    - watchlist: 監控清單各標的，依年度切段抓取 (富果單次查詢上限一年)，進度記錄於檢查點檔
+    - market: 全市場，每個交易日一個整批請求，已載入的交易日記錄於資料庫 (loaded_dates)
+    中斷後重新執行會從未完成的部分繼續；以 BACKFILL_CONCURRENCY 限制並行數，
+    並依 FinMind 剩餘額度決定本次最多發出的請求數 (額度用盡時保存進度後結束)
+    """
+    def __init__(self, fetcher, scanner, checkpoint_path=None):
+        self.fetcher = fetcher
+        self.scanner = scanner
+        self.db = fetcher.history_db
+        self.checkpoint_path = checkpoint_path or os.getenv("BACKFILL_CHECKPOINT", "backfill_checkpoint.json")
+        self.concurrency = int(os.getenv("BACKFILL_CONCURRENCY", 4))
+        # 保留給盤中查詢的 FinMind 額度
+        self.quota_reserve = int(os.getenv("BACKFILL_QUOTA_RESERVE", 50))
+        # 無法查詢額度時 (未設定 Token)，本次最多發出的請求數
+        self.default_budget = int(os.getenv("BACKFILL_MAX_REQUESTS", 300))
+
+    def _load_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            try:
+                with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except Exception as e:
+                log.warning("讀取回補檢查點失敗，將重新開始: %s", e)
+        return {"done": {}, "failed": {}}
+
+    def _save_checkpoint(self, checkpoint):
+        checkpoint['updated_at'] = time.strftime("%Y-%m-%d %H:%M:%S")
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    async def _request_budget(self):
+        """本次可使用的 FinMind 請求數 (上限 - 已使用 - 保留額度)"""
+        usage = await self.fetcher.aget_api_usage()
+        if not usage or usage.get('api_request_limit') is None:
+            return self.default_budget
+        return max(0, usage['api_request_limit'] - (usage.get('user_count') or 0) - self.quota_reserve)
+
+    @staticmethod
+    def _year_chunks(start, end):
+        """將 [start, end] 依年度切段，回傳 [(起日, 迄日)]"""
+        chunks = []
+        chunk_start = start
+        while chunk_start <= end:
+            chunk_end = min(end, date(chunk_start.year, 12, 31))
+            chunks.append((chunk_start, chunk_end))
+            chunk_start = chunk_end + timedelta(days=1)
+        return chunks
+
+    async def _run_tasks(self, tasks, budget):
+        """
+        以有限並行數執行 (key, 是否消耗額度, coroutine 工廠) 工作
+        額度用盡後不再啟動新工作，回傳 {key: 寫入筆數或例外}
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        remaining = [budget]
+        results = {}
+
+        async def run(key, uses_quota, factory):
+            async with semaphore:
+                if uses_quota:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                try:
+                    results[key] = await factory()
+                except Exception as e:
+                    results[key] = e
+
+        await asyncio.gather(*(run(*task) for task in tasks))
+        return results
+
+    async def backfill_watchlist(self, symbols, years):
+        """回補監控清單各標的最近 years 年的日 K"""
+        today = self.fetcher._get_taipei_now().date()
+        start = today - timedelta(days=365 * years)
+        checkpoint = self._load_checkpoint()
+        done = checkpoint.setdefault("done", {})
+        failed = checkpoint.setdefault("failed", {})
+
+        async def fetch(key, symbol, chunk_start, chunk_end):
+            try:
+                df, source_tag = await self.fetcher.afetch_history_df(
+                    symbol, chunk_start.strftime("%Y-%m-%d"), chunk_end.strftime("%Y-%m-%d"))
+                record = HistoryRecord.from_frame(symbol, df, source=source_tag)
+                rows = await asyncio.to_thread(self.db.upsert_record, record) if record is not None else 0
+            except Exception as e:
+                failed[key] = str(e)
+                raise
+            if not rows:
+                # 空回應不記為完成 (可能為資料來源暫時異常)，下次執行重新抓取
+                failed[key] = "無資料"
+                return 0
+            failed.pop(key, None)
+            # 只有已結束年度的段落記為完成 (今年的段落每次都重新抓取)；每段完成即保存，中斷後可續傳
+            if chunk_end.year < today.year:
+                done[key] = rows
+                self._save_checkpoint(checkpoint)
+            return rows
+
+        tasks = []
+        for symbol in symbols:
+            for chunk_start, chunk_end in self._year_chunks(start, today):
+                # 檢查點以 (標的, 段落起日) 為鍵，回補年數改變時段落起日不同，會重新抓取
+                key = f"{symbol}:{chunk_start}"
+                if key in done:
+                    continue
+                tasks.append((key, not self.fetcher._is_us_symbol(symbol),
+                              lambda k=key, s=symbol, a=chunk_start, b=chunk_end: fetch(k, s, a, b)))
+
+        if not tasks:
+            log.info("監控清單歷史已回補完成，無需抓取。")
+            return {"tasks": 0, "rows": 0, "failed": 0, "pending": 0}
+
+        budget = await self._request_budget()
+        log.info("開始回補監控清單 %s 檔 × %s 年：共 %s 段，本次額度 %s 次請求", len(symbols), years, len(tasks), budget)
+        results = await self._run_tasks(tasks, budget)
+        self._mark_before_listing(symbols, start, today, results, done, failed)
+        self._save_checkpoint(checkpoint)
+        rows = sum(result for result in results.values() if not isinstance(result, Exception))
+        return self._summary(tasks, results, rows)
+
+    def _mark_before_listing(self, symbols, start, today, results, done, failed):
+        """
+        已結束年度的段落回傳空資料、但較晚的段落有資料時，視為上市 (或開始交易) 前的區間記為完成
+        避免這些段落每次執行都重新請求而持續消耗額度
+        """
+        for symbol in symbols:
+            listed = False
+            for chunk_start, chunk_end in reversed(self._year_chunks(start, today)):
+                key = f"{symbol}:{chunk_start}"
+                rows = done[key] if key in done else results.get(key)
+                if isinstance(rows, int) and rows > 0:
+                    listed = True
+                elif rows == 0 and listed and chunk_end.year < today.year and key not in done:
+                    done[key] = 0
+                    failed.pop(key, None)
+                    log.debug("%s 於 %s 前無交易資料，視為上市前區間", symbol, chunk_end)
+
+    async def backfill_market(self, years):
+        """回補全市場最近 years 年的日 K (每個交易日一個整批請求)"""
+        today = self.fetcher._get_taipei_now().date()
+        d = today - timedelta(days=365 * years)
+        wanted = []
+        while d <= today:
+            if self.scanner.is_trading_day(d):
+                wanted.append(d.strftime("%Y-%m-%d"))
+            d += timedelta(days=1)
+        loaded = await asyncio.to_thread(self.db.loaded_dates)
+        missing = [date_str for date_str in wanted if date_str not in loaded]
+        if not missing:
+            log.info("全市場歷史已回補完成，無需抓取。")
+            return {"tasks": 0, "rows": 0, "failed": 0, "pending": 0}
+
+        budget = await self._request_budget()
+        log.info("開始回補全市場 %s 年：共 %s 個交易日，本次額度 %s 次請求", years, len(missing), budget)
+        # 由新到舊載入，額度不足時優先保留近期資料
+        tasks = [(date_str, True, lambda s=date_str: self.scanner.load_date(s)) for date_str in reversed(missing)]
+        results = await self._run_tasks(tasks, budget)
+        rows = sum(result for result in results.values() if not isinstance(result, Exception))
+        return self._summary(tasks, results, rows)
+
+    @staticmethod
+    def _summary(tasks, results, rows):
+        failed = [key for key, result in results.items() if isinstance(result, Exception)]
+        for key in failed[:10]:
+            log.warning("回補失敗 %s: %s", key, results[key])
+        summary = {
+            "tasks": len(tasks),
+            "rows": rows,
+            "failed": len(failed),
+            "pending": len(tasks) - len(results),
+        }
+        log.info("📦 回補結束：%s/%s 段完成，寫入 %s 筆，失敗 %s，因額度保留 %s 段待下次執行", len(results) - len(failed), len(tasks), rows, len(failed), summary['pending'])
+        return summary
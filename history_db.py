@@ -0,0 +1,139 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+from quote_store import HistoryRecord
+
+
+class HistoryDatabase:
+    """
+    本地日 K 資料庫 (sqlite)，保存全市場或監控清單的長期歷史
+    - daily_prices: 每檔標的每日一列，(symbol, date) 為主鍵，重複寫入時覆蓋
+    - loaded_dates: 已以整批 (單日全市場) 方式載入的交易日，避免重複請求
+    寫入一律以單一交易批次完成
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS daily_prices (
+            symbol TEXT NOT NULL,
+            date TEXT NOT NULL,
+            open REAL, high REAL, low REAL, close REAL, volume REAL,
+            PRIMARY KEY (symbol, date)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_daily_prices_date ON daily_prices (date);
+        CREATE TABLE IF NOT EXISTS loaded_dates (
+            date TEXT PRIMARY KEY,
+            rows INTEGER NOT NULL,
+            loaded_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv("HISTORY_DB_PATH", "history.db")
+        self._lock = threading.Lock() # sqlite 同時只允許一個寫入者
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def upsert_rows(self, rows, loaded_date=None):
+        """
+        批次寫入日 K (單一交易)
+        rows: iterable of (symbol, date, open, high, low, close, volume)
+        loaded_date: 若為整日全市場資料，一併記錄該交易日已載入
+        回傳寫入筆數
+        """
+        rows = list(rows)
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO daily_prices (symbol, date, open, high, low, close, volume) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            if loaded_date:
+                conn.execute("INSERT OR REPLACE INTO loaded_dates (date, rows) VALUES (?, ?)",
+                             (loaded_date, len(rows)))
+        return len(rows)
+
+    def upsert_record(self, record):
+        """寫入單一標的的 HistoryRecord"""
+        dates = record.dates.astype(str).tolist()
+        return self.upsert_rows(zip(
+            [record.symbol] * len(dates), dates,
+            record.open.tolist(), record.high.tolist(), record.low.tolist(),
+            record.close.tolist(), record.volume.tolist()
+        ))
+
+    def loaded_dates(self):
+        """已整批載入的交易日集合"""
+        with self._connect() as conn:
+            return {row[0] for row in conn.execute("SELECT date FROM loaded_dates")}
+
+    def latest_date(self):
+        with self._connect() as conn:
+            row = conn.execute("SELECT MAX(date) FROM daily_prices").fetchone()
+        return row[0] if row else None
+
+    def record(self, symbol, start_date=None):
+        """讀取單一標的的歷史 (HistoryRecord)，無資料時回傳 None"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT date, open, high, low, close, volume FROM daily_prices "
+                "WHERE symbol = ? AND date >= ? ORDER BY date",
+                (symbol, start_date or "")
+            ).fetchall()
+        if not rows:
+            return None
+        dates, o, h, l, c, v = zip(*rows)
+        as_float = lambda values: np.array(values, dtype=np.float64)
+        return HistoryRecord(symbol, np.array(dates, dtype='datetime64[D]'), as_float(o), as_float(h),
+                             as_float(l), as_float(c), as_float(v), start=start_date, source="HistoryDB")
+
+    def load_matrix(self, days, end_date=None, symbols=None):
+        """
+        讀取最近 days 個交易日的全市場矩陣 (標的數 × 交易日)
+        回傳: {"symbols": [str], "dates": [str], "open"/"high"/"low"/"close"/"volume": ndarray}
+        該日無資料 (停牌等) 的位置為 NaN
+        未指定 symbols 時只使用已整批載入的交易日 (個別標的寫入的日期可能只有少數標的有資料)
+        """
+        if symbols:
+            date_query = "SELECT DISTINCT date FROM daily_prices WHERE date <= ? ORDER BY date DESC LIMIT ?"
+        else:
+            date_query = "SELECT date FROM loaded_dates WHERE rows > 0 AND date <= ? ORDER BY date DESC LIMIT ?"
+        with self._connect() as conn:
+            date_rows = conn.execute(date_query, (end_date or "9999-12-31", days)).fetchall()
+            if not date_rows:
+                return None
+            dates = sorted(row[0] for row in date_rows)
+            query = ("SELECT symbol, date, open, high, low, close, volume FROM daily_prices "
+                     "WHERE date >= ? AND date <= ?")
+            params = [dates[0], dates[-1]]
+            if symbols:
+                query += f" AND symbol IN ({','.join('?' * len(symbols))})"
+                params.extend(symbols)
+            rows = conn.execute(query, params).fetchall()
+        if not rows:
+            return None
+
+        sym_col, date_col, *values = zip(*rows)
+        symbol_list, sym_idx = np.unique(np.array(sym_col), return_inverse=True)
+        date_idx = np.searchsorted(np.array(dates), np.array(date_col))
+        result = {"symbols": symbol_list.tolist(), "dates": dates}
+        for name, column in zip(("open", "high", "low", "close", "volume"), values):
+            matrix = np.full((len(symbol_list), len(dates)), np.nan)
+            matrix[sym_idx, date_idx] = np.array(column, dtype=np.float64)
+            result[name] = matrix
+        return result
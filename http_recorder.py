@@ -0,0 +1,387 @@
+import os
+import re
+import sys
+import json
+import gzip
+import time
+import queue
+import atexit
+import base64
+import hashlib
+import logging
+import argparse
+import threading
+from datetime import datetime, timezone, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+# HTTP 錄製與重播
+# - 錄製: 攔截 httpx (富果/FinMind 非同步用戶端、Notion、Telegram) 與 requests (富果 snapshot、FinMind DataLoader)
+#   的每一次請求，將回應寫入 gzip 壓縮的 JSONL 封存檔 (相同內容的回應只存一份)
+# - 重播: 本機 HTTP 服務依封存檔回應，路徑配置與 tests/fake_providers.py 相同 (/finmind/...、/notion/... 等)，
+#   可依原始延遲或加速 (--speed) 回應；tests/benchmark.py --replay 以此重跑同一個交易日
+# yfinance 使用 curl_cffi 發出請求，不在錄製範圍內
+
+log = logging.getLogger(__name__)
+
+TAIPEI = timezone(timedelta(hours=8))
+
+# 正式 API 主機 -> 重播服務的路徑前綴
+HOST_PREFIXES = {
+    "api.finmindtrade.com": "finmind",
+    "api.web.finmindtrade.com": "finmind",
+    "api.fugle.tw": "fugle",
+    "api.notion.com": "notion",
+    "api.telegram.org": "telegram",
+    "query1.finance.yahoo.com": "yahoo",
+    "query2.finance.yahoo.com": "yahoo",
+}
+# 不寫入封存檔、也不參與比對的查詢參數
+SECRET_PARAMS = {"token", "api_token", "apikey"}
+# 每次執行都不同的路徑片段 (Bot Token、Notion 資料庫 ID)
+PATH_RULES = (
+    (re.compile(r"/bot[^/]+/"), "/bot<token>/"),
+    (re.compile(r"/databases/[^/]+/"), "/databases/<id>/"),
+)
+# 依執行日期變動的查詢參數 (日期不同時的寬鬆比對會忽略)
+DATE_PARAMS = {"start_date", "end_date", "date", "from", "to"}
+
+
+def normalize_path(path):
+    for pattern, replacement in PATH_RULES:
+        path = pattern.sub(replacement, path)
+    return path
+
+
+def normalize_query(query_string):
+    return tuple(sorted((k, v) for k, v in parse_qsl(query_string) if k not in SECRET_PARAMS))
+
+
+def request_key(content_type, body):
+    """請求內容的比對鍵 (multipart 上傳每次邊界字串不同，不列入比對)"""
+    if not body or (content_type or "").startswith("multipart/"):
+        return None
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    return hashlib.sha1(body).hexdigest()[:16]
+
+
+class HttpRecorder:
+    """
+    將 HTTP 交換寫入封存檔 (gzip JSONL，附加模式；每次啟動為一個 session)
+    記錄由背景執行緒寫入，不阻塞事件迴圈；HTTP_RECORD_EXCLUDE (正規表示式) 比對到的路徑不錄製
+    """
+    def __init__(self, path, exclude=None):
+        self.path = path
+        self.exclude = re.compile(exclude or os.getenv("HTTP_RECORD_EXCLUDE", r"/getUpdates$"))
+        self.started = time.time()
+        self.count = 0
+        self._queue = queue.Queue()
+        self._seen = set() # 已寫入的回應內容 (sha1)
+        self._file = None
+        self._thread = None
+
+    def start(self):
+        self._file = gzip.open(self.path, "at", encoding="utf-8")
+        self._file.write(json.dumps({
+            "type": "session",
+            "started_at": datetime.fromtimestamp(self.started, TAIPEI).isoformat(),
+        }) + "\n")
+        self._thread = threading.Thread(target=self._writer, name="http-recorder", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        log.info("🎙️ HTTP 錄製中: %s", self.path)
+
+    def record(self, method, url, request_type, request_body, status, content_type, body, started, elapsed):
+        parts = urlsplit(str(url))
+        # 其他主機 (例如已指向本機替身服務) 的路徑本身即為重播服務的配置
+        prefix = HOST_PREFIXES.get(parts.hostname)
+        path = normalize_path(f"/{prefix}{parts.path}" if prefix else parts.path)
+        if self.exclude.search(path):
+            return
+        self._queue.put({
+            "type": "exchange",
+            "t": round(started - self.started, 3),
+            "method": method.upper(),
+            "path": path,
+            "query": normalize_query(parts.query),
+            "req": request_key(request_type, request_body),
+            "status": status,
+            "content_type": content_type,
+            "elapsed": round(elapsed, 4),
+            "body": body,
+        })
+
+    def _writer(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            body = item["body"]
+            sha = hashlib.sha1(body).hexdigest()
+            if sha not in self._seen:
+                self._seen.add(sha)
+                entry = {"type": "body", "sha": sha}
+                try:
+                    entry["text"] = body.decode("utf-8")
+                except UnicodeDecodeError:
+                    entry["b64"] = base64.b64encode(body).decode("ascii")
+                self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            item["body"] = sha
+            self._file.write(json.dumps(item, ensure_ascii=False) + "\n")
+            self.count += 1
+            if self._queue.empty():
+                self._file.flush() # 中途中斷時已寫入的部分仍可讀取
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+        log.info("HTTP 錄製結束: %s 筆 (%s)", self.count, self.path)
+
+
+def _patch_httpx(recorder):
+    import httpx
+
+    sync_send = httpx.HTTPTransport.handle_request
+    async_send = httpx.AsyncHTTPTransport.handle_async_request
+
+    def body_of(request):
+        try:
+            return request.content
+        except httpx.RequestNotRead: # 串流上傳 (multipart)
+            return None
+
+    def finish(request, response, raw, started, t0):
+        # 以已讀取的原始內容重建回應 (解壓縮仍依原始標頭處理)
+        copy = httpx.Response(response.status_code, headers=response.headers, content=raw,
+                              request=request, extensions=response.extensions)
+        body = copy.read()
+        recorder.record(request.method, request.url, request.headers.get("content-type"), body_of(request),
+                        response.status_code, response.headers.get("content-type"), body,
+                        started, time.perf_counter() - t0)
+        return copy
+
+    def handle_request(self, request):
+        started, t0 = time.time(), time.perf_counter()
+        response = sync_send(self, request)
+        try:
+            raw = b"".join(response.iter_raw())
+        finally:
+            response.close()
+        return finish(request, response, raw, started, t0)
+
+    async def handle_async_request(self, request):
+        started, t0 = time.time(), time.perf_counter()
+        response = await async_send(self, request)
+        try:
+            raw = b"".join([chunk async for chunk in response.aiter_raw()])
+        finally:
+            await response.aclose()
+        return finish(request, response, raw, started, t0)
+
+    httpx.HTTPTransport.handle_request = handle_request
+    httpx.AsyncHTTPTransport.handle_async_request = handle_async_request
+
+
+def _patch_requests(recorder):
+    import requests.adapters
+
+    send = requests.adapters.HTTPAdapter.send
+
+    def patched_send(self, request, **kwargs):
+        started, t0 = time.time(), time.perf_counter()
+        response = send(self, request, **kwargs)
+        body = request.body if isinstance(request.body, (str, bytes)) else None
+        recorder.record(request.method, request.url, request.headers.get("Content-Type"), body,
+                        response.status_code, response.headers.get("Content-Type"), response.content,
+                        started, time.perf_counter() - t0)
+        return response
+
+    requests.adapters.HTTPAdapter.send = patched_send
+
+
+_recorder = None
+
+
+def install_recorder(path):
+    """開始錄製本行程所有 httpx / requests 請求 (重複呼叫時沿用既有的錄製器)"""
+    global _recorder
+    if _recorder is None:
+        _recorder = HttpRecorder(path)
+        _recorder.start()
+        _patch_httpx(_recorder)
+        _patch_requests(_recorder)
+    return _recorder
+
+
+class ReplayArchive:
+    """
+    讀取封存檔並依請求找出錄製的回應
+    比對順序: 方法 + 路徑 + 查詢參數 + 請求內容 -> 不含請求內容 -> 不含日期參數
+    同一個鍵錄到多次時依錄製順序輪流回應 (例如盤中多次查詢同一檔報價)，用完後重複最後一筆
+    """
+    def __init__(self, path):
+        self.path = path
+        self.bodies = {}
+        self.exchanges = []
+        self.sessions = []
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break # 錄製中斷時最後一行可能不完整
+                if entry["type"] == "body":
+                    self.bodies[entry["sha"]] = entry["text"].encode("utf-8") if "text" in entry else base64.b64decode(entry["b64"])
+                elif entry["type"] == "exchange":
+                    entry["query"] = tuple(tuple(item) for item in entry["query"])
+                    entry["session"] = len(self.sessions) - 1
+                    self.exchanges.append(entry)
+                elif entry["type"] == "session":
+                    self.sessions.append(datetime.fromisoformat(entry["started_at"]))
+        self._index = {}
+        for exchange in self.exchanges:
+            for key in self._keys(exchange["method"], exchange["path"], exchange["query"], exchange["req"]):
+                self._index.setdefault(key, []).append(exchange)
+        self._cursors = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _keys(method, path, query, req):
+        loose = tuple(item for item in query if item[0] not in DATE_PARAMS)
+        return [("exact", method, path, query, req), ("any_body", method, path, query), ("any_date", method, path, loose)]
+
+    def recorded_at(self, exchange):
+        """錄製當時的台北時間"""
+        return self.sessions[exchange["session"]] + timedelta(seconds=exchange["t"])
+
+    def lookup(self, method, path, query, req):
+        """回傳 (exchange, 比對層級)，找不到時回傳 (None, None)"""
+        with self._lock:
+            for key in self._keys(method, path, query, req):
+                candidates = self._index.get(key)
+                if candidates:
+                    cursor = self._cursors.get(key, 0)
+                    self._cursors[key] = cursor + 1
+                    return candidates[min(cursor, len(candidates) - 1)], key[0]
+        return None, None
+
+    def rewind(self):
+        with self._lock:
+            self._cursors.clear()
+
+    def summary(self):
+        counts = {}
+        for exchange in self.exchanges:
+            # 以代碼或頁面 ID 結尾的路徑合併計算
+            path = exchange['path']
+            if re.search(r"\d", path.rsplit("/", 1)[-1]):
+                path = path.rsplit("/", 1)[0] + "/*"
+            name = f"{exchange['method']} {path}"
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True # 標頭與內容分兩次寫出，避免 Nagle 與延遲 ACK 造成每個請求多 40ms
+    archive = None
+    speed = 1.0
+    stats = None
+    stats_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type or "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._dispatch()
+
+    def do_POST(self):
+        self._dispatch()
+
+    def do_PATCH(self):
+        self._dispatch()
+
+    def _count(self, table, name):
+        with self.stats_lock:
+            self.stats[table][name] = self.stats[table].get(name, 0) + 1
+
+    def _dispatch(self):
+        parts = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if parts.path.startswith("/_bench/"):
+            # 與 tests/fake_providers.py 相同的統計介面 (設定請求會讓輪流回應的順序從頭開始)
+            if self.command == "POST":
+                self.archive.rewind()
+            with self.stats_lock:
+                payload = json.dumps(self.stats).encode("utf-8")
+            self._send(200, payload)
+            return
+
+        path = normalize_path(parts.path)
+        provider = path.strip("/").split("/")[0]
+        self._count("requests", provider)
+        exchange, level = self.archive.lookup(self.command, path, normalize_query(parts.query),
+                                              request_key(self.headers.get("Content-Type"), body))
+        if exchange is None:
+            # 未錄製的請求以錯誤計 (benchmark 報表中顯示為錯誤數)
+            self._count("errors", provider)
+            self._send(404, json.dumps({"msg": "not recorded", "path": path}).encode("utf-8"))
+            return
+        self._count("matched", level)
+        if self.speed > 0:
+            time.sleep(exchange["elapsed"] / self.speed)
+        self._send(exchange["status"], self.archive.bodies.get(exchange["body"], b""), exchange["content_type"])
+
+
+class _ReplayServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 512
+
+
+def serve_replay(path, port, speed=1.0, ready=None):
+    """
+    啟動重播服務 (阻塞)
+    speed: 1 為原始延遲，2 為兩倍速，0 為不延遲；ready 為 multiprocessing.Event 時於開始接受連線後設定
+    """
+    _ReplayHandler.archive = ReplayArchive(path)
+    _ReplayHandler.speed = speed
+    _ReplayHandler.stats = {"requests": {}, "errors": {}, "matched": {}}
+    server = _ReplayServer(("127.0.0.1", port), _ReplayHandler)
+    if ready is not None:
+        ready.set()
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP 錄製檔重播")
+    sub = parser.add_subparsers(dest="command", required=True)
+    replay = sub.add_parser("replay", help="啟動本機重播服務")
+    replay.add_argument("archive")
+    replay.add_argument("--port", type=int, default=8765)
+    replay.add_argument("--speed", type=float, default=1.0, help="延遲倍速 (1 原始、0 不延遲)")
+    info = sub.add_parser("info", help="列出封存檔內容")
+    info.add_argument("archive")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        archive = ReplayArchive(args.archive)
+        print(f"{args.archive}: {len(archive.sessions)} 個 session，{len(archive.exchanges)} 筆請求，"
+              f"{len(archive.bodies)} 份不重複回應")
+        for name, count in sorted(archive.summary().items(), key=lambda item: -item[1]):
+            print(f"  {count:>6}  {name}")
+    else:
+        print(f"重播服務啟動: http://127.0.0.1:{args.port} (速度 {args.speed}x)")
+        sys.exit(serve_replay(args.archive, args.port, args.speed))
@@ -0,0 +1,284 @@
+import time
+import numpy as np
+
+from metrics import metrics
+
+# 批次技術指標：所有函式的輸入為 (標的數 × 天數) 矩陣，沿 axis=1 (時間) 一次計算整份監控清單
+# 各標的歷史長度不同時向右對齊 (最新一根 K 棒在最後一欄)，左側以 NaN 補齊
+
+
+def align_right(series_list, length=None):
+    """將長度不一的序列向右對齊為矩陣，左側補 NaN"""
+    length = length or max((len(s) for s in series_list), default=0)
+    matrix = np.full((len(series_list), length), np.nan)
+    for row, series in enumerate(series_list):
+        n = min(len(series), length)
+        if n:
+            matrix[row, length - n:] = series[len(series) - n:]
+    return matrix
+
+
+def _rolling_sum(matrix, window):
+    """回傳 (視窗和, 視窗內有效值個數)，前 window-1 欄為 NaN"""
+    values = np.nan_to_num(matrix)
+    counts = (~np.isnan(matrix)).astype(np.float64)
+    pad = np.zeros((matrix.shape[0], 1))
+    csum = np.cumsum(np.hstack([pad, values]), axis=1)
+    ccount = np.cumsum(np.hstack([pad, counts]), axis=1)
+    sums = np.full(matrix.shape, np.nan)
+    valid = np.full(matrix.shape, 0.0)
+    if matrix.shape[1] >= window:
+        sums[:, window - 1:] = csum[:, window:] - csum[:, :-window]
+        valid[:, window - 1:] = ccount[:, window:] - ccount[:, :-window]
+    return sums, valid
+
+
+def sma(matrix, window):
+    """簡單移動平均 (視窗內有缺值時為 NaN)"""
+    sums, valid = _rolling_sum(matrix, window)
+    return np.where(valid == window, sums / window, np.nan)
+
+
+def rolling_std(matrix, window):
+    """移動標準差 (母體標準差，與布林通道慣例相同)"""
+    mean = sma(matrix, window)
+    sq_sums, valid = _rolling_sum(matrix * matrix, window)
+    var = np.where(valid == window, sq_sums / window - mean * mean, np.nan)
+    return np.sqrt(np.maximum(var, 0.0))
+
+
+def _smooth(matrix, alpha):
+    """
+    指數平滑 (各列自第一個有效值開始)，以欄為單位迭代、各列同時計算
+    左側全為 NaN 的補齊欄直接略過
+    """
+    out = np.full(matrix.shape, np.nan)
+    prev = np.full(matrix.shape[0], np.nan)
+    filled = np.flatnonzero(~np.isnan(matrix).all(axis=0))
+    for col in range(filled[0] if len(filled) else matrix.shape[1], matrix.shape[1]):
+        x = matrix[:, col]
+        started = ~np.isnan(prev)
+        prev = np.where(started, np.where(np.isnan(x), prev, alpha * x + (1 - alpha) * prev), x)
+        out[:, col] = prev
+    return out
+
+
+def ema(matrix, span):
+    """指數移動平均 (alpha = 2 / (span + 1))"""
+    return _smooth(matrix, 2.0 / (span + 1))
+
+
+def rsi(close, period=14):
+    """相對強弱指標 (Wilder 平滑)，前 period 欄為 NaN"""
+    diff = np.diff(close, axis=1, prepend=np.nan)
+    gain = np.where(diff > 0, diff, np.where(np.isnan(diff), np.nan, 0.0))
+    loss = np.where(diff < 0, -diff, np.where(np.isnan(diff), np.nan, 0.0))
+    avg_gain = _smooth(gain, 1.0 / period)
+    avg_loss = _smooth(loss, 1.0 / period)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rs = avg_gain / avg_loss
+        result = np.where(avg_loss == 0, 100.0, 100.0 - 100.0 / (1.0 + rs))
+    # 樣本不足 period 筆時不輸出
+    _, valid = _rolling_sum(diff, period)
+    return np.where(valid == period, result, np.nan)
+
+
+def macd(close, fast=12, slow=26, signal=9):
+    """回傳 (MACD 線, 訊號線, 柱狀體)"""
+    line = ema(close, fast) - ema(close, slow)
+    signal_line = ema(line, signal)
+    return line, signal_line, line - signal_line
+
+
+def bollinger(close, window=20, k=2.0):
+    """回傳 (上軌, 中軌, 下軌)"""
+    mid = sma(close, window)
+    std = rolling_std(close, window)
+    return mid + k * std, mid, mid - k * std
+
+
+def atr(high, low, close, period=14):
+    """平均真實區間 (Wilder 平滑)"""
+    prev_close = np.roll(close, 1, axis=1)
+    prev_close[:, 0] = np.nan
+    tr = np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+    result = _smooth(tr, 1.0 / period)
+    _, valid = _rolling_sum(tr, period)
+    return np.where(valid == period, result, np.nan)
+
+
+def rolling_max(matrix, window):
+    """N 日最高 (視窗內有缺值時為 NaN)"""
+    return _rolling_extreme(matrix, window, np.max)
+
+
+def rolling_min(matrix, window):
+    """N 日最低 (視窗內有缺值時為 NaN)"""
+    return _rolling_extreme(matrix, window, np.min)
+
+
+def _rolling_extreme(matrix, window, func):
+    out = np.full(matrix.shape, np.nan)
+    if matrix.shape[1] >= window:
+        windows = np.lib.stride_tricks.sliding_window_view(matrix, window, axis=1)
+        # 含 NaN 的視窗結果自然為 NaN
+        out[:, window - 1:] = func(windows, axis=2)
+    return out
+
+
+class IndicatorSet:
+    """
+    一次批次計算的結果：各指標為 (標的數 × 天數) 矩陣，與輸入歷史同樣向右對齊
+    可附加同寬度的其他批次結果 (列容量不足時倍增)，已有的列位置不變
+    每列記錄計算時的歷史版本 (最後日期、抓取時間)，歷史更新後可判斷該列已過期
+    """
+    # latest() 輸出的欄位
+    FIELDS = ("ma5", "ma20", "ma60", "ema12", "ema26", "rsi14", "macd", "macd_signal", "macd_hist",
+              "bb_upper", "bb_mid", "bb_lower", "atr14", "high20", "low20")
+
+    def __init__(self, symbols, lengths, series, versions=None):
+        self.symbols = list(symbols)
+        self.index = {symbol: row for row, symbol in enumerate(self.symbols)}
+        self.lengths = list(lengths) # 各標的參與計算的歷史長度
+        self.versions = list(versions) if versions is not None else [None] * len(self.symbols)
+        self.series = series         # 格式: {name: ndarray}，列數可能多於標的數 (預留容量)
+        self.created_at = time.time()
+
+    def __contains__(self, symbol):
+        return symbol in self.index
+
+    def is_current(self, record):
+        """該標的的計算結果是否對應這份歷史 (最後日期與抓取時間皆相同)"""
+        row = self.index.get(record.symbol)
+        return row is not None and self.versions[row] == record_version(record)
+
+    def extend(self, other):
+        """附加另一批同寬度的計算結果 (已存在的標的就地覆寫為新結果)"""
+        rows = []
+        for row, symbol in enumerate(other.symbols):
+            own = self.index.get(symbol)
+            if own is None:
+                rows.append(row)
+                continue
+            for name, matrix in self.series.items():
+                matrix[own] = other.series[name][row]
+            self.lengths[own] = other.lengths[row]
+            self.versions[own] = other.versions[row]
+        if not rows:
+            return
+        needed = len(self.symbols) + len(rows)
+        capacity = self.series["ma5"].shape[0]
+        if needed > capacity:
+            capacity = max(needed, capacity * 2)
+            for name, matrix in self.series.items():
+                grown = np.full((capacity, matrix.shape[1]), np.nan)
+                grown[:len(self.symbols)] = matrix[:len(self.symbols)]
+                self.series[name] = grown
+        start = len(self.symbols)
+        for name, matrix in self.series.items():
+            matrix[start:needed] = other.series[name][rows]
+        for row in rows:
+            self.index[other.symbols[row]] = len(self.symbols)
+            self.symbols.append(other.symbols[row])
+            self.lengths.append(other.lengths[row])
+            self.versions.append(other.versions[row])
+
+    def values(self, symbol, name, last=None):
+        """指定標的、指標的序列 (僅含該標的實際歷史長度，last 指定時只取最後幾筆)"""
+        row = self.index[symbol]
+        length = self.lengths[row]
+        if last is not None:
+            length = min(length, last)
+        return self.series[name][row, self.series[name].shape[1] - length:]
+
+    def latest(self, symbol):
+        """指定標的最新一根 K 棒的所有指標 (缺值為 None)，無此標的時回傳 None"""
+        row = self.index.get(symbol)
+        if row is None:
+            return None
+        result = {}
+        for name in self.FIELDS:
+            value = self.series[name][row, -1]
+            result[name] = None if np.isnan(value) else round(float(value), 2)
+        return result
+
+
+def record_version(record):
+    """歷史紀錄的版本識別：(最後日期, 抓取時間)，新增 K 棒或重新抓取後即不同"""
+    last = record.dates[-1] if len(record) else None
+    return last, record.fetched_at
+
+
+def compute_indicators(records, window=None):
+    """
+    對多檔標的的 HistoryRecord 一次計算所有指標
+    window: 每檔只取最後 window 根 K 棒 (矩陣寬度固定為 window)；未指定時取最長的歷史
+    回傳: IndicatorSet
+    """
+    symbols = [r.symbol for r in records]
+    lengths = [min(len(r), window) if window else len(r) for r in records]
+    close = align_right([r.close for r in records], window)
+    high = align_right([r.high for r in records], close.shape[1])
+    low = align_right([r.low for r in records], close.shape[1])
+
+    macd_line, macd_signal, macd_hist = macd(close)
+    bb_upper, bb_mid, bb_lower = bollinger(close)
+    series = {
+        "ma5": sma(close, 5),
+        "ma20": bb_mid,
+        "ma60": sma(close, 60),
+        "ema12": ema(close, 12),
+        "ema26": ema(close, 26),
+        "rsi14": rsi(close, 14),
+        "macd": macd_line,
+        "macd_signal": macd_signal,
+        "macd_hist": macd_hist,
+        "bb_upper": bb_upper,
+        "bb_mid": bb_mid,
+        "bb_lower": bb_lower,
+        "atr14": atr(high, low, close, 14),
+        "high20": rolling_max(high, 20),
+        "low20": rolling_min(low, 20),
+    }
+    return IndicatorSet(symbols, lengths, series, [record_version(r) for r in records])
+
+
+class IndicatorEngine:
+    """
+    共用的指標計算結果 (每個交易日建立一份)，所有報告、查詢與警報共用
+    - 每檔只取最後 window 根 K 棒，矩陣寬度固定 (長週期 K 線圖載入的長歷史不會拉寬整份矩陣)
+    - 同一交易日內只為尚未計算或歷史已更新 (最後日期、抓取時間改變) 的標的補算，其他標的沿用既有結果
+    """
+    def __init__(self, history_store, window=120):
+        self.history = history_store
+        self.window = window
+        self._result = None
+        self._day = None
+
+    def get(self, trading_day, symbols=None):
+        """
+        回傳 IndicatorSet
+        trading_day: 交易日 (YYYY-MM-DD)，換日時重新計算
+        symbols: 需要涵蓋的標的 (缺少者須先載入歷史快取)；未指定時涵蓋歷史快取中所有標的
+        """
+        if self._day != trading_day:
+            self._result = None
+            self._day = trading_day
+        wanted = set(symbols) if symbols else None
+        missing = [
+            record for record in self.history.records()
+            if (wanted is None or record.symbol in wanted)
+            and (self._result is None or not self._result.is_current(record))
+        ]
+        metrics.cache("indicators", not missing)
+        if missing:
+            batch = compute_indicators(missing, self.window)
+            if self._result is None:
+                self._result = batch
+            else:
+                self._result.extend(batch)
+        if self._result is None:
+            return None
+        if symbols and any(symbol not in self._result for symbol in symbols):
+            return None
+        return self._result
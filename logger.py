@@ -0,0 +1,123 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+from metrics import metrics
+
+# 結構化日誌 (取代高頻路徑上的 print)；各模組以 logging.getLogger(__name__) 取得 logger
+# - 呼叫端只把 LogRecord 放進佇列 (不格式化、不寫出)，由背景執行緒格式化並寫入 stdout / LOG_FILE
+#   訊息一律使用 %s 參數 (logger.debug("... %s", data))，層級關閉時不會產生字串，原始資料傾印亦無成本
+# - 佇列滿時直接捨棄並計數 (log_dropped_total)，不會阻塞事件迴圈
+# - 逐檔標的的 debug / info 訊息 (extra={"symbol": ...}) 依 LOG_SAMPLE_RATE 抽樣，LOG_SYMBOLS 列出的代碼一律保留
+# - LOG_FORMAT=json 時每行輸出一筆 JSON (含 symbol 等 extra 欄位)，否則為一般文字
+# 環境變數: LOG_LEVEL (預設 INFO)、LOG_FORMAT (text / json)、LOG_FILE、LOG_QUEUE_SIZE、LOG_SAMPLE_RATE、LOG_SYMBOLS
+
+# LogRecord 的標準屬性 (其餘為 extra 欄位)
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener = None
+
+
+class SymbolSampler(logging.Filter):
+    """逐檔標的的低層級訊息抽樣 (warning 以上與未帶 symbol 的訊息不受影響)"""
+    def __init__(self, rate, always=()):
+        super().__init__()
+        self.rate = rate
+        self.always = {s.upper() for s in always}
+
+    def filter(self, record):
+        symbol = getattr(record, "symbol", None)
+        if symbol is None or record.levelno >= logging.WARNING or self.rate >= 1:
+            return True
+        if str(symbol).upper() in self.always:
+            return True
+        return random.random() < self.rate
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """
+    只排入 LogRecord：格式化延後到背景執行緒 (標準 QueueHandler 會在呼叫端先格式化)
+    參數物件在寫出前被修改時，輸出的是修改後的內容
+    """
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("log_dropped_total")
+
+
+class StructuredFormatter(logging.Formatter):
+    """json_lines=True 時輸出單行 JSON；文字格式時將 symbol 附在 logger 名稱後、其餘 extra 欄位以 key=value 附在最後"""
+    def __init__(self, json_lines=False):
+        super().__init__()
+        self.json_lines = json_lines
+
+    def format(self, record):
+        message = record.getMessage()
+        extra = {k: v for k, v in vars(record).items() if k not in _RECORD_FIELDS}
+        if record.exc_info:
+            message += "\n" + self.formatException(record.exc_info)
+        if self.json_lines:
+            entry = {"ts": round(record.created, 3), "level": record.levelname.lower(),
+                     "logger": record.name, "msg": message}
+            entry.update(extra)
+            return json.dumps(entry, ensure_ascii=False, default=str)
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.created))
+        fields = "".join(f" {k}={v}" for k, v in extra.items() if k != "symbol")
+        symbol = f" [{extra['symbol']}]" if "symbol" in extra else ""
+        return f"{stamp} {record.levelname:<7} {record.name}{symbol} {message}{fields}"
+
+
+def setup_logging(level=None, stream=None):
+    """
+    設定根 logger (重複呼叫時以新設定取代)
+    stream: 輸出目標 (預設 stdout；效能測試可導向 /dev/null 以保留格式化與寫出成本)
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+    level = level or os.getenv("LOG_LEVEL", "INFO").upper()
+    formatter = StructuredFormatter(json_lines=os.getenv("LOG_FORMAT", "text").lower() == "json")
+
+    outputs = [logging.StreamHandler(stream or sys.stdout)]
+    if os.getenv("LOG_FILE"):
+        outputs.append(logging.FileHandler(os.getenv("LOG_FILE"), encoding="utf-8"))
+    for handler in outputs:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", 10000)))
+    handler = _NonBlockingQueueHandler(log_queue)
+    symbols = [s for s in os.getenv("LOG_SYMBOLS", "").split(",") if s.strip()]
+    handler.addFilter(SymbolSampler(float(os.getenv("LOG_SAMPLE_RATE", 0.1)), [s.strip() for s in symbols]))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    # 第三方套件的逐請求訊息 (httpx 每個請求一行 info) 只保留警告
+    for name in ("httpx", "httpcore", "telegram"):
+        logging.getLogger(name).setLevel(max(logging.WARNING, root.level))
+
+    _listener = QueueListener(log_queue, *outputs, respect_handler_level=True)
+    _listener.start()
+    metrics.gauge("log_queue_depth", log_queue.qsize)
+    return root
+
+
+@atexit.register
+def shutdown_logging():
+    """寫出佇列中剩餘的訊息 (程式結束時自動呼叫)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,174 @@
+import os
+import asyncio
+import logging
+from datetime import date, timedelta
+import numpy as np
+
+from indicators import sma, rolling_max, rolling_min
+
+log = logging.getLogger(__name__)
+
+
+class MarketScanner:
+    """
+    盤後全市場掃描
+    - 每個交易日以單一請求取得全市場日 K (FinMind TaiwanStockPrice 不指定代碼)，寫入本地資料庫
+    - 於 (標的數 × 交易日) 矩陣上一次向量化計算各篩選條件
+    """
+    # 篩選條件: 名稱 -> 說明
+    SCREENS = {
+        "high20": "創 20 日新高",
+        "low20": "創 20 日新低",
+        "ma20_breakout": "突破 MA20",
+        "ma20_breakdown": "跌破 MA20",
+        "volume_surge": "爆量 (> 20 日均量 2 倍)",
+    }
+
+    def __init__(self, fetcher, db=None, calendar=None):
+        self.fetcher = fetcher
+        self.db = db or fetcher.history_db
+        self.calendar = calendar
+        # 掃描所需的交易日數 (20 日條件需前 20 日 + 當日)
+        self.lookback = int(os.getenv("SCAN_LOOKBACK_DAYS", 30))
+        self.concurrency = int(os.getenv("SCAN_CONCURRENCY", 4))
+        # 成交量門檻 (股)，過濾流動性過低的標的
+        self.min_volume = float(os.getenv("SCAN_MIN_VOLUME", 500000))
+
+    def is_trading_day(self, d):
+        return self.calendar.is_trading_day("TW", d) if self.calendar else d.weekday() < 5
+
+    def trading_days(self, count):
+        """由今日往前的 count 個台股交易日 (由舊到新)"""
+        d = self.fetcher._get_taipei_now().date()
+        days = []
+        for _ in range(count * 3):
+            if self.is_trading_day(d):
+                days.append(d.strftime("%Y-%m-%d"))
+                if len(days) == count:
+                    break
+            d -= timedelta(days=1)
+        return sorted(days)
+
+    async def load_date(self, date_str):
+        """以單一整批請求載入指定交易日的全市場日 K，回傳寫入筆數"""
+        df = await self.fetcher.async_client.taiwan_stock_daily(None, date_str, date_str)
+        rows = []
+        if df is not None and not df.empty:
+            columns = {c.lower(): c for c in df.columns}
+            get = lambda name: df[columns[name]].tolist() if name in columns else [None] * len(df)
+            rows = list(zip(
+                df[columns['stock_id']].astype(str).tolist(), [date_str] * len(df),
+                get('open'), get('max'), get('min'), get('close'), get('trading_volume')
+            ))
+        # 取得資料、或行事曆確認為休市日時才記錄為已載入；交易日的空回應 (如今日資料尚未發布) 下次重新請求
+        loaded = date_str if rows or not self.is_trading_day(date.fromisoformat(date_str)) else None
+        if loaded is None:
+            log.info("%s 全市場日 K 尚無資料，下次重新載入", date_str)
+        return await asyncio.to_thread(self.db.upsert_rows, rows, loaded)
+
+    async def sync(self, days=None):
+        """補齊最近 days 個交易日中尚未載入的日期 (並行數受 SCAN_CONCURRENCY 限制)"""
+        wanted = self.trading_days(days or self.lookback)
+        loaded = await asyncio.to_thread(self.db.loaded_dates)
+        missing = [d for d in wanted if d not in loaded]
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def load(date_str):
+            async with semaphore:
+                try:
+                    count = await self.load_date(date_str)
+                    log.info("📥 已載入 %s 全市場日 K (%s 筆)", date_str, count)
+                    return count
+                except Exception as e:
+                    log.warning("載入 %s 全市場日 K 失敗: %s", date_str, e)
+                    return 0
+
+        counts = await asyncio.gather(*(load(d) for d in missing))
+        return dict(zip(missing, counts))
+
+    def _universe_mask(self, symbols):
+        """只保留一般股票 (4 碼代碼，代碼主檔中為上市或上櫃)"""
+        master = self.fetcher.symbol_master
+        mask = np.array([len(s) == 4 and s.isdigit() for s in symbols])
+        if master:
+            mask &= np.array([master.get(s, {}).get('type') in ("twse", "tpex") for s in symbols])
+        return mask
+
+    def run_screens(self, data, screens=None):
+        """
+        於全市場矩陣上計算篩選條件 (全部向量化)
+        回傳: {screen: bool ndarray (每檔標的是否符合)}
+        """
+        close, high, low, volume = data['close'], data['high'], data['low'], data['volume']
+        last, prev = close[:, -1], close[:, -2]
+        ma20 = sma(close, 20)
+        prev_high20 = rolling_max(high, 20)[:, -2]
+        prev_low20 = rolling_min(low, 20)[:, -2]
+        avg_volume = sma(volume, 20)[:, -2]
+
+        with np.errstate(invalid="ignore"):
+            results = {
+                "high20": high[:, -1] > prev_high20,
+                "low20": low[:, -1] < prev_low20,
+                "ma20_breakout": (last > ma20[:, -1]) & (prev <= ma20[:, -2]),
+                "ma20_breakdown": (last < ma20[:, -1]) & (prev >= ma20[:, -2]),
+                "volume_surge": volume[:, -1] > avg_volume * 2,
+            }
+            liquid = volume[:, -1] >= self.min_volume
+        base = self._universe_mask(data['symbols']) & liquid & ~np.isnan(last)
+        return {name: hits & base for name, hits in results.items() if not screens or name in screens}
+
+    async def scan(self, screens=None):
+        """
+        載入缺少的交易日後執行掃描
+        回傳: {"date": str, "universe": int, "hits": {screen: [dict]}} 或 None
+        """
+        await self.sync()
+        await asyncio.to_thread(self.fetcher.get_symbol_master)
+        data = await asyncio.to_thread(self.db.load_matrix, self.lookback)
+        if not data or len(data['dates']) < 21:
+            log.warning("本地歷史資料不足 21 個交易日，無法掃描。")
+            return None
+
+        masks = self.run_screens(data, screens)
+        close = data['close']
+        with np.errstate(divide="ignore", invalid="ignore"):
+            change_pct = (close[:, -1] - close[:, -2]) / close[:, -2] * 100
+        master = self.fetcher.symbol_master
+        hits = {}
+        for name, mask in masks.items():
+            rows = np.flatnonzero(mask)
+            # 依漲跌幅排序 (跌勢條件由跌幅最大者開始)
+            descending = name not in ("low20", "ma20_breakdown")
+            rows = rows[np.argsort(-change_pct[rows] if descending else change_pct[rows], kind="stable")]
+            hits[name] = [
+                {
+                    "symbol": data['symbols'][i],
+                    "name": master.get(data['symbols'][i], {}).get('name', ""),
+                    "close": round(float(close[i, -1]), 2),
+                    "change_pct": round(float(change_pct[i]), 2),
+                    "volume": int(data['volume'][i, -1]),
+                }
+                for i in rows
+            ]
+        return {
+            "date": data['dates'][-1],
+            "universe": int(self._universe_mask(data['symbols']).sum()),
+            "hits": hits,
+        }
+
+    def format_report(self, result, limit=15):
+        """掃描結果文字報告 (每個條件最多列出 limit 檔)"""
+        if not result:
+            return "全市場掃描失敗或本地資料不足。"
+        lines = [f"🔎 **全市場掃描** (`{result['date']}`，共 {result['universe']} 檔)\n"]
+        for name, rows in result['hits'].items():
+            lines.append(f"**{self.SCREENS[name]}**：{len(rows)} 檔")
+            for row in rows[:limit]:
+                emoji = "🔴" if row['change_pct'] > 0 else "🟢" if row['change_pct'] < 0 else "⚪"
+                label = f"{row['name']} ({row['symbol']})" if row['name'] else row['symbol']
+                lines.append(f"  • {label} `{row['close']}` {emoji} {row['change_pct']}%")
+            if len(rows) > limit:
+                lines.append(f"  …其餘 {len(rows) - limit} 檔")
+            lines.append("")
+        return "\n".join(lines).strip()
@@ -0,0 +1,248 @@
+import os
+import json
+import logging
+from functools import lru_cache
+from datetime import date, datetime, time as dt_time, timedelta
+from zoneinfo import ZoneInfo
+
+log = logging.getLogger(__name__)
+
+# 各市場交易時段 (交易所當地時間)，結束時間早於開始時間者為跨日時段
+MARKETS = {
+    "TW": {
+        "tz": "Asia/Taipei",
+        "sessions": {
+            # 13:25-13:30 為收盤集合競價，多保留 5 分鐘以取得收盤價
+            "regular": (dt_time(9, 0), dt_time(13, 35)),
+            "after_hours": (dt_time(14, 0), dt_time(14, 30)), # 盤後定價交易
+        },
+    },
+    "TAIFEX": {
+        "tz": "Asia/Taipei",
+        "sessions": {
+            "regular": (dt_time(8, 45), dt_time(13, 45)),
+            "night": (dt_time(15, 0), dt_time(5, 0)), # 夜盤至次日 05:00
+        },
+    },
+    "US": {
+        "tz": "America/New_York",
+        "sessions": {
+            "pre_market": (dt_time(4, 0), dt_time(9, 30)),
+            "regular": (dt_time(9, 30), dt_time(16, 0)),
+            "after_hours": (dt_time(16, 0), dt_time(20, 0)),
+        },
+    },
+}
+
+# 期交所依證交所行事曆休市
+CALENDAR_ALIASES = {"TAIFEX": "TW"}
+
+
+def _nth_weekday(year, month, weekday, n):
+    """當月第 n 個星期 weekday (n=-1 為最後一個)"""
+    if n > 0:
+        d = date(year, month, 1)
+        d += timedelta(days=(weekday - d.weekday()) % 7)
+        return d + timedelta(weeks=n - 1)
+    last = date(year + (month == 12), month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _easter(year):
+    """復活節日期 (Anonymous Gregorian algorithm)"""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def _observed(d):
+    """週六的假日提前至週五，週日的假日延後至週一"""
+    if d.weekday() == 5:
+        return d - timedelta(days=1)
+    if d.weekday() == 6:
+        return d + timedelta(days=1)
+    return d
+
+
+@lru_cache(maxsize=None)
+def us_holidays(year):
+    """紐約證交所 (NYSE) 固定規則休市日"""
+    holidays = {
+        _nth_weekday(year, 1, 0, 3),   # Martin Luther King Jr. Day
+        _nth_weekday(year, 2, 0, 3),   # Presidents' Day
+        _easter(year) - timedelta(days=2), # Good Friday
+        _nth_weekday(year, 5, 0, -1),  # Memorial Day
+        _observed(date(year, 7, 4)),   # Independence Day
+        _nth_weekday(year, 9, 0, 1),   # Labor Day
+        _nth_weekday(year, 11, 3, 4),  # Thanksgiving
+        _observed(date(year, 12, 25)), # Christmas
+    }
+    # 元旦落在週六時不提前至前一年 12/31
+    new_year = date(year, 1, 1)
+    if new_year.weekday() != 5:
+        holidays.add(_observed(new_year))
+    if year >= 2022:
+        holidays.add(_observed(date(year, 6, 19))) # Juneteenth
+    return frozenset(holidays)
+
+
+@lru_cache(maxsize=None)
+def us_early_closes(year):
+    """NYSE 提前於 13:00 收盤的交易日"""
+    holidays = us_holidays(year)
+    days = {
+        date(year, 7, 3),
+        _nth_weekday(year, 11, 3, 4) + timedelta(days=1), # 感恩節隔天
+        date(year, 12, 24),
+    }
+    return {d: dt_time(13, 0) for d in days if d.weekday() < 5 and d not in holidays}
+
+
+class MarketCalendar:
+    """
+    以交易所時區 (zoneinfo) 與交易時段定義判斷各市場是否開盤
+    - 美股休市日與半日市依 NYSE 規則計算，自動處理夏令時間
+    - 台股休市日與半日市 (每年由證交所公告) 由行事曆檔案提供:
+      {"TW": {"holidays": ["2026-02-16", ...], "half_days": {"2026-xx-xx": "12:00"}}}
+    """
+    def __init__(self, calendar_file=None):
+        self.calendar_file = calendar_file or os.getenv("MARKET_CALENDAR_FILE", "market_calendar.json")
+        self.holidays = {}  # 格式: {market: set(date)}
+        self.half_days = {} # 格式: {market: {date: 收盤時間}}
+        self.years = {}     # 格式: {market: set(year)}，行事曆檔案列有休市日的年度
+        self.load_calendar()
+
+    def load_calendar(self):
+        """讀取行事曆檔案 (不存在時僅套用週末與內建規則)"""
+        if not os.path.exists(self.calendar_file):
+            log.warning("⚠️ 找不到市場行事曆 %s，台股僅排除週末 (國定假日仍視為交易日)，"
+                        "可參考 market_calendar.sample.json 建立", self.calendar_file)
+            return
+        try:
+            with open(self.calendar_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for market, conf in data.items():
+                self.holidays[market] = {date.fromisoformat(d) for d in conf.get("holidays", [])}
+                self.years[market] = {d.year for d in self.holidays[market]}
+                self.half_days[market] = {
+                    date.fromisoformat(d): dt_time.fromisoformat(t)
+                    for d, t in conf.get("half_days", {}).items()
+                }
+            log.info("✅ 已載入市場行事曆: %s", self.calendar_file)
+            if date.today().year not in self.years.get("TW", ()):
+                log.warning("⚠️ 市場行事曆 %s 未列出今年的台股休市日，請依證交所公告更新", self.calendar_file)
+        except Exception as e:
+            log.error("❌ 載入市場行事曆失敗: %s", e)
+
+    @staticmethod
+    def market_for_symbol(symbol):
+        """依代碼判斷所屬市場 (純字母且不含點為美股，TAIEX 為台股指數)"""
+        if symbol.isalpha() and "." not in symbol and symbol.upper() != "TAIEX":
+            return "US"
+        return "TW"
+
+    def tz(self, market):
+        return ZoneInfo(MARKETS[market]["tz"])
+
+    def now(self, market):
+        return datetime.now(self.tz(market))
+
+    def is_trading_day(self, market, d):
+        """指定日期 (交易所當地日期) 是否為交易日"""
+        if d.weekday() > 4:
+            return False
+        calendar = CALENDAR_ALIASES.get(market, market)
+        if d in self.holidays.get(calendar, ()):
+            return False
+        if calendar == "US" and d in us_holidays(d.year):
+            return False
+        return True
+
+    def covers(self, market, d):
+        """是否確知該日期的休市安排 (美股依規則計算；台股須行事曆檔案列有該年度的休市日)"""
+        calendar = CALENDAR_ALIASES.get(market, market)
+        return calendar == "US" or d.year in self.years.get(calendar, ())
+
+    def _close_override(self, market, d):
+        """半日市的提前收盤時間"""
+        calendar = CALENDAR_ALIASES.get(market, market)
+        if d in self.half_days.get(calendar, {}):
+            return self.half_days[calendar][d]
+        if calendar == "US":
+            return us_early_closes(d.year).get(d)
+        return None
+
+    def session_bounds(self, market, d, session):
+        """回傳交易日 d 指定時段的 (開始, 結束) aware datetime，非交易日或無此時段時回傳 None"""
+        if not self.is_trading_day(market, d):
+            return None
+        spec = MARKETS[market]["sessions"].get(session)
+        if spec is None:
+            return None
+        tz = self.tz(market)
+        start_t, end_t = spec
+        start = datetime.combine(d, start_t, tzinfo=tz)
+        end_day = d + timedelta(days=1) if end_t <= start_t else d
+        end = datetime.combine(end_day, end_t, tzinfo=tz)
+
+        # 半日市: 一般盤提前收盤，盤後時段相對順延 (如美股 13:00 收盤、盤後至 17:00)
+        early = self._close_override(market, d)
+        if early and end_day == d:
+            if session == "regular":
+                end = min(end, datetime.combine(d, early, tzinfo=tz))
+            elif start_t >= MARKETS[market]["sessions"]["regular"][1]:
+                shift = datetime.combine(d, MARKETS[market]["sessions"]["regular"][1]) - datetime.combine(d, early)
+                start, end = start - shift, end - shift
+        return start, end
+
+    def _bounds_around(self, market, moment, sessions, days_back=1, days_forward=14):
+        local_date = moment.astimezone(self.tz(market)).date()
+        for offset in range(-days_back, days_forward + 1):
+            d = local_date + timedelta(days=offset)
+            for session in sessions:
+                bounds = self.session_bounds(market, d, session)
+                if bounds:
+                    yield bounds
+
+    def is_open(self, market, now=None, sessions=("regular",)):
+        """指定市場目前是否位於任一指定時段內"""
+        now = now or self.now(market)
+        return any(start <= now < end for start, end in self._bounds_around(market, now, sessions, days_forward=0))
+
+    def next_open(self, market, now=None, sessions=("regular",)):
+        """下一次 (或目前) 開盤時間；目前已開盤時回傳 now"""
+        now = now or self.now(market)
+        candidates = []
+        for start, end in self._bounds_around(market, now, sessions):
+            if start <= now < end:
+                return now
+            if start > now:
+                candidates.append(start)
+        return min(candidates) if candidates else None
+
+    def next_close(self, market, now=None, sessions=("regular",)):
+        """下一次收盤時間 (晚於 now)"""
+        now = now or self.now(market)
+        ends = [end for _, end in self._bounds_around(market, now, sessions) if end > now]
+        return min(ends) if ends else None
+
+    def next_trading_day_start(self, market, now=None):
+        """下一個交易日的當地 00:00 (今日為交易日且尚未結束時回傳 now)"""
+        now = now or self.now(market)
+        tz = self.tz(market)
+        local = now.astimezone(tz)
+        if self.is_trading_day(market, local.date()):
+            return now
+        for days in range(1, 15):
+            d = local.date() + timedelta(days=days)
+            if self.is_trading_day(market, d):
+                return datetime.combine(d, dt_time(0, 0), tzinfo=tz)
+        return None
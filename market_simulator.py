@@ -0,0 +1,345 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import contextlib
+
+import numpy as np
+
+from metrics import metrics
+from logger import setup_logging
+from tracing import tracer
+
+# 模擬行情：以合成報價對警報路徑做負載測試 (例如 5000 檔、每秒一個 tick)
+# - 報價來源: 幾何隨機漫步 (random)，或以本地歷史資料庫的日收盤價內插後重播 (replay)
+# - 每個 tick 將所有標的的報價寫入價格快取 (QuoteStore)，再呼叫 check_once，
+#   與正式報價相同地經過警戒值判斷、Notion 寫入佇列與 Telegram 警報佇列
+# - Notion 與 Telegram 以可設定延遲的程式內替身取代 (不發出網路請求)
+# - 回報每秒處理檔數、檢查週期耗時、tick 延誤，兩個佇列的積壓量與積壓成長速率，
+#   以及警報追蹤的端到端延遲 (tick 寫入價格快取 → 訊息送達)
+#
+# 用法: python market_simulator.py --symbols 5000 --tick 1 --duration 60 --threshold-density 0.05
+
+
+def simulated_symbols(count):
+    """模擬用代碼 (6 碼數字，視為台股)"""
+    return [str(100000 + i) for i in range(count)]
+
+
+class RandomWalkSource:
+    """幾何隨機漫步：每個 tick 價格乘上 exp(volatility × 標準常態亂數)，四捨五入至 0.01"""
+    def __init__(self, symbols, volatility, seed=0):
+        self.symbols = list(symbols)
+        self.volatility = volatility
+        self.rng = np.random.default_rng(seed)
+        self._prices = self.rng.uniform(20, 600, len(self.symbols))
+
+    def step(self):
+        self._prices *= np.exp(self.volatility * self.rng.standard_normal(len(self._prices)))
+        return np.round(self._prices, 2)
+
+
+class ReplaySource:
+    """
+    以歷史資料庫的日收盤價重播：相鄰兩日之間線性內插為 steps_per_day 個 tick，播完後從頭循環
+    標的數多於資料庫內的標的時重複使用 (代碼仍各自獨立)
+    """
+    def __init__(self, symbols, history_db, days=60, steps_per_day=30):
+        matrix = history_db.load_matrix(days)
+        if matrix is None or len(matrix["dates"]) < 2:
+            raise ValueError("歷史資料庫沒有足夠的交易日可重播 (請先執行 --mode backfill --scope market)")
+        close = matrix["close"]
+        # 停牌 (NaN) 以前一日補齊；整段皆無資料的標的捨棄
+        for j in range(1, close.shape[1]):
+            missing = np.isnan(close[:, j])
+            close[missing, j] = close[missing, j - 1]
+        close = close[~np.isnan(close).any(axis=1)]
+        if not len(close):
+            raise ValueError("歷史資料庫沒有完整的收盤價序列可重播")
+        self.symbols = list(symbols)
+        self.closes = close[np.arange(len(self.symbols)) % len(close)]
+        self.steps_per_day = max(1, steps_per_day)
+        self._step = 0
+
+    def step(self):
+        days = self.closes.shape[1]
+        position = self._step / self.steps_per_day % (days - 1)
+        self._step += 1
+        day = int(position)
+        weight = position - day
+        return np.round(self.closes[:, day] * (1 - weight) + self.closes[:, day + 1] * weight, 2)
+
+
+class SimulatedNotion:
+    """Notion 替身：提供監控清單，寫入時依設定延遲阻塞 (與 NotionHelper 相同於執行緒中呼叫)"""
+    def __init__(self, items, latency):
+        self.items = items
+        self.latency = latency
+        self.writes = 0
+
+    def get_monitoring_list(self, raise_on_error=False):
+        return [dict(item) for item in self.items]
+
+    def update_price_and_status(self, page_id, current_price, status_name):
+        with metrics.track("notion", op="update_price"):
+            time.sleep(self.latency)
+        self.writes += 1
+        return True
+
+
+class SimulatedTelegram:
+    """Telegram 替身：發送時依設定延遲等待；/stop 狀態沿用原本的 Notifier"""
+    def __init__(self, notifier, latency):
+        self.notifier = notifier
+        self.latency = latency
+        self.sent = 0
+
+    def is_stopped(self, symbol):
+        return self.notifier.is_stopped(symbol)
+
+    async def send_message(self, text):
+        with metrics.track("telegram", method="send_message"):
+            await asyncio.sleep(self.latency)
+        self.sent += 1
+        return True
+
+
+def build_watchlist(symbols, prices, density, near_band, seed=0):
+    """
+    依起始價格建立監控清單
+    density 比例的標的警戒值設在起始價 ±near_band 內 (容易觸發)，其餘設在 ±50% 外
+    """
+    rng = np.random.default_rng(seed + 1)
+    near = rng.random(len(symbols)) < density
+    items = []
+    for symbol, price, is_near in zip(symbols, prices.tolist(), near.tolist()):
+        band = near_band if is_near else 0.5
+        items.append({
+            "page_id": f"sim-{symbol}", "name": f"模擬{symbol}", "symbol": symbol,
+            "high_alert": round(price * (1 + band), 2), "low_alert": round(price * (1 - band), 2),
+            "current_price": price, "status": "正常",
+        })
+    return items, int(near.sum())
+
+
+class MarketSimulator:
+    """
+    以模擬報價驅動 MarketMonitor 的警報路徑
+    schedule: all (每個 tick 檢查全部標的) 或 planner (與排程相同，只檢查 PollPlanner 到期的標的)
+    """
+    def __init__(self, monitor, source, items, notion_latency, telegram_latency, schedule="all", out=None):
+        self.monitor = monitor
+        self.source = source
+        self.symbols = source.symbols
+        self.schedule = schedule
+        self.out = out or sys.stdout
+        self.samples = []
+
+        # 不受實際交易時段影響
+        monitor._is_session_open = lambda market: True
+        self.notion = SimulatedNotion(items, notion_latency)
+        monitor.notion = self.notion
+        monitor.notion_writer.notion = self.notion
+        self.telegram = SimulatedTelegram(monitor.notifier, telegram_latency)
+        monitor.alert_queue.notifier = self.telegram
+
+    def _feed(self, prices, now):
+        """寫入價格快取 (與正式報價相同的 QuoteStore)"""
+        quotes = self.monitor.fetcher.quotes
+        for symbol, price in zip(self.symbols, prices.tolist()):
+            quotes.set(symbol, price, now)
+
+    async def run(self, duration, tick, report_every=5):
+        writer, alerts = self.monitor.notion_writer, self.monitor.alert_queue
+        await self.monitor._get_watchlist()
+        ticks = max(1, int(duration / tick))
+        began = time.perf_counter()
+        next_tick = began
+        last_report = began
+        print(f"{'秒':>6}{'週期 ms':>10}{'檢查檔/秒':>12}{'延誤 ms':>10}{'Notion 積壓':>12}{'寫入/秒':>9}"
+              f"{'Telegram 積壓':>14}{'發送/秒':>9}", file=self.out)
+        previous = (0, 0, 0, began)
+        for n in range(ticks):
+            lag = max(0.0, time.perf_counter() - next_tick)
+            self._feed(self.source.step(), time.time())
+            targets = self.symbols if self.schedule == "all" else self.monitor.planner.take_due()
+            started = time.perf_counter()
+            checked = 0
+            if targets:
+                success, fail = await self.monitor.check_once(symbols=targets)
+                checked = success + fail
+            now = time.perf_counter()
+            self.samples.append({
+                "t": now - began, "cycle": now - started, "lag": lag, "checked": checked,
+                "notion_pending": writer.pending, "notion_written": self.notion.writes,
+                "telegram_pending": alerts.pending, "telegram_sent": self.telegram.sent,
+            })
+
+            if now - last_report >= report_every or n == ticks - 1:
+                checked_total = sum(s["checked"] for s in self.samples)
+                elapsed = now - previous[3]
+                print(f"{now - began:>6.0f}{(now - started) * 1000:>10.0f}"
+                      f"{(checked_total - previous[0]) / elapsed:>12.0f}{lag * 1000:>10.0f}"
+                      f"{writer.pending:>12}{(self.notion.writes - previous[1]) / elapsed:>9.1f}"
+                      f"{alerts.pending:>14}{(self.telegram.sent - previous[2]) / elapsed:>9.1f}", file=self.out)
+                previous = (checked_total, self.notion.writes, self.telegram.sent, now)
+                last_report = now
+
+            next_tick += tick
+            await asyncio.sleep(max(0.0, next_tick - time.perf_counter()))
+        return self.summary(time.perf_counter() - began, tick)
+
+    async def drain(self, timeout):
+        """模擬結束後等待佇列寫完，回傳耗時秒數 (逾時回傳 None)"""
+        started = time.perf_counter()
+        done = await self.monitor.flush_outbox(timeout=timeout)
+        return time.perf_counter() - started if done else None
+
+    def summary(self, elapsed, tick):
+        samples = self.samples
+        t = np.array([s["t"] for s in samples])
+        cycles = np.array([s["cycle"] for s in samples])
+        lags = np.array([s["lag"] for s in samples])
+
+        def growth(key):
+            # 積壓量對時間的線性迴歸斜率 (筆/秒)，持續為正代表下游跟不上
+            values = np.array([s[key] for s in samples], dtype=float)
+            return float(np.polyfit(t, values, 1)[0]) if len(samples) > 1 else 0.0
+
+        def delay(queue):
+            hist = metrics.histogram("outbox_delay_seconds", queue=queue)
+            if not hist or not hist.count:
+                return None, None
+            return round(hist.quantile(0.5) * 1000, 1), round(hist.quantile(0.99) * 1000, 1)
+
+        writer, alerts = self.monitor.notion_writer, self.monitor.alert_queue
+        checked = sum(s["checked"] for s in samples)
+        return {
+            "symbols": len(self.symbols),
+            "ticks": len(samples),
+            "tick_seconds": tick,
+            "elapsed": round(elapsed, 2),
+            # 吞吐量: 每秒完成警戒值判斷的檔數 (理想值為 檔數 / tick 間隔)
+            "checked_per_second": round(checked / elapsed, 1),
+            "target_per_second": round(len(self.symbols) / tick, 1),
+            "cycle_p50_ms": round(float(np.percentile(cycles, 50)) * 1000, 1),
+            "cycle_p99_ms": round(float(np.percentile(cycles, 99)) * 1000, 1),
+            "lag_max_ms": round(float(lags.max()) * 1000, 1),
+            "notion": {
+                "submitted": writer.submitted, "coalesced": writer.coalesced, "written": self.notion.writes,
+                "pending": writer.pending, "max_pending": max(s["notion_pending"] for s in samples),
+                "growth_per_second": round(growth("notion_pending"), 2),
+                "written_per_second": round(self.notion.writes / elapsed, 2),
+                "delay_p50_ms": delay("notion")[0], "delay_p99_ms": delay("notion")[1],
+            },
+            "telegram": {
+                "submitted": alerts.submitted, "coalesced": alerts.coalesced, "sent": self.telegram.sent,
+                "skipped": alerts.skipped, "pending": alerts.pending,
+                "max_pending": max(s["telegram_pending"] for s in samples),
+                "growth_per_second": round(growth("telegram_pending"), 2),
+                "sent_per_second": round(self.telegram.sent / elapsed, 2),
+                "delay_p50_ms": delay("telegram")[0], "delay_p99_ms": delay("telegram")[1],
+            },
+            # 最近完成的警報追蹤 (毫秒)；total 為 tick 寫入價格快取至訊息送達
+            "alert_latency": tracer.summary(),
+        }
+
+
+def format_summary(result):
+    ms = lambda value: "---" if value is None else f"{value}ms"
+    lines = [
+        f"\n模擬結果: {result['symbols']} 檔，{result['ticks']} 個 tick (間隔 {result['tick_seconds']}s)，耗時 {result['elapsed']}s",
+        f"  警戒值判斷: {result['checked_per_second']} 檔/秒 (目標 {result['target_per_second']})，"
+        f"週期 p50 {result['cycle_p50_ms']}ms / p99 {result['cycle_p99_ms']}ms，最大 tick 延誤 {result['lag_max_ms']}ms",
+    ]
+    for name, unit in (("notion", "written"), ("telegram", "sent")):
+        q = result[name]
+        lines.append(
+            f"  {name}: 排入 {q['submitted']} (合併 {q['coalesced']})，完成 {q[unit]} ({q[f'{unit}_per_second']}/秒)，"
+            f"積壓 {q['pending']} (最大 {q['max_pending']}，成長 {q['growth_per_second']:+}/秒)，"
+            f"佇列延遲 p50 {ms(q['delay_p50_ms'])} / p99 {ms(q['delay_p99_ms'])}")
+    latency = result.get("alert_latency") or {}
+    if latency.get("count"):
+        lines.append(f"  警報延遲 (最近 {latency['count']} 則，送達 {latency['delivered']} 則，p50 / p95 / p99):")
+        for name, q in latency["stages"].items():
+            label = "tick→送達" if name == "total" else name
+            lines.append(f"    {label:<20}{q['p50']:>10.1f}{q['p95']:>10.1f}{q['p99']:>10.1f} ms")
+    if result.get("drain_seconds") is not None:
+        lines.append(f"  結束後清空佇列耗時 {result['drain_seconds']:.1f}s")
+    elif result.get("drain_timeout"):
+        lines.append(f"  {result['drain_timeout']:g}s 內未能清空佇列")
+    return "\n".join(lines)
+
+
+async def main(args):
+    from monitor import MarketMonitor
+    monitor = MarketMonitor()
+    symbols = simulated_symbols(args.symbols)
+    if args.source == "replay":
+        from history_db import HistoryDatabase
+        source = ReplaySource(symbols, HistoryDatabase(args.history_db), args.replay_days, args.steps_per_day)
+    else:
+        source = RandomWalkSource(symbols, args.volatility, args.seed)
+    start_prices = source.step()
+    items, near = build_watchlist(symbols, start_prices, args.threshold_density, args.near_band, args.seed)
+    if args.notion_workers:
+        monitor.notion_writer.workers = args.notion_workers
+    if args.telegram_rate:
+        monitor.alert_queue.rate = args.telegram_rate
+
+    out = sys.stdout
+    # 日誌照常經過佇列與格式化 (計入成本)，未指定 --verbose 時寫入 /dev/null
+    setup_logging(args.log_level.upper(), stream=None if args.verbose else open(os.devnull, "w"))
+    simulator = MarketSimulator(monitor, source, items, args.notion_latency_ms / 1000,
+                                args.telegram_latency_ms / 1000, schedule=args.schedule, out=out)
+    print(f"模擬 {len(symbols)} 檔 ({args.source})，tick {args.tick}s，{args.duration}s，"
+          f"警戒值接近現價者 {near} 檔 (±{args.near_band:.1%})", file=out)
+    with contextlib.ExitStack() as stack:
+        # 其餘 print 輸出導向 /dev/null
+        if not args.verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+        result = await simulator.run(args.duration, args.tick, args.report_every)
+        result["drain_seconds"] = await simulator.drain(args.drain) if args.drain else None
+        result["drain_timeout"] = args.drain
+        result["alert_latency"] = tracer.summary()
+    monitor.renderer.shutdown()
+    await monitor.fetcher.async_client.aclose()
+
+    print(format_summary(result))
+    if args.trace_output:
+        print(f"警報追蹤已寫入 {args.trace_output} ({tracer.export(args.trace_output)} 則)")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"結果已寫入 {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="以模擬行情對警報路徑做負載測試")
+    parser.add_argument("--symbols", type=int, default=5000, help="標的數")
+    parser.add_argument("--tick", type=float, default=1.0, help="tick 間隔秒數")
+    parser.add_argument("--duration", type=float, default=60, help="模擬秒數")
+    parser.add_argument("--source", choices=["random", "replay"], default="random",
+                        help="random: 隨機漫步；replay: 重播歷史資料庫的日收盤價")
+    parser.add_argument("--volatility", type=float, default=0.002, help="隨機漫步每個 tick 的波動度 (對數報酬標準差)")
+    parser.add_argument("--threshold-density", type=float, default=0.05, help="警戒值接近現價的標的比例")
+    parser.add_argument("--near-band", type=float, default=0.01, help="接近現價的警戒值與起始價的距離 (比例)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--history-db", default=os.getenv("HISTORY_DB_PATH", "history.db"), help="replay 使用的歷史資料庫")
+    parser.add_argument("--replay-days", type=int, default=60, help="replay 使用的最近交易日數")
+    parser.add_argument("--steps-per-day", type=int, default=30, help="replay 相鄰兩日之間內插的 tick 數")
+    parser.add_argument("--schedule", choices=["all", "planner"], default="all",
+                        help="all: 每個 tick 檢查全部標的；planner: 只檢查 PollPlanner 到期的標的 (與排程相同)")
+    parser.add_argument("--notion-latency-ms", type=float, default=350, help="Notion 替身每次寫入的延遲")
+    parser.add_argument("--telegram-latency-ms", type=float, default=100, help="Telegram 替身每次發送的延遲")
+    parser.add_argument("--notion-workers", type=int, default=0, help="Notion 寫入工作數 (預設沿用 NOTION_WRITE_CONCURRENCY)")
+    parser.add_argument("--telegram-rate", type=float, default=0, help="每秒發送則數 (預設沿用 TELEGRAM_RATE_PER_SECOND)")
+    parser.add_argument("--drain", type=float, default=0, help="結束後最多等待佇列清空的秒數 (0 不等待)")
+    parser.add_argument("--report-every", type=float, default=5, help="進度輸出間隔秒數")
+    parser.add_argument("--output", help="結果 JSON 輸出路徑")
+    parser.add_argument("--trace-output", help="最近的警報追蹤紀錄 (JSON lines) 輸出路徑")
+    parser.add_argument("--verbose", action="store_true", help="輸出日誌 (預設寫入 /dev/null)")
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "INFO"), help="日誌層級 (DEBUG 含逐檔訊息)")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,300 @@
+import os
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import profiler
+
+log = logging.getLogger(__name__)
+
+# 程式內的計數器、直方圖與即時數值 (佇列深度等)
+# 以 Prometheus 文字格式輸出 (本機 HTTP 端點)，並提供 /stats 指令使用的文字摘要
+# 全域實例 metrics 可在任何執行緒中使用 (資料來源的同步呼叫會在 to_thread 執行緒中記錄)
+
+# 延遲直方圖的預設分界 (秒)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """固定分界的直方圖 (累計次數、總和)，分位數以所在區間線性內插估計"""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # 最後一格為 +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.last = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.last = value
+
+    def quantile(self, q):
+        """估計第 q 分位數 (0~1)，無資料時回傳 None"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            if n and cumulative + n >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else lower
+                return lower + (upper - lower) * (rank - cumulative) / n
+            cumulative += n
+        return self.buckets[-1]
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _display_name(labels):
+    """標籤值依固定順序組成的顯示名稱 (例如 finmind/TaiwanStockPrice)"""
+    d = dict(labels)
+    return "/".join(d[k] for k in ("provider", "endpoint", "op", "method", "job") if k in d)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=None):
+    pairs = list(key) + list(extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Metrics:
+    """
+    計數器 (counter)、直方圖 (histogram) 與即時數值 (gauge，讀取時才呼叫回呼函式)
+    名稱沿用 Prometheus 慣例：計數器以 _total 結尾、延遲以秒為單位
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}   # 格式: {(name, labels): float}
+        self._histograms = {} # 格式: {(name, labels): Histogram}
+        self._gauges = {}     # 格式: {(name, labels): callable 或數值}
+        self._help = {}
+        self.started_at = time.time()
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram()
+            hist.observe(value)
+
+    def gauge(self, name, value, **labels):
+        """設定即時數值；value 可為函式 (輸出時才讀取，例如佇列長度)"""
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """記錄區塊執行時間至直方圖 name (剖析中時同時為一個階段)"""
+        started = time.perf_counter()
+        try:
+            with profiler.stage(f"{name.removesuffix('_seconds')} {_display_name(_label_key(labels))}".strip()):
+                yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @contextmanager
+    def track(self, kind, **labels):
+        """
+        記錄一次外部呼叫：{kind}_request_seconds (延遲) 與 {kind}_requests_total (依 outcome 分類)
+        區塊拋出例外時 outcome 為 error；區塊內可設定 call["outcome"] (例如 HTTP 狀態碼)
+        剖析中時同時為一個階段 (例如 provider fugle/snapshot)
+        """
+        call = {"outcome": "ok"}
+        started = time.perf_counter()
+        try:
+            with profiler.stage(f"{kind} {_display_name(_label_key(labels))}"):
+                yield call
+        except BaseException:
+            call["outcome"] = "error"
+            raise
+        finally:
+            self.observe(f"{kind}_request_seconds", time.perf_counter() - started, **labels)
+            self.inc(f"{kind}_requests_total", outcome=call["outcome"], **labels)
+
+    def cache(self, name, hit):
+        """記錄快取命中或未命中"""
+        self.inc("cache_requests_total", cache=name, result="hit" if hit else "miss")
+
+    def fallback(self, source, target):
+        """記錄資料來源備援 (source 失敗或資料過舊，改用 target)"""
+        self.inc("provider_fallbacks_total", source=source, target=target)
+
+    # --- 讀取 ---
+
+    def counters(self, name):
+        """回傳 {labels dict 的 tuple: 值}"""
+        with self._lock:
+            return {labels: value for (n, labels), value in self._counters.items() if n == name}
+
+    def histograms(self, name):
+        with self._lock:
+            return {labels: hist for (n, labels), hist in self._histograms.items() if n == name}
+
+    def histogram(self, name, **labels):
+        with self._lock:
+            return self._histograms.get((name, _label_key(labels)))
+
+    def gauges(self):
+        """讀取所有即時數值 (回呼失敗者略過)"""
+        with self._lock:
+            items = list(self._gauges.items())
+        values = {}
+        for key, value in items:
+            try:
+                values[key] = float(value() if callable(value) else value)
+            except Exception:
+                continue
+        return values
+
+    def render_prometheus(self):
+        """Prometheus 文字格式 (text/plain; version=0.0.4)"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+        lines = []
+        declared = set()
+
+        def declare(name, kind):
+            if name not in declared:
+                declared.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            declare(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        for (name, labels), hist in histograms:
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, n in zip(hist.buckets, hist.counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', f'{bound:g}')])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {hist.count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {hist.sum:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+        for (name, labels), value in sorted(self.gauges().items()):
+            declare(name, "gauge")
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        declare("process_uptime_seconds", "gauge")
+        lines.append(f"process_uptime_seconds {time.time() - self.started_at:.0f}")
+        return "\n".join(lines) + "\n"
+
+    def format_report(self):
+        """/stats 指令使用的文字摘要 (延遲為估計的 p50 / p95)"""
+        ms = lambda seconds: "---" if seconds is None else f"{seconds * 1000:.0f}ms"
+        lines = [f"📈 **系統統計** (運行 {(time.time() - self.started_at) / 3600:.1f} 小時)\n"]
+
+        cycle = self.histogram("check_cycle_seconds")
+        if cycle and cycle.count:
+            lines.append(f"**價格檢查週期**：{cycle.count} 次 | p50 `{ms(cycle.quantile(0.5))}` | "
+                         f"p95 `{ms(cycle.quantile(0.95))}` | 最近 `{ms(cycle.last)}`")
+
+        for kind, title in (("provider", "資料來源"), ("notion", "Notion"), ("telegram", "Telegram")):
+            hists = self.histograms(f"{kind}_request_seconds")
+            if not hists:
+                continue
+            outcomes = self.counters(f"{kind}_requests_total")
+            lines.append(f"\n**{title}** (次數 / 失敗 / p50 / p95)")
+            for labels, hist in sorted(hists.items()):
+                errors = sum(v for key, v in outcomes.items()
+                             if dict(key).get("outcome") != "ok" and set(labels) <= set(key))
+                lines.append(f"• `{_display_name(labels)}`: {hist.count} / {int(errors)} / `{ms(hist.quantile(0.5))}` / `{ms(hist.quantile(0.95))}`")
+
+        fallbacks = self.counters("provider_fallbacks_total")
+        if fallbacks:
+            lines.append("\n**備援切換**")
+            for labels, value in sorted(fallbacks.items()):
+                d = dict(labels)
+                lines.append(f"• `{d.get('source')}` → `{d.get('target')}`: {int(value)}")
+
+        cache = {}
+        for labels, value in self.counters("cache_requests_total").items():
+            d = dict(labels)
+            cache.setdefault(d.get("cache"), {})[d.get("result")] = value
+        if cache:
+            lines.append("\n**快取命中率**")
+            for name, result in sorted(cache.items()):
+                hits, misses = result.get("hit", 0), result.get("miss", 0)
+                lines.append(f"• `{name}`: {hits / (hits + misses):.0%} ({int(hits)}/{int(hits + misses)})")
+
+        gauges = self.gauges()
+        if gauges:
+            lines.append("\n**佇列與快取大小**")
+            for (name, labels), value in sorted(gauges.items()):
+                suffix = _format_labels(labels)
+                lines.append(f"• `{name}{suffix}`: {value:g}")
+        return "\n".join(lines)
+
+
+metrics = Metrics()
+
+
+class MetricsServer:
+    """以背景執行緒提供 /metrics (Prometheus 文字格式) 的本機 HTTP 端點"""
+    def __init__(self, registry=None, host=None, port=None):
+        self.registry = registry or metrics
+        self.host = host or os.getenv("METRICS_HOST", "127.0.0.1")
+        self.port = int(os.getenv("METRICS_PORT", 9108)) if port is None else port
+        self._server = None
+
+    def start(self):
+        """啟動端點 (METRICS_PORT=0 時停用)，回傳是否成功"""
+        if not self.port:
+            return False
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # 不輸出每次抓取的存取紀錄
+
+        try:
+            self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            log.warning("無法啟動 metrics 端點 (%s:%s): %s", self.host, self.port, e)
+            return False
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        log.info("📈 Metrics 端點已啟動: http://%s:%s/metrics", self.host, self.port)
+        return True
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
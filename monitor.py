@@ -2,22 +2,41 @@ import os
 import time
 import asyncio
 import json
-from datetime import datetime, time as dt_time, timezone, timedelta
+import logging
+import tempfile
+from datetime import datetime, timezone, timedelta
 from dotenv import load_dotenv
 
 from price_fetcher import PriceFetcher
 from notion_helper import NotionHelper
 from notifier import Notifier
-from report_generator import ReportGenerator
+from render_service import RenderService
+from snapshot_store import SnapshotStore
+from scheduler import Scheduler, daily_at
+from poll_planner import PollPlanner
+from market_scanner import MarketScanner
+from backfill import HistoryBackfill
+from metrics import metrics, MetricsServer
+from outbox import NotionWriter, TelegramQueue
+from logger import setup_logging
+from tracing import tracer
+import profiler
 
 load_dotenv()
 
+log = logging.getLogger("monitor") # 以腳本執行時 __name__ 為 __main__
+
 class MarketMonitor:
     def __init__(self):
         self.fetcher = PriceFetcher()
         self.notion = NotionHelper()
         self.notifier = Notifier()
-        self.generator = ReportGenerator()
+        self.renderer = RenderService()
+        # 價格檢查的 Notion 寫入與警報訊息改由背景佇列依速率限制寫出
+        self.notion_writer = NotionWriter(self.notion)
+        self.alert_queue = TelegramQueue(self.notifier)
+        # 報告資料抓取的並行上限 (避免瞬間打爆 API 額度)
+        self.report_concurrency = int(os.getenv("REPORT_CONCURRENCY", 8))
         
         # 預設設定 (優先讀取環境變數)
         self.interval = int(os.getenv("CHECK_INTERVAL_SECONDS", 600))
@@ -27,97 +46,166 @@ class MarketMonitor:
         # 載入持久化設定 (覆蓋預設值)
         self.load_config()
         
-        self.last_open_date = None
-        self.last_close_date = None
-        self.last_noon_date = None
-        self.last_daily_report_date = None
-        self.last_order_stats_date = None
         self.last_check_time = 0
         self.taipei_tz = timezone(timedelta(hours=8))
 
+        # 市場交易時段 (依交易所時區與行事曆)，美股可加入 pre_market / after_hours
+        self.sessions = self.fetcher.calendar
+        self.snapshots = SnapshotStore(calendar=self.sessions)
+        self.market_sessions = {
+            "TW": tuple(os.getenv("TW_SESSIONS", "regular").split(",")),
+            "US": tuple(os.getenv("US_SESSIONS", "regular").split(",")),
+        }
+
+        # 依距離警戒值調整各標的輪詢頻率
+        self.planner = PollPlanner(max_interval=self.interval)
+        self.watchlist_ttl = int(os.getenv("WATCHLIST_TTL_SECONDS", 60))
+        self._watchlist = None
+        self._watchlist_time = 0
+        self._check_stats = [0, 0] # 自上次彙總訊息以來的 [成功, 失敗] 數
+
+        # 事件驅動排程 (各項定時報告與價格檢查)
+        self.warmup_time = os.getenv("WARMUP_TIME", "08:45")
+        self.warmup_concurrency = int(os.getenv("WARMUP_CONCURRENCY", 4))
+        # 盤後全市場掃描 (MARKET_SCAN_TIME 設定時每個交易日自動發送，例如 "15:30")
+        self.scanner = MarketScanner(self.fetcher, calendar=self.sessions)
+        self.scan_time = os.getenv("MARKET_SCAN_TIME", "")
+        self.backfill = HistoryBackfill(self.fetcher, self.scanner)
+        self.scheduler = Scheduler(self.taipei_tz)
+        self._setup_jobs()
+        self.metrics_server = MetricsServer()
+        self._register_gauges()
+
+    def _register_gauges(self):
+        """佇列深度與快取大小 (讀取 metrics 時才計算)"""
+        metrics.gauge("render_queue_depth", lambda: self.renderer.pending)
+        metrics.gauge("render_cache_entries", lambda: len(self.renderer.cache))
+        metrics.gauge("poll_planner_symbols", lambda: len(self.planner.states))
+        metrics.gauge("poll_planner_due", lambda: sum(1 for s in self.planner.states.values() if s.next_due <= time.time()))
+        metrics.gauge("scheduler_jobs_running", lambda: sum(1 for job in self.scheduler.jobs.values() if job.running))
+        metrics.gauge("quote_store_symbols", lambda: len(self.fetcher.quotes))
+        metrics.gauge("history_cache_symbols", lambda: len(self.fetcher.history))
+        metrics.gauge("history_cache_bytes", lambda: self.fetcher.history.nbytes)
+        metrics.gauge("outbox_pending", lambda: self.notion_writer.pending, queue="notion")
+        metrics.gauge("outbox_pending", lambda: self.alert_queue.pending, queue="telegram")
+
     def _get_now_taipei(self):
         """獲取目前的台北時間"""
         return datetime.now(self.taipei_tz)
 
     def is_market_open(self):
         """
-        判斷台股是否在交易時段 (週一至週五 09:00 - 13:35)
+        判斷台股是否在交易時段 (依市場行事曆，含休市日與半日市)
         日期判定優先於 allow_outside 檢查
         """
-        now = self._get_now_taipei()
-        # 週六 (5) 與週日 (6) 絕對不開
-        if now.weekday() > 4:
-            return False
-            
-        if self.allow_outside:
-            return True
-            
-        market_start = dt_time(9, 0)
-        market_end = dt_time(13, 35)
-        current_time = now.time()
-        
-        return market_start <= current_time <= market_end
+        return self._is_session_open("TW")
 
     def is_us_market_open(self):
         """
-        判斷美股是否在交易時段 (台北時間 22:30 - 05:00)
+        判斷美股是否在交易時段 (依美東時間，自動處理夏令時間與 NYSE 休市日)
         日期判定優先於 allow_outside 檢查
         """
-        now = self._get_now_taipei()
-        weekday = now.weekday() # 0=Mon, 5=Sat, 6=Sun
-        current_time = now.time()
+        return self._is_session_open("US")
 
-        # 週日全天與週一開盤前 (22:30 前) 不進行監控
-        if weekday == 6:
-            return False
-        if weekday == 0 and current_time < dt_time(22, 30):
-            return False
-        # 週六僅在清晨 05:00 前 (美股週五盤) 允許
-        if weekday == 5 and current_time > dt_time(5, 0):
-            return False
-
-        if self.allow_outside:
-            return True
-            
-        # 週一至週五晚上 22:30 - 23:59
-        if 0 <= weekday <= 4 and current_time >= dt_time(22, 30):
+    def _is_session_open(self, market):
+        """依市場行事曆判斷是否需要監控該市場"""
+        now = self.sessions.now(market)
+        # 非交易日 (週末、休市日) 即使開啟 allow_outside 也不監控
+        if self.allow_outside and self.sessions.is_trading_day(market, now.date()):
             return True
-        # 週二至週六凌晨 00:00 - 05:00
-        if 1 <= weekday <= 5 and current_time <= dt_time(5, 0):
-            return True
-            
-        return False
+        return self.sessions.is_open(market, now, self.market_sessions[market])
 
-    async def check_once(self):
-        print(f"[{datetime.now()}] 開始執行價格檢查...")
-        
-        items = self.notion.get_monitoring_list()
+    async def _get_watchlist(self, max_age=None):
+        """
+        取得監控清單 (max_age 秒內讀取過時沿用快取，避免高頻輪詢時反覆查詢 Notion)
+        Notion 查詢於執行緒中進行；查詢失敗時沿用上次的清單與輪詢狀態 (max_age 後再重試)
+        """
+        now = time.time()
+        if max_age is not None:
+            hit = self._watchlist is not None and now - self._watchlist_time < max_age
+            metrics.cache("watchlist", hit)
+            if hit:
+                return self._watchlist
+        try:
+            items = await asyncio.to_thread(self.notion.get_monitoring_list, raise_on_error=True)
+        except Exception:
+            metrics.inc("watchlist_errors_total")
+            if self._watchlist is None:
+                return []
+            log.warning("讀取監控清單失敗，沿用上次的清單 (%s 檔)", len(self._watchlist))
+            self._watchlist_time = now
+            return self._watchlist
+        self._watchlist = items
+        self._watchlist_time = now
+        self.planner.sync(item['symbol'] for item in items)
+        return items
+
+    async def check_once(self, symbols=None):
+        """
+        執行價格檢查
+        symbols: 僅檢查指定標的 (由輪詢排程器依優先順序挑選)；None 為完整檢查 (如 /check)
+        """
+        # 排程的高頻輪詢只在 debug 層級記錄開始與結束
+        level = logging.INFO if symbols is None else logging.DEBUG
+        log.log(level, "開始執行價格檢查 (%s 檔)...", "全部" if symbols is None else len(symbols))
+        started = time.perf_counter()
+
+        if symbols is None:
+            items = await self._get_watchlist()
+        else:
+            wanted = set(symbols)
+            items = [i for i in await self._get_watchlist(max_age=self.watchlist_ttl) if i['symbol'] in wanted]
         if not items:
-            print("目前沒有要監控的標的。")
+            log.info("目前沒有要監控的標的。")
             return 0, 0
 
         success_count = 0
         fail_count = 0
-        
+
+        # 辨識市場 (TAIEX 視為台股)，該市場未開盤時跳過
+        open_markets = {}
+        active = []
         for item in items:
-            symbol = item['symbol']
-            # 辨識市場 (排除 TAIEX)
-            is_us = symbol.isalpha() and "." not in symbol and symbol.upper() != "TAIEX"
-            
-            # 如果不是交易時段且沒開啟強制檢查，跳過該市場標的
-            if not self.allow_outside:
-                if is_us:
-                    if not self.is_us_market_open():
-                        continue
-                else:
-                    # 台股標的 (含 TAIEX) 僅在台股開盤時檢查
-                    if not self.is_market_open():
-                        continue
+            market = self.sessions.market_for_symbol(item['symbol'])
+            if market not in open_markets:
+                open_markets[market] = self._is_session_open(market)
+            if open_markets[market]:
+                active.append(item)
+            else:
+                self.planner.defer(item['symbol'])
+
+        # 所有報價於同一事件迴圈上並行抓取 (重複代碼只抓一次)
+        # 排程挑選的標的需要新鮮報價 (快取上限為最短輪詢間隔)
+        max_age = self.planner.min_interval if symbols is not None else None
+        unique_symbols = list(dict.fromkeys(item['symbol'] for item in active))
+
+        fetch_windows = {} # 各標的報價抓取的起訖時間 (警報延遲追蹤使用)
 
-            price_data = self.fetcher.get_last_price(symbol)
+        async def fetch(symbol):
+            with profiler.stage(f"fetch {symbol}"):
+                fetch_started = time.time()
+                quote = await self.fetcher.aget_last_price(symbol, max_age=max_age)
+                fetch_windows[symbol] = (fetch_started, time.time())
+                return quote
+
+        with profiler.stage("fetch"):
+            quotes = await asyncio.gather(*(fetch(symbol) for symbol in unique_symbols), return_exceptions=True)
+        quote_map = {
+            symbol: quote for symbol, quote in zip(unique_symbols, quotes)
+            if not isinstance(quote, Exception)
+        }
+
+        # 警報訊息附帶的技術指標取自共用結果 (不逐檔重新計算)
+        with profiler.stage("indicators"):
+            indicator_set = self.fetcher.get_indicator_set()
+
+        for item in active:
+            symbol = item['symbol']
+            price_data = quote_map.get(symbol)
             
             if price_data is None:
                 fail_count += 1
+                self.planner.defer(symbol)
                 continue
             
             price = price_data['price']
@@ -125,43 +213,83 @@ class MarketMonitor:
             is_cached = price_data.get('is_cached', False)
                 
             success_count += 1
-            cache_tag = " (快取)" if is_cached else ""
-            print(f"處理 {item['name']} ({symbol}): 當前價格 {price} {cache_tag}")
+            # 逐檔訊息為 debug 層級並依 LOG_SAMPLE_RATE 抽樣，大型監控清單不受輸出拖慢
+            log.debug("處理 %s: 當前價格 %s%s", item['name'], price, " (快取)" if is_cached else "", extra={"symbol": symbol})
             
             status = "正常"
             alert_msg = ""
+            trace = None
+            evaluate_started = time.time()
             
-            # 檢查警戒值
-            is_triggered = False
-            time_info = f"\n(資料時間: {fetch_time}{' 快取' if is_cached else ''})"
-            if item['high_alert'] and price >= item['high_alert']:
-                is_triggered = True
-                status = "警戒"
-                alert_msg = f"🔔 持續警報：[{item['name']} ({symbol})] 當前價格 {price} >= 上限 {item['high_alert']}{time_info}\n(回覆 /stop {symbol} 停止警報)"
-            elif item['low_alert'] and price <= item['low_alert']:
-                is_triggered = True
-                status = "警戒"
-                alert_msg = f"🔔 持續警報：[{item['name']} ({symbol})] 當前價格 {price} <= 下限 {item['low_alert']}{time_info}\n(回覆 /stop {symbol} 停止警報)"
+            # 檢查警戒值 (剖析時為 evaluate 階段；發送與 Notion 寫入另有各自的階段)
+            with profiler.stage("evaluate"):
+                is_triggered = False
+                time_info = f"\n(資料時間: {fetch_time}{' 快取' if is_cached else ''})"
+                indicator_line = self._format_indicators(indicator_set.latest(symbol) if indicator_set else None)
+                if indicator_line:
+                    time_info = f"\n{indicator_line}" + time_info
+                if item['high_alert'] and price >= item['high_alert']:
+                    is_triggered = True
+                    status = "警戒"
+                    alert_msg = f"🔔 持續警報：[{item['name']} ({symbol})] 當前價格 {price} >= 上限 {item['high_alert']}{time_info}\n(回覆 /stop {symbol} 停止警報)"
+                elif item['low_alert'] and price <= item['low_alert']:
+                    is_triggered = True
+                    status = "警戒"
+                    alert_msg = f"🔔 持續警報：[{item['name']} ({symbol})] 當前價格 {price} <= 下限 {item['low_alert']}{time_info}\n(回覆 /stop {symbol} 停止警報)"
             
             # 處理持續警報邏輯
             if is_triggered:
                 # 只有當使用者還沒說 /stop 時才發送
                 if not self.notifier.is_stopped(symbol):
-                    await self.notifier.send_message(alert_msg)
+                    trace = self._start_trace(item, price_data, fetch_windows.get(symbol), evaluate_started)
+                    self.alert_queue.submit(alert_msg, key=symbol, trace=trace)
                 else:
-                    print(f"{symbol} 處於警報範圍但已被使用者暫停。")
+                    log.info("處於警報範圍但已被使用者暫停。", extra={"symbol": symbol})
             else:
                 # 如果價格回到正常範圍，自動從停止清單移除，以便下次觸發時能再次通知
                 if self.notifier.is_stopped(symbol):
                     self.notifier.stopped_symbols.remove(symbol.upper())
-                    print(f"{symbol} 價格已回歸正常，重設警報狀態。")
+                    log.info("價格已回歸正常，重設警報狀態。", extra={"symbol": symbol})
             
-            # 更新 Notion
-            self.notion.update_price_and_status(item['page_id'], price, status)
+            # 依距離警戒值與波動度排定下次檢查時間
+            self.planner.record(symbol, price, item['high_alert'], item['low_alert'])
+
+            # 更新 Notion (排程輪詢時僅在價格或狀態變動時寫入)
+            if symbols is None or price != item.get('current_price') or status != item.get('status'):
+                self.notion_writer.submit(item['page_id'], price, status, trace=trace)
+                item['current_price'] = price
+                item['status'] = status
             
-        print(f"檢查任務完成。成功: {success_count}, 失敗: {fail_count}")
+        metrics.observe("check_cycle_seconds", time.perf_counter() - started)
+        metrics.inc("check_symbols_total", success_count, result="ok")
+        metrics.inc("check_symbols_total", fail_count, result="fail")
+        log.log(level, "檢查任務完成。成功: %s, 失敗: %s", success_count, fail_count)
         return success_count, fail_count
 
+    def _start_trace(self, item, price_data, fetch_window, evaluate_started):
+        """
+        建立警報追蹤：起點為收到報價的時間 (新抓取者為開始抓取時)
+        區段: fetch (抓取) 或 cache (報價在快取中等待)、batch wait (等待同批其他標的)、evaluate (警戒值判斷)
+        之後的佇列與寫出區段由 outbox 補上
+        """
+        now = time.time()
+        fetch_started, fetch_ended = fetch_window or (evaluate_started, evaluate_started)
+        received = price_data.get('received_at', fetch_ended)
+        cached = price_data.get('is_cached', False)
+        origin = min(received, fetch_started) if cached else fetch_started
+        trace = tracer.start(item['symbol'], origin, price=price_data['price'],
+                             source=price_data.get('source', 'cache' if cached else ''),
+                             first=item.get('status') != "警戒")
+        if trace is None:
+            return None
+        if cached:
+            trace.span("cache", origin, fetch_ended)
+        else:
+            trace.span("fetch", fetch_started, fetch_ended)
+        trace.span("batch wait", fetch_ended, evaluate_started)
+        trace.span("evaluate", evaluate_started, now)
+        return trace
+
     async def get_summary_callback(self, offset=0):
         """回傳目前所有監控標的的摘要文字"""
         if offset > 0:
@@ -199,14 +327,50 @@ class MarketMonitor:
         return False
 
     async def get_report_data(self, offset=0):
-        """獲取用於報告的結構化數據"""
-        items = self.notion.get_monitoring_list()
+        """
+        獲取用於報告的結構化數據
+        各標的統計資料以非同步請求平行抓取 (並行數上限 REPORT_CONCURRENCY)，市場買賣力道同時進行；
+        本輪檢查已取得的即時報價直接沿用，重複的代碼只抓取一次
+        """
+        # 前幾個交易日的資料直接由盤後快照提供，不呼叫任何 API
+        if offset >= 1:
+            today_str = self._get_now_taipei().strftime("%Y-%m-%d")
+            snapshot = self.snapshots.get_by_offset(offset, today_str)
+            metrics.cache("snapshot", snapshot is not None)
+            if snapshot:
+                return {
+                    "date": snapshot['date'],
+                    "stock_list": snapshot['stock_list'],
+                    "sentiment": snapshot['sentiment'],
+                    "images": snapshot['images']
+                }
+            log.info("找不到 offset=%s 的盤後快照，改為即時計算。", offset)
+
+        items = await self._get_watchlist(self.watchlist_ttl)
+
+        sentiment_task = asyncio.ensure_future(self.fetcher.aget_market_sentiment())
+        semaphore = asyncio.Semaphore(self.report_concurrency)
+
+        async def fetch_stats(symbol):
+            latest = self.fetcher.get_cached_quote(symbol, max_age=self.interval)
+            async with semaphore:
+                with profiler.stage(f"stats {symbol}"):
+                    return await self.fetcher.aget_full_stats(symbol, offset, latest)
+
+        symbols = list(dict.fromkeys(item['symbol'] for item in items))
+        results = await asyncio.gather(*(fetch_stats(symbol) for symbol in symbols), return_exceptions=True)
+        stats_map = {
+            symbol: result for symbol, result in zip(symbols, results)
+            if result and not isinstance(result, Exception)
+        }
+        # 技術指標取自共用的批次計算結果 (僅最新交易日適用)
+        indicator_set = self.fetcher.get_indicator_set() if offset == 0 else None
+
         stock_list = []
         date_str = "---"
-        
         for item in items:
             symbol = item['symbol']
-            stats = self.fetcher.get_full_stats(symbol, offset=offset)
+            stats = stats_map.get(symbol)
             if stats:
                 if date_str == "---":
                     date_str = stats['date']
@@ -224,23 +388,16 @@ class MarketMonitor:
                     "open": stats['open'],
                     "high": stats['high'],
                     "low": stats['low'],
-                    "volume": stats['volume']
+                    "volume": stats['volume'],
+                    "indicators": indicator_set.latest(symbol) if indicator_set else None
                 })
         
         # 獲取市場買賣力道
-        sentiment_data = None
-        m_stats = self.fetcher.get_market_order_stats()
-        if m_stats:
-            diff_vol = m_stats['total_buy_volume'] - m_stats['total_sell_volume']
-            sentiment = "🐂 偏多" if diff_vol > 0 else "Bearish" # Placeholder logic, will refine in monitor
-            overheat_index = (m_stats['total_deal_volume'] / m_stats['total_buy_volume']) * 100 if m_stats['total_buy_volume'] > 0 else 0
-            sentiment_data = {
-                "date": m_stats['date'],
-                "time": m_stats['time'],
-                "sentiment": "🐂 偏多" if diff_vol > 0 else "🐻 偏空",
-                "diff_vol": diff_vol,
-                "overheat_index": overheat_index
-            }
+        try:
+            sentiment_data = await sentiment_task
+        except Exception as e:
+            log.warning("獲取市場買賣力道失敗: %s", e)
+            sentiment_data = None
 
         return {
             "date": date_str,
@@ -251,6 +408,10 @@ class MarketMonitor:
     async def get_detailed_summary(self, offset=0):
         """回傳目前所有監控標的的詳細摘要 (開、收、高、低、MA20)"""
         data = await self.get_report_data(offset=offset)
+        return self._format_detailed_summary(data)
+
+    def _format_detailed_summary(self, data):
+        """將報告資料格式化為文字摘要"""
         if not data['stock_list']:
             return "目前監控清單為空或無法獲取資料。"
             
@@ -267,10 +428,27 @@ class MarketMonitor:
                 f"  開: `{s['open']}` / 高: `{s['high']}` / 低: `{s['low']}`\n"
                 f"  量: `{s['volume']:,}` / MA20: `{s['ma20_status']}`"
             )
+            indicator_line = self._format_indicators(s.get('indicators'))
+            if indicator_line:
+                line += f"\n  {indicator_line}"
             lines.append(line)
             
         return "\n".join(lines)
 
+    @staticmethod
+    def _format_indicators(ind):
+        """技術指標摘要 (一行)"""
+        if not ind:
+            return ""
+        parts = []
+        if ind.get('rsi14') is not None:
+            parts.append(f"RSI14: `{ind['rsi14']}`")
+        if ind.get('macd_hist') is not None:
+            parts.append(f"MACD 柱: `{ind['macd_hist']}`")
+        if ind.get('high20') is not None and ind.get('low20') is not None:
+            parts.append(f"20 日高/低: `{ind['high20']}`/`{ind['low20']}`")
+        return " / ".join(parts)
+
     def load_config(self):
         """從檔案載入設定"""
         if os.path.exists(self.config_file):
@@ -279,9 +457,9 @@ class MarketMonitor:
                     config = json.load(f)
                     self.interval = config.get("interval", self.interval)
                     self.allow_outside = config.get("allow_outside", self.allow_outside)
-                print(f"✅ 已載入設定: 間隔={self.interval}s, 時段外={self.allow_outside}")
+                log.info("✅ 已載入設定: 間隔=%ss, 時段外=%s", self.interval, self.allow_outside)
             except Exception as e:
-                print(f"❌ 載入設定失敗: {e}")
+                log.error("❌ 載入設定失敗: %s", e)
 
     def save_config(self):
         """將設定儲存至檔案"""
@@ -292,25 +470,28 @@ class MarketMonitor:
             }
             with open(self.config_file, "w", encoding="utf-8") as f:
                 json.dump(config, f, indent=4, ensure_ascii=False)
-            print(f"💾 設定已儲存至 {self.config_file}")
+            log.info("💾 設定已儲存至 %s", self.config_file)
         except Exception as e:
-            print(f"❌ 儲存設定失敗: {e}")
+            log.error("❌ 儲存設定失敗: %s", e)
 
     async def change_config_callback(self, interval=None, allow_outside=None):
         """處理來自 Telegram 的系統配置修改請求"""
         changed = False
         if interval is not None:
             self.interval = interval
-            print(f"系統檢查間隔已更變為: {self.interval} 秒")
+            self.planner.max_interval = interval
+            log.info("系統檢查間隔已更變為: %s 秒", self.interval)
             changed = True
         
         if allow_outside is not None:
             self.allow_outside = allow_outside
-            print(f"交易時段外處理已變更為: {self.allow_outside}")
+            log.info("交易時段外處理已變更為: %s", self.allow_outside)
             changed = True
             
         if changed:
             self.save_config()
+            # 立即依新設定重新計算價格檢查的觸發時間
+            self.scheduler.reschedule("price_check")
 
     async def get_market_callback(self):
         """回傳市場指數資料"""
@@ -318,11 +499,11 @@ class MarketMonitor:
 
     async def get_api_usage_callback(self):
         """回傳 API 使用量資訊"""
-        return self.fetcher.get_api_usage()
+        return await self.fetcher.aget_api_usage()
 
     async def get_stock_history_callback(self, symbol):
         """回傳特定股票的五日歷史數據摘要"""
-        stats_list = self.fetcher.get_five_day_stats(symbol)
+        stats_list = await self.fetcher.aget_five_day_stats(symbol)
         if not stats_list:
             return None
             
@@ -337,38 +518,86 @@ class MarketMonitor:
                 f"  MA5: `{s['ma5'] or '---'}` | MA20: `{s['ma20'] or '---'}`\n"
             )
             lines.append(line)
+
+        indicator_set = self.fetcher.get_indicator_set([symbol])
+        ind = indicator_set.latest(symbol) if indicator_set else None
+        if ind:
+            lines.append(
+                f"📐 **技術指標 (最新)**\n"
+                f"  MA5/20/60: `{ind['ma5'] or '---'}` / `{ind['ma20'] or '---'}` / `{ind['ma60'] or '---'}`\n"
+                f"  EMA12/26: `{ind['ema12'] or '---'}` / `{ind['ema26'] or '---'}`\n"
+                f"  RSI14: `{ind['rsi14'] or '---'}` | ATR14: `{ind['atr14'] or '---'}`\n"
+                f"  MACD: `{ind['macd'] or '---'}` / 訊號 `{ind['macd_signal'] or '---'}` / 柱 `{ind['macd_hist'] or '---'}`\n"
+                f"  布林: `{ind['bb_lower'] or '---'}` ~ `{ind['bb_upper'] or '---'}`\n"
+                f"  20 日高/低: `{ind['high20'] or '---'}` / `{ind['low20'] or '---'}`"
+            )
         return "\n".join(lines)
 
     async def get_graphical_report_callback(self, offset=0):
-        """用於回傳圖形化報告的路徑與說明文字"""
+        """用於回傳圖形化報告的路徑列表 (清單較長時為多頁) 與說明文字"""
         report_data = await self.get_report_data(offset=offset)
         if not report_data['stock_list']:
             return None, "目前監控清單為空或資料失效。"
             
         try:
-            img_path = self.generator.generate_closing_report(report_data['sentiment'], report_data['stock_list'])
+            # 快照中已有當日報告圖片時直接沿用
+            img_paths = report_data.get('images')
+            if not img_paths:
+                img_paths = await self.renderer.closing_report_pages(report_data['sentiment'], report_data['stock_list'])
             caption = f"數據日期: `{report_data['date']}`"
-            return img_path, caption
+            return img_paths, caption
         except Exception as e:
-            print(f"回調產生圖片報告失敗: {e}")
+            log.error("回調產生圖片報告失敗: %s", e)
             return None, f"圖片生成失敗: {e}"
 
     async def get_stock_chart_callback(self, symbol):
         """用於回傳特定股票 K 線圖路徑"""
-        stats_list = self.fetcher.get_five_day_stats(symbol)
+        stats_list = await self.fetcher.aget_five_day_stats(symbol)
         if not stats_list:
             return None
             
         try:
-            img_path = self.generator.generate_stock_history_chart(symbol, stats_list)
+            img_path = await self.renderer.stock_chart(symbol, stats_list)
             return img_path
         except Exception as e:
-            print(f"回調產生 K 線圖失敗: {e}")
+            log.error("回調產生 K 線圖失敗: %s", e)
             return None
 
+    async def get_long_chart_callback(self, symbol, days=120):
+        """用於回傳特定股票長週期 K 線圖路徑"""
+        history = await asyncio.to_thread(self.fetcher.get_price_history, symbol, days)
+        if not history:
+            return None
+
+        try:
+            return await self.renderer.long_chart(symbol, history)
+        except Exception as e:
+            log.error("回調產生長週期 K 線圖失敗: %s", e)
+            return None
+
+    async def get_stock_charts_callback(self, symbols=None):
+        """
+        平行產生多檔標的 K 線圖 (未指定代碼時為整份監控清單)
+        回傳: list of (symbol, img_path)，失敗的標的 img_path 為 None
+        """
+        if not symbols:
+            items = await asyncio.to_thread(self.notion.get_monitoring_list)
+            symbols = [item['symbol'] for item in items]
+        if not symbols:
+            return []
+
+        stats_results = await asyncio.gather(
+            *(self.fetcher.aget_five_day_stats(symbol) for symbol in symbols)
+        )
+        charts = [(symbol, stats) for symbol, stats in zip(symbols, stats_results) if stats]
+        paths = await self.renderer.stock_charts(charts)
+
+        rendered = dict(zip([symbol for symbol, _ in charts], paths))
+        return [(symbol, rendered.get(symbol)) for symbol in symbols]
+
     async def get_monitoring_limits_callback(self):
         """獲取目前監控清單與警戒上下限摘要"""
-        items = self.notion.get_monitoring_list()
+        items = await asyncio.to_thread(self.notion.get_monitoring_list)
         if not items:
             return None
             
@@ -384,7 +613,7 @@ class MarketMonitor:
         """用於測試發送各種自動化報告"""
         today = self._get_now_taipei().date()
         if report_type == "noon":
-            price, ma20 = self.fetcher.get_ticker_ma("^TWII", window=20)
+            price, ma20 = await asyncio.to_thread(self.fetcher.get_ticker_ma, "^TWII", window=20)
             if price and ma20:
                 status = "📈 站上 MA20" if price >= ma20 else "📉 跌破 MA20"
                 message = (
@@ -397,11 +626,12 @@ class MarketMonitor:
                 await self.notifier.send_message(message)
                 return True
         elif report_type == "sentiment":
-            stats = self.fetcher.get_market_order_stats()
-            if stats:
-                diff_vol = stats['total_buy_volume'] - stats['total_sell_volume']
-                sentiment = "🐂 偏多" if diff_vol > 0 else "🐻 偏空"
-                overheat_index = (stats['total_deal_volume'] / stats['total_buy_volume']) * 100 if stats['total_buy_volume'] > 0 else 0
+            stats = await self.fetcher.aget_market_order_stats()
+            summary = await self.fetcher.aget_market_sentiment()
+            if stats and summary:
+                diff_vol = summary['diff_vol']
+                sentiment = summary['sentiment']
+                overheat_index = summary['overheat_index']
                 message = (
                     f"📊 **[測試] 台股全市場委託成交統計**\n\n"
                     f"• 數據日期: `{stats['date']}`\n"
@@ -410,6 +640,7 @@ class MarketMonitor:
                     f"• 總成交量: `{stats['total_deal_volume']:,}`\n"
                     f"• 買賣量差: `{diff_vol:+,}`\n"
                     f"• **過熱指數**: `{overheat_index:.2f}%` (成交/委買)\n"
+                    f"• 近 {self.fetcher.sentiment.window_seconds // 60} 分鐘買賣失衡: `{summary['imbalance']:+.2%}`\n"
                     f"• 市場氣氛: **{sentiment}**\n\n"
                     f"(統計時間: {stats['time']})"
                 )
@@ -418,11 +649,11 @@ class MarketMonitor:
         if report_type == "daily":
             report_data = await self.get_report_data(offset=0)
             try:
-                img_path = self.generator.generate_closing_report(report_data['sentiment'], report_data['stock_list'])
-                await self.notifier.send_photo(img_path, caption=f"🔔 **[測試] 監控標的盤後綜合報告**")
+                img_paths = await self.renderer.closing_report_pages(report_data['sentiment'], report_data['stock_list'])
+                await self.notifier.send_photos(img_paths, caption=f"🔔 **[測試] 監控標的盤後綜合報告**")
                 return True
             except Exception as e:
-                print(f"圖片生成失敗: {e}")
+                log.error("圖片生成失敗: %s", e)
                 summary = await self.get_detailed_summary()
                 message = f"🔔 **[測試] 監控標的盤後報告**\n\n{summary}"
                 await self.notifier.send_message(message)
@@ -432,7 +663,7 @@ class MarketMonitor:
                     
     async def send_noon_report(self):
         """執行午間報告"""
-        price, ma20 = self.fetcher.get_ticker_ma("^TWII", window=20)
+        price, ma20 = await asyncio.to_thread(self.fetcher.get_ticker_ma, "^TWII", window=20)
         if price and ma20:
             status = "📈 站上 MA20" if price >= ma20 else "📉 跌破 MA20"
             message = (
@@ -446,35 +677,120 @@ class MarketMonitor:
             return True
         return False
 
-    async def send_daily_report(self):
-        """執行盤後綜合大報告"""
-        report_data = await self.get_report_data(offset=0)
+    async def materialize_snapshot(self, report_data=None):
+        """
+        盤後快照作業：計算當日各標的摘要、市場氣氛與報告圖片並持久化
+        回傳 (report_data, img_paths)，非交易日 (資料日期不是今日) 時回傳 (report_data, None)
+        """
+        if report_data is None:
+            report_data = await self.get_report_data(offset=0)
         now = self._get_now_taipei()
         today_str = now.strftime("%Y-%m-%d")
-        
+
         # 檢查數據日期是否為今日
         if report_data['date'] != today_str:
-            print(f"[{now}] 數據日期 ({report_data['date']}) 與今日 ({today_str}) 不符，判定為休市，跳過盤後報告。")
-            return False
+            log.info("數據日期 (%s) 與今日 (%s) 不符，判定為休市，不建立快照。", report_data['date'], today_str)
+            return report_data, None
 
+        img_paths = []
         try:
-            # 嘗試生成圖片報告
-            img_path = self.generator.generate_closing_report(report_data['sentiment'], report_data['stock_list'])
-            caption = f"🏁 **台股每日盤後綜合報告 (15:00)**\n\n數據日期: `{report_data['date']}`"
-            await self.notifier.send_photo(img_path, caption=caption)
+            img_paths = await self.renderer.closing_report_pages(report_data['sentiment'], report_data['stock_list'])
         except Exception as e:
-            print(f"圖片報告生成失敗，改發送文字: {e}")
+            log.warning("快照圖片生成失敗，僅儲存數據: %s", e)
+
+        # 盤中市場氣氛時間軸 (委託成交統計序列已在記憶體中，不需額外請求)
+        timeline = self.fetcher.sentiment.timeline(today_str)
+        if timeline and img_paths:
+            try:
+                img_paths.append(await self.renderer.sentiment_timeline(timeline))
+            except Exception as e:
+                log.warning("市場氣氛時間軸生成失敗: %s", e)
+
+        snapshot = self.snapshots.save(report_data, img_paths)
+        if snapshot and snapshot['images']:
+            img_paths = snapshot['images']
+        return report_data, img_paths
+
+    async def send_daily_report(self):
+        """執行盤後綜合大報告 (同時建立當日快照)"""
+        report_data, img_paths = await self.materialize_snapshot()
+        if img_paths is None:
+            log.info("判定為休市，跳過盤後報告。")
+            return False
+
+        if img_paths:
+            caption = f"🏁 **台股每日盤後綜合報告 (15:00)**\n\n數據日期: `{report_data['date']}`"
+            await self.notifier.send_photos(img_paths, caption=caption)
+        else:
+            log.warning("圖片報告生成失敗，改發送文字。")
             # 備援發送文字報告
             sentiment_msg = ""
             if report_data['sentiment']:
                 s = report_data['sentiment']
-                sentiment_msg = f"📊 **市場氣氛: {s['sentiment']}** | 量差: `{s['diff_vol']:+,}` | 過熱: `{s['overheat_index']:.2f}%` \n\n"
+                sentiment_msg = f"📊 **市場氣氛: {s['sentiment']}** | 量差: `{s['diff_vol']:+,}` | 過熱: `{s['overheat_index']:.2f}%` | 失衡: `{s.get('imbalance', 0):+.2%}` \n\n"
             
-            summary = await self.get_detailed_summary(offset=0)
+            summary = self._format_detailed_summary(report_data)
             message = f"🏁 **台股每日盤後綜合報告 (15:00)**\n\n{sentiment_msg}📋 **監控標的摘要**\n{summary}"
             await self.notifier.send_message(message)
         return True
 
+    async def get_stats_callback(self):
+        """系統統計摘要 (供 /stats 指令使用)，含警報延遲分位數"""
+        return metrics.format_report() + tracer.format_report()
+
+    async def export_traces_callback(self):
+        """將最近的警報追蹤寫成 JSON lines 暫存檔 (供 /stats traces 使用)，回傳 (路徑, 筆數)"""
+        fd, path = tempfile.mkstemp(prefix="alert-traces-", suffix=".jsonl")
+        os.close(fd)
+        return path, await asyncio.to_thread(tracer.export, path)
+
+    async def profile_callback(self, target="check", dump=False):
+        """
+        以剖析模式執行一次作業 (供 /profile 指令使用)
+        target: check (完整價格檢查) 或 report (產生並發送圖形化報告)
+        回傳 Profile (format_report() 為各階段耗時，dump 時 files 為剖析檔路徑)
+        """
+        job = self._send_graphical_report() if target == "report" else self._check_and_flush()
+        profile = profiler.Profile(target, dump=dump)
+        await profile.run(job)
+        return profile
+
+    async def _check_and_flush(self):
+        """完整價格檢查並等待 Notion 寫入與警報發送完成 (單次模式與剖析使用)"""
+        result = await self.check_once()
+        await self.flush_outbox()
+        return result
+
+    async def flush_outbox(self, timeout=None):
+        """等待背景佇列中的 Notion 寫入與警報訊息寫完"""
+        pending = self.notion_writer.pending + self.alert_queue.pending
+        if pending:
+            log.info("等待 %s 筆 Notion 寫入與警報訊息送出...", pending)
+        done = await self.notion_writer.flush(timeout)
+        return await self.alert_queue.flush(timeout) and done
+
+    async def _send_graphical_report(self):
+        """產生並發送今日圖形化報告 (剖析 report 使用)"""
+        img_paths, caption = await self.get_graphical_report_callback(offset=0)
+        if img_paths:
+            await self.notifier.send_photos(img_paths, caption=f"📊 **即時圖形化報告**\n{caption}")
+        else:
+            await self.notifier.send_message(caption)
+
+    async def scan_callback(self, screens=None):
+        """全市場掃描 (供 /scan 指令使用)，回傳文字報告"""
+        result = await self.scanner.scan(screens)
+        return self.scanner.format_report(result)
+
+    async def send_market_scan(self):
+        """發送盤後全市場掃描結果"""
+        result = await self.scanner.scan()
+        if not result:
+            log.warning("全市場掃描失敗或本地資料不足，跳過發送。")
+            return False
+        await self.notifier.send_message(self.scanner.format_report(result))
+        return True
+
     async def send_us_closing_report(self):
         """發送美股收盤報告 (NASDAQ, S&P 500, Dow)"""
         now = self._get_now_taipei()
@@ -490,8 +806,8 @@ class MarketMonitor:
         lines = [f"🇺🇸 **美股收盤行情總結** ({date_key})\n"]
         success = False
         
-        for name, symbol in indices.items():
-            data = self.fetcher.get_last_price(symbol)
+        quotes = await asyncio.gather(*(self.fetcher.aget_last_price(symbol) for symbol in indices.values()))
+        for name, data in zip(indices, quotes):
             if data:
                 price = data['price']
                 change_pct = data.get('change_pct', 0)
@@ -503,104 +819,196 @@ class MarketMonitor:
         
         if success:
             await self.notifier.send_message("\n".join(lines))
-            print("美股收盤報告已發送。")
+            log.info("美股收盤報告已發送。")
         else:
-            print("無法獲取任何美股指數，不發送報告。")
+            log.warning("無法獲取任何美股指數，不發送報告。")
+
+    def _setup_jobs(self):
+        """註冊排程工作 (時間皆為台北時間，台股報告僅在台股交易日執行)"""
+        tw_day = lambda d: self.sessions.is_trading_day("TW", d)
+        warm_h, warm_m = (int(x) for x in self.warmup_time.split(":"))
+        self.scheduler.add_job("warmup", self.warm_up, daily_at(warm_h, warm_m, grace_minutes=10, day_filter=tw_day))
+        self.scheduler.add_job("open", self.send_open_report, daily_at(9, 0, grace_minutes=15, day_filter=tw_day))
+        self.scheduler.add_job("noon", self.send_noon_report, daily_at(12, 0, grace_minutes=15, day_filter=tw_day, retry_seconds=60))
+        self.scheduler.add_job("daily", self.send_daily_report, daily_at(15, 0, grace_minutes=20, day_filter=tw_day))
+        if self.scan_time:
+            scan_h, scan_m = (int(x) for x in self.scan_time.split(":"))
+            self.scheduler.add_job("market_scan", self.send_market_scan, daily_at(scan_h, scan_m, grace_minutes=30, day_filter=tw_day))
+        # 美股收盤報告：美股收盤 (含半日市) 後 5 分鐘
+        self.scheduler.add_job("us_close", self.send_us_closing_report, self._next_us_close_report)
+        self.scheduler.add_job("price_check", self._scheduled_price_check, self._next_price_check)
+
+    def _next_us_close_report(self, now, job):
+        """下一次美股收盤後 5 分鐘 (啟動時若剛收盤 30 分鐘內且尚未發送則立即補發)"""
+        close = self.sessions.next_close("US", now - timedelta(minutes=30))
+        if job.last_run is not None and job.last_run >= close:
+            close = self.sessions.next_close("US", close + timedelta(minutes=1))
+        if close is None:
+            return None
+        return max(now, close + timedelta(minutes=5))
+
+    def _next_market_open(self, now):
+        """回傳下一個需要監控的開盤時間 (台股或美股)"""
+        candidates = []
+        for market in ("TW", "US"):
+            if self.allow_outside:
+                start = self.sessions.next_trading_day_start(market, now)
+            else:
+                start = self.sessions.next_open(market, now, self.market_sessions[market])
+            if start is not None:
+                candidates.append(start.astimezone(self.taipei_tz))
+        # 找不到時 (行事曆異常) 一小時後再確認
+        return max(now, min(candidates)) if candidates else now + timedelta(hours=1)
+
+    def _next_price_check(self, now, job):
+        """價格檢查的下次觸發時間：開盤中依各標的輪詢優先順序，收盤時睡到下一個開盤時間"""
+        if self.is_market_open() or self.is_us_market_open():
+            # 監控清單至少每個一般間隔重新讀取一次 (以納入新增標的)
+            due = self._watchlist_time + self.interval
+            planned = self.planner.next_due_time()
+            if planned is not None:
+                due = min(due, planned)
+            return max(now, datetime.fromtimestamp(due, self.taipei_tz))
+        return self._next_market_open(now)
+
+    async def _scheduled_price_check(self):
+        """排程觸發的價格檢查 (僅檢查已到期的標的)"""
+        market_status = []
+        if self.is_market_open(): market_status.append("台股(開)")
+        if self.is_us_market_open(): market_status.append("美股(開)")
+        if not market_status:
+            log.info("非交易時段 (台/美均收) 且未開啟全天候監控，跳過自動檢查。")
+            return
+
+        # 新增的標的會在同步清單時立即到期
+        await self._get_watchlist(max_age=self.interval)
+        due = self.planner.take_due()
+        if due:
+            log.debug("執行自動價格檢查 (%s, 到期標的: %s)...", ', '.join(market_status), len(due))
+            success, fail = await self.check_once(symbols=due)
+            self._check_stats[0] += success
+            self._check_stats[1] += fail
+
+        # 彙總訊息依一般檢查間隔發送，避免高頻輪詢洗版
+        if time.time() - self.last_check_time >= self.interval:
+            self.last_check_time = time.time()
+            success, fail = self._check_stats
+            self._check_stats = [0, 0]
+            if success > 0 or fail > 0:
+                await self.notifier.send_message(f"✅ 定期價格檢查完成。成功: {success}, 失敗: {fail}")
+
+    async def send_open_report(self):
+        """09:00 開盤提醒 (附前一交易日收盤報告)"""
+        prev_summary = await self.get_detailed_summary(offset=1)
+        message = f"☀️ **台股今日開盤**！\n\n📊 **前一交易日收盤報告**\n{prev_summary}\n\n系統已開始監控..."
+        await self.notifier.send_message(message)
+
+    async def warm_up(self):
+        """
+        盤前暖機：於開盤前預先載入監控清單、台股代碼主檔、各標的日 K 歷史與技術指標
+        以及前一交易日快照，讓開盤第一分鐘的查詢全部由快取提供
+        抓取以 WARMUP_CONCURRENCY 限制並行數，避免瞬間用盡 API 額度
+        """
+        started = time.time()
+        today_str = self._get_now_taipei().strftime("%Y-%m-%d")
+
+        items = await self._get_watchlist()
+        master = await asyncio.to_thread(self.fetcher.get_symbol_master)
+
+        semaphore = asyncio.Semaphore(self.warmup_concurrency)
+
+        async def prefetch(symbol):
+            async with semaphore:
+                record = await self.fetcher.aget_daily_history(symbol, self.fetcher.HISTORY_DAYS)
+                return record is not None
+
+        symbols = list(dict.fromkeys(item['symbol'] for item in items))
+        results = await asyncio.gather(*(prefetch(symbol) for symbol in symbols), return_exceptions=True)
+        warmed = sum(1 for result in results if result is True)
+        # 一次計算整份清單的技術指標，開盤後的報告與警報直接沿用
+        with profiler.stage("indicators"):
+            indicator_set = self.fetcher.get_indicator_set()
+        indicator_count = len(indicator_set.symbols) if indicator_set else 0
+
+        snapshot = self.snapshots.get_by_offset(1, today_str)
+        snapshot_info = snapshot['date'] if snapshot else "無"
+        log.info("🔥 盤前暖機完成 (%.1fs)：監控清單 %s 檔，歷史資料 %s/%s 檔，技術指標 %s 檔，代碼主檔 %s 檔，前一交易日快照: %s", time.time() - started, len(items), warmed, len(symbols), indicator_count, len(master), snapshot_info)
 
     async def run_monitor_loop(self):
-        """背景執行的監控迴圈 (用於 Bot 模式)"""
-        print(f"監控迴圈啟動 (主檢查間隔: {self.interval} 秒，時區: 台北 UTC+8)")
-        while True:
-            try:
-                now = self._get_now_taipei()
-                today = now.date()
-                curr_time = now.time()
-                is_weekday = now.weekday() <= 4
-
-                # 1. 檢查各項定時報告
-                if is_weekday:
-                    # 09:00 開盤提醒
-                    if dt_time(9, 0) <= curr_time < dt_time(9, 15):
-                        if self.last_open_date != today:
-                            prev_summary = await self.get_detailed_summary(offset=1)
-                            message = f"☀️ **台股今日開盤**！\n\n📊 **前一交易日收盤報告**\n{prev_summary}\n\n系統已開始監控..."
-                            await self.notifier.send_message(message)
-                            self.last_open_date = today
-                    
-                    # 12:00 中午報告
-                    if dt_time(12, 0) <= curr_time < dt_time(12, 15):
-                        if self.last_noon_date != today:
-                            if await self.send_noon_report():
-                                self.last_noon_date = today
-
-                    # 15:00 盤後綜合大報告
-                    if dt_time(15, 0) <= curr_time < dt_time(15, 20):
-                        if self.last_daily_report_date != today:
-                            if await self.send_daily_report():
-                                self.last_daily_report_date = today
-                            # 無論是否發送成功，都視為已處理完畢今日任務
-                            self.last_daily_report_date = today
-
-                # 2. 處理常規價格檢查
-                import time as py_time
-                current_unix = py_time.time()
-                
-                # 只要台股或美股其中一個有開，就進入檢查
-                if self.is_market_open() or self.is_us_market_open():
-                    if current_unix - self.last_check_time >= self.interval:
-                        market_status = []
-                        if self.is_market_open(): market_status.append("台股(開)")
-                        if self.is_us_market_open(): market_status.append("美股(開)")
-                        
-                        print(f"[{now}] 執行自動價格檢查 ({', '.join(market_status)}, 間隔: {self.interval}s)...")
-                        success, fail = await self.check_once()
-                        self.last_check_time = current_unix
-                        if success > 0 or fail > 0:
-                            await self.notifier.send_message(f"✅ 定期價格檢查完成。成功: {success}, 失敗: {fail}")
-                else:
-                    if current_unix - self.last_check_time >= self.interval:
-                        print(f"[{now}] 非交易時段 (台/美均收) 且未開啟全天候監控，跳過自動檢查。")
-                        self.last_check_time = current_unix
+        """背景執行的事件驅動排程 (用於 Bot 模式)"""
+        log.info("排程啟動 (主檢查間隔: %s 秒，時區: 台北 UTC+8)", self.interval)
+        await self.scheduler.run()
 
-            except Exception as e:
-                print(f"監控迴圈發生錯誤: {e}")
-            
-            # 迴圈固定每分鐘運行一次，以確保不漏掉定時報告
-            await asyncio.sleep(60)
+    async def run_backfill(self, years, scope="watchlist"):
+        """回補最近 years 年的日 K 至本地資料庫 (scope: watchlist 監控清單 / market 全市場)"""
+        if scope == "market":
+            return await self.backfill.backfill_market(years)
+        items = await self._get_watchlist()
+        symbols = list(dict.fromkeys(item['symbol'] for item in items))
+        return await self.backfill.backfill_watchlist(symbols, years)
 
-    async def run_once(self, mode):
-        """執行單次任務 (模式: check, noon, daily)"""
-        print(f"執行單次任務: {mode}")
+    async def _run_mode(self, mode, years, scope):
         if mode == "check":
             # 在 One-shot 模式下，如果檢查到沒開盤則直接退出
             if not self.is_market_open() and not self.is_us_market_open() and not self.allow_outside:
-                print("非交易時段且未開啟強制檢查，取消本次任務。")
+                log.info("非交易時段且未開啟強制檢查，取消本次任務。")
                 return
-            await self.check_once()
+            await self._check_and_flush()
         elif mode == "noon":
             await self.send_noon_report()
         elif mode == "daily":
             await self.send_daily_report()
         elif mode == "us_daily":
             await self.send_us_closing_report()
+        elif mode == "snapshot":
+            await self.materialize_snapshot()
+        elif mode == "scan":
+            await self.send_market_scan()
+        elif mode == "backfill":
+            await self.run_backfill(years, scope)
         else:
-            print(f"不支援的模式: {mode}")
+            log.error("不支援的模式: %s", mode)
+
+    async def run_once(self, mode, years=3, scope="watchlist", profile=False, dump=False):
+        """
+        執行單次任務 (模式: check, noon, daily, backfill 等)
+        profile: 以剖析模式執行並輸出各階段耗時；dump: 另寫出 cProfile 與火焰圖堆疊檔
+        """
+        log.info("執行單次任務: %s", mode)
+        try:
+            if profile or dump:
+                result = profiler.Profile(mode, dump=dump)
+                await result.run(self._run_mode(mode, years, scope))
+                print(result.format_report())
+            else:
+                await self._run_mode(mode, years, scope)
+        finally:
+            self.renderer.shutdown()
+            await self.fetcher.async_client.aclose()
 
     def run_bot(self):
         """啟動 Telegram 機器人常駐模式 (整合背景監控迴圈)"""
-        print("Telegram 機器人常駐模式啟動中...")
+        log.info("Telegram 機器人常駐模式啟動中...")
         self._setup_callbacks()
         
         app = self.notifier.app
         if not app:
-            print("無法獲取 Telegram Application，請檢查 Token。")
+            log.error("無法獲取 Telegram Application，請檢查 Token。")
             return
 
         async def post_init(application):
             asyncio.create_task(self.run_monitor_loop())
-            print("背景監控任務已啟動。")
+            log.info("背景監控任務已啟動。")
 
+        async def post_shutdown(application):
+            await self.flush_outbox(timeout=10)
+            self.metrics_server.stop()
+            self.renderer.shutdown()
+            await self.fetcher.async_client.aclose()
+
+        self.metrics_server.start()
         app.post_init = post_init
+        app.post_shutdown = post_shutdown
         app.run_polling()
 
     def _setup_callbacks(self):
@@ -615,14 +1023,35 @@ class MarketMonitor:
         self.notifier.set_test_callback(self.test_report_callback)
         self.notifier.set_report_callback(self.get_graphical_report_callback)
         self.notifier.set_stock_chart_callback(self.get_stock_chart_callback)
+        self.notifier.set_stock_charts_callback(self.get_stock_charts_callback)
+        self.notifier.set_long_chart_callback(self.get_long_chart_callback)
         self.notifier.set_monitoring_list_callback(self.get_monitoring_limits_callback)
+        self.notifier.set_scan_callback(self.scan_callback)
+        self.notifier.set_stats_callback(self.get_stats_callback)
+        self.notifier.set_trace_export_callback(self.export_traces_callback)
+        self.notifier.set_profile_callback(self.profile_callback)
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="台美股監控系統")
-    parser.add_argument("--mode", choices=["bot", "check", "noon", "daily", "us_daily"], default="bot",
-                        help="執行模式: bot (常駐機器人), check (單次檢查), noon (午間報告), daily (台股盤後), us_daily (美股收盤)")
+    parser.add_argument("--mode", choices=["bot", "check", "noon", "daily", "us_daily", "snapshot", "scan", "backfill"], default="bot",
+                        help="執行模式: bot (常駐機器人), check (單次檢查), noon (午間報告), daily (台股盤後), us_daily (美股收盤), snapshot (僅建立盤後快照), scan (全市場掃描), backfill (回補歷史日 K)")
+    parser.add_argument("--years", type=int, default=3, help="backfill 模式回補的年數 (預設 3)")
+    parser.add_argument("--scope", choices=["watchlist", "market"], default="watchlist",
+                        help="backfill 模式的範圍: watchlist (監控清單) 或 market (全市場)")
+    parser.add_argument("--profile", action="store_true", help="以剖析模式執行單次任務，輸出各階段耗時 (bot 模式請使用 /profile)")
+    parser.add_argument("--profile-dump", action="store_true",
+                        help="剖析時另寫出 cProfile (.prof) 與火焰圖堆疊檔 (.folded) 至 PROFILE_DIR (預設 profiles/)")
+    parser.add_argument("--record", metavar="PATH", default=os.getenv("HTTP_RECORD_PATH"),
+                        help="錄製所有資料來源、Notion 與 Telegram 的 HTTP 請求至封存檔 (供 tests/benchmark.py --replay 重播)")
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "INFO"),
+                        help="日誌層級 (DEBUG 時輸出逐檔訊息，依 LOG_SAMPLE_RATE 抽樣)")
     args = parser.parse_args()
+    setup_logging(args.log_level.upper())
+
+    if args.record:
+        from http_recorder import install_recorder
+        install_recorder(args.record)
 
     monitor = MarketMonitor()
     
@@ -630,4 +1059,5 @@ if __name__ == "__main__":
         monitor.run_bot()
     else:
         # 單次執行模式
-        asyncio.run(monitor.run_once(args.mode))
+        asyncio.run(monitor.run_once(args.mode, years=args.years, scope=args.scope,
+                                     profile=args.profile, dump=args.profile_dump))
@@ -1,12 +1,20 @@
 import os
 import time
 import asyncio
+import logging
 from telegram import Update, Bot
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes
 from dotenv import load_dotenv
 
+from metrics import metrics
+
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
+# Telegram Bot API 根網址 (效能測試時指向本機的替身服務)
+TELEGRAM_BASE_URL = os.getenv("TELEGRAM_BASE_URL", "https://api.telegram.org")
+
 class Notifier:
     def __init__(self):
         self.token = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -15,12 +23,18 @@ class Notifier:
         self.app = None
         
         if self.token:
-            self.app = ApplicationBuilder().token(self.token).build()
+            self.app = (ApplicationBuilder().token(self.token)
+                        .base_url(f"{TELEGRAM_BASE_URL}/bot")
+                        .base_file_url(f"{TELEGRAM_BASE_URL}/file/bot")
+                        # 同時處理多個指令：/show、/prev、/dlist all 等待產圖時不阻塞其他指令
+                        .concurrent_updates(True)
+                        .build())
             self.app.add_handler(CommandHandler("stop", self._stop_command))
             self.app.add_handler(CommandHandler("start", self._start_command))
             self.app.add_handler(CommandHandler("alist", self._alist_command))
             self.app.add_handler(CommandHandler("list", self._list_command))
             self.app.add_handler(CommandHandler("dlist", self._dlist_command))
+            self.app.add_handler(CommandHandler("kline", self._kline_command))
             self.app.add_handler(CommandHandler("sethigh", self._set_high_command))
             self.app.add_handler(CommandHandler("setlow", self._set_low_command))
             self.app.add_handler(CommandHandler("interval", self._set_interval_command))
@@ -32,6 +46,9 @@ class Notifier:
             self.app.add_handler(CommandHandler("market", self._market_command))
             self.app.add_handler(CommandHandler("check", self._check_command)) # New command
             self.app.add_handler(CommandHandler("apicheck", self._api_usage_command)) # New command
+            self.app.add_handler(CommandHandler("scan", self._scan_command))
+            self.app.add_handler(CommandHandler("stats", self._stats_command))
+            self.app.add_handler(CommandHandler("profile", self._profile_command))
             self.app.add_handler(CommandHandler("test", self._test_command)) # New command for testing
             self.app.add_handler(CommandHandler("help", self._help_command))
             from telegram.ext import MessageHandler, filters
@@ -46,7 +63,13 @@ class Notifier:
             self.test_callback = None # New callback
             self.report_callback = None # New callback
             self.stock_chart_callback = None # New callback
+            self.stock_charts_callback = None
+            self.long_chart_callback = None
             self.monitoring_list_callback = None # New callback
+            self.scan_callback = None
+            self.stats_callback = None
+            self.trace_export_callback = None
+            self.profile_callback = None
 
     async def _debug_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         pass
@@ -60,11 +83,15 @@ class Notifier:
                 "• `/check` - 執行價格檢查 (僅在開盤時段有效)\n"
                 "• `/market` - 國際市場主要指數 (台/美/大宗)\n"
                 "• `/list [代碼]` - 查詢標的近 5 日數據分析 (台/美)\n"
+                "• `/kline [代碼] [天數]` - 長週期 K 線圖 (預設 120 日)\n"
                 "• `/show` - 監控標的即時報價清單\n"
                 "• `/showlist` - 完整清單與警報上下限\n"
-                "• `/apicheck` - 系統 API 額度與狀態\n\n"
+                "• `/apicheck` - 系統 API 額度與狀態\n"
+                "• `/stats [traces]` - 資料來源延遲、快取命中率、佇列狀態與警報延遲 (traces 匯出追蹤紀錄)\n"
+                "• `/profile [check|report] [dump]` - 剖析一次檢查或報告的各階段耗時\n\n"
                 "📋 **歷史與報告**\n"
                 "• `/prev` - 前一交易日收盤報表\n"
+                "• `/scan [條件]` - 盤後全市場掃描 (high20/low20/ma20_breakout/ma20_breakdown/volume_surge)\n"
                 "• `/test daily` - 手動觸發盤後綜合報告\n\n"
                 "⚙️ **警報管理**\n"
                 "• `/stop [代碼]` - 暫停特定標警報 (例如: `/stop 2330`)\n"
@@ -75,14 +102,14 @@ class Notifier:
                 "💡 **系統自動化 (Cron 模式)**\n"
                 "程式目前支援以排程啟動，例如：\n"
                 "• 09:00 開盤提醒 / 12:00 午報 / 15:00 台股盤後\n"
-                "• 05:05 **[New]** 美股收盤總結 (道瓊/標普/那指)\n"
-                "• **監控時段**：台股 (09:00-13:35) 與美股 (22:30-05:00)\n"
+                "• 美股收盤後 5 分鐘 美股收盤總結 (道瓊/標普/那指)\n"
+                "• **監控時段**：台股 (09:00-13:35，排除休市日) 與美股 (美東 09:30-16:00，自動處理夏令時間)\n"
                 "• 警報訊息會包含您在 Notion 設定的「上限/下限備註」。\n\n"
                 "⚠️ *如需修改系統設定，請洽詢開發者。*"
             )
             await update.message.reply_text(help_text, parse_mode='Markdown')
         except Exception as e:
-            print(f"發送 Help 訊息時發生錯誤: {e}")
+            log.exception("發送 Help 訊息時發生錯誤: %s", e)
 
     async def _prev_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not self.data_callback:
@@ -92,9 +119,9 @@ class Notifier:
         try:
             if self.report_callback:
                 await update.message.reply_text("正在產生前一交易日圖形化報告...")
-                img_path, caption = await self.report_callback(offset=1)
-                if img_path:
-                    await self.send_photo(img_path, caption=f"📊 **前一交易日收盤報告**\n{caption}")
+                img_paths, caption = await self.report_callback(offset=1)
+                if img_paths:
+                    await self.send_photos(img_paths, caption=f"📊 **前一交易日收盤報告**\n{caption}")
                     return
             
             # Fallback to text
@@ -105,7 +132,7 @@ class Notifier:
                 await update.message.reply_text(f"📊 **前一交易日收盤報告**\n\n{summary}", parse_mode='Markdown')
         except Exception as e:
             await update.message.reply_text(f"❌ 執行 /prev 時發生錯誤: {e}")
-            print(f"Error in _prev_command: {e}")
+            log.exception("Error in _prev_command: %s", e)
 
     def set_data_callback(self, callback):
         """設定用於獲取標的摘要的回呼函式"""
@@ -147,10 +174,34 @@ class Notifier:
         """設定用於獲取股票 K 線圖回呼函式"""
         self.stock_chart_callback = callback
     
+    def set_stock_charts_callback(self, callback):
+        """設定用於批次產生多檔 K 線圖回呼函式"""
+        self.stock_charts_callback = callback
+
+    def set_long_chart_callback(self, callback):
+        """設定用於獲取長週期 K 線圖回呼函式"""
+        self.long_chart_callback = callback
+
     def set_monitoring_list_callback(self, callback):
         """設定用於獲取監控清單回呼函式"""
         self.monitoring_list_callback = callback
 
+    def set_scan_callback(self, callback):
+        """設定用於全市場掃描回呼函式"""
+        self.scan_callback = callback
+
+    def set_stats_callback(self, callback):
+        """設定用於獲取系統統計回呼函式"""
+        self.stats_callback = callback
+
+    def set_trace_export_callback(self, callback):
+        """設定用於匯出警報追蹤紀錄回呼函式"""
+        self.trace_export_callback = callback
+
+    def set_profile_callback(self, callback):
+        """設定用於剖析作業回呼函式"""
+        self.profile_callback = callback
+
     async def _set_interval_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """處理 /settime 指令，設定自動檢查間隔"""
         if not context.args:
@@ -189,8 +240,8 @@ class Notifier:
             await update.message.reply_text(
                 f"✅ 設定成功：已切換為 {status}。\n\n"
                 f"目前的監控時段定義為：\n"
-                f"• 台股交易時段：週一至週五 09:00 - 13:35\n"
-                f"• 美股交易時段：台北時間週一晚至週六晨 21:00 - 06:00"
+                f"• 台股交易時段：交易日 09:00 - 13:35 (依市場行事曆排除休市日)\n"
+                f"• 美股交易時段：美東時間 09:30 - 16:00 (夏令約台北 21:30 - 04:00，冬令約 22:30 - 05:00)"
             )
 
     async def _set_high_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -253,7 +304,7 @@ class Notifier:
             
         except Exception as e:
              await update.message.reply_text(f"❌ 執行 /market 時發生錯誤: {e}")
-             print(f"Error in _market_command: {e}")
+             log.exception("Error in _market_command: %s", e)
 
     async def _check_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not self.check_callback:
@@ -276,7 +327,63 @@ class Notifier:
             await update.message.reply_text(msg)
         except Exception as e:
             await update.message.reply_text(f"❌ 執行檢查時發生錯誤: {e}")
-            print(f"Error in _check_command: {e}")
+            log.exception("Error in _check_command: %s", e)
+
+    async def _scan_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """處理 /scan 指令，執行全市場掃描 (可指定條件)"""
+        if not self.scan_callback:
+            await update.message.reply_text("系統尚未準備好，請稍後再試。")
+            return
+
+        try:
+            screens = [arg.lower() for arg in context.args] or None
+            await update.message.reply_text("🔎 正在執行全市場掃描 (首次執行需載入歷史資料)...")
+            report = await self.scan_callback(screens)
+            await update.message.reply_text(report, parse_mode='Markdown')
+        except Exception as e:
+            await update.message.reply_text(f"❌ 執行 /scan 時發生錯誤: {e}")
+            log.exception("Error in _scan_command: %s", e)
+
+    async def _stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """處理 /stats 指令，顯示各資料來源延遲、快取命中率、佇列深度與警報延遲；/stats traces 附上追蹤紀錄 (JSON lines)"""
+        if not self.stats_callback:
+            await update.message.reply_text("系統尚未準備好，請稍後再試。")
+            return
+
+        try:
+            report = await self.stats_callback()
+            await update.message.reply_text(report, parse_mode='Markdown')
+            if "traces" in [arg.lower() for arg in context.args] and self.trace_export_callback:
+                path, count = await self.trace_export_callback()
+                if not count:
+                    await update.message.reply_text("目前沒有警報追蹤紀錄。")
+                else:
+                    with open(path, 'rb') as f:
+                        await update.message.reply_document(f, caption=f"最近 {count} 則警報的追蹤紀錄")
+                os.remove(path)
+        except Exception as e:
+            await update.message.reply_text(f"❌ 執行 /stats 時發生錯誤: {e}")
+            log.exception("Error in _stats_command: %s", e)
+
+    async def _profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """處理 /profile 指令，以剖析模式執行一次價格檢查或報告，回覆各階段耗時 (dump 時附上剖析檔)"""
+        if not self.profile_callback:
+            await update.message.reply_text("系統尚未準備好，請稍後再試。")
+            return
+
+        args = [arg.lower() for arg in context.args]
+        target = "report" if "report" in args else "check"
+        try:
+            await update.message.reply_text(f"⏱ 正在以剖析模式執行 {target}...")
+            profile = await self.profile_callback(target, dump="dump" in args)
+            # 階段較多時截斷，避免超過 Telegram 訊息長度上限 (完整內容見剖析檔)
+            await update.message.reply_text(profile.format_report(limit=60), parse_mode='Markdown')
+            for path in profile.files:
+                with open(path, 'rb') as f:
+                    await update.message.reply_document(f)
+        except Exception as e:
+            await update.message.reply_text(f"❌ 執行 /profile 時發生錯誤: {e}")
+            log.exception("Error in _profile_command: %s", e)
 
     async def _api_usage_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not self.api_usage_callback:
@@ -306,7 +413,7 @@ class Notifier:
                 await update.message.reply_text(msg, parse_mode='Markdown')
         except Exception as e:
             await update.message.reply_text(f"❌ 查詢時發生錯誤: {e}")
-            print(f"Error in _api_usage_command: {e}")
+            log.exception("Error in _api_usage_command: %s", e)
 
     async def _stop_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not context.args:
@@ -349,13 +456,18 @@ class Notifier:
                 await update.message.reply_text(history_msg, parse_mode='Markdown')
         except Exception as e:
             await update.message.reply_text(f"❌ 查詢時發生錯誤: {e}")
-            print(f"Error in _list_command (history): {e}")
+            log.exception("Error in _list_command (history): %s", e)
 
     async def _dlist_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not context.args:
-            await update.message.reply_text("請提供要查詢的代碼，例如：/dlist 2330")
+            await update.message.reply_text("請提供要查詢的代碼，例如：/dlist 2330 (多檔: /dlist 2330 2317，整份清單: /dlist all)")
             return
-            
+
+        # 多檔或整份清單：交由繪圖行程池平行產生
+        if len(context.args) > 1 or context.args[0].lower() == "all":
+            await self._dlist_batch(update, context)
+            return
+
         symbol = context.args[0].upper()
         if not self.stock_chart_callback:
             await update.message.reply_text("系統尚未準備好，請稍後再試。")
@@ -370,7 +482,64 @@ class Notifier:
                 await self.send_photo(img_path, caption=f"📈 **{symbol} 五日 K 線變化圖**")
         except Exception as e:
             await update.message.reply_text(f"❌ 查詢時發生錯誤: {e}")
-            print(f"Error in _dlist_command: {e}")
+            log.exception("Error in _dlist_command: %s", e)
+
+    async def _dlist_batch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """處理多檔 /dlist 請求"""
+        if not self.stock_charts_callback:
+            await update.message.reply_text("系統尚未準備好，請稍後再試。")
+            return
+
+        symbols = None if context.args[0].lower() == "all" else [a.upper() for a in context.args]
+        try:
+            target = "監控清單" if symbols is None else f"{len(symbols)} 檔標的"
+            await update.message.reply_text(f"📊 正在平行產生{target}的五日 K 線圖...")
+            results = await self.stock_charts_callback(symbols)
+            if not results:
+                await update.message.reply_text("目前監控清單為空。")
+                return
+
+            failed = []
+            for symbol, img_path in results:
+                if img_path:
+                    await self.send_photo(img_path, caption=f"📈 **{symbol} 五日 K 線變化圖**")
+                else:
+                    failed.append(symbol)
+            if failed:
+                await update.message.reply_text(f"以下標的找不到數據或圖片生成失敗：{', '.join(failed)}")
+        except Exception as e:
+            await update.message.reply_text(f"❌ 查詢時發生錯誤: {e}")
+            log.exception("Error in _dlist_batch: %s", e)
+
+    async def _kline_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """處理 /kline 指令，產生長週期 K 線圖"""
+        if not context.args:
+            await update.message.reply_text("請提供要查詢的代碼與天數，例如：/kline 2330 250 (天數預設 120，範圍 20 ~ 1500)")
+            return
+        if not self.long_chart_callback:
+            await update.message.reply_text("系統尚未準備好，請稍後再試。")
+            return
+
+        symbol = context.args[0].upper()
+        try:
+            days = int(context.args[1]) if len(context.args) > 1 else 120
+        except ValueError:
+            await update.message.reply_text("❌ 天數請輸入數字。")
+            return
+        if not 20 <= days <= 1500:
+            await update.message.reply_text("⚠️ 天數範圍為 20 ~ 1500 個交易日。")
+            return
+
+        try:
+            await update.message.reply_text(f"📊 正在產生 {symbol} 的 {days} 日 K 線圖...")
+            img_path = await self.long_chart_callback(symbol, days)
+            if not img_path:
+                await update.message.reply_text(f"找不到 {symbol} 的數據或圖片生成失敗。")
+            else:
+                await self.send_photo(img_path, caption=f"📈 **{symbol} {days} 日 K 線圖**")
+        except Exception as e:
+            await update.message.reply_text(f"❌ 查詢時發生錯誤: {e}")
+            log.exception("Error in _kline_command: %s", e)
 
     async def _alist_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """顯示目前的暫停警報清單"""
@@ -388,9 +557,9 @@ class Notifier:
         try:
             if self.report_callback:
                 await update.message.reply_text("正在產生即時圖形化報告...")
-                img_path, caption = await self.report_callback(offset=0)
-                if img_path:
-                    await self.send_photo(img_path, caption=f"🚀 **目前監控標的即時報價**\n{caption}")
+                img_paths, caption = await self.report_callback(offset=0)
+                if img_paths:
+                    await self.send_photos(img_paths, caption=f"🚀 **目前監控標的即時報價**\n{caption}")
                     return
 
             summary = await self.data_callback()
@@ -400,7 +569,7 @@ class Notifier:
                 await update.message.reply_text(f"🚀 **目前監控標的即時報價**\n\n{summary}", parse_mode='Markdown')
         except Exception as e:
             await update.message.reply_text(f"❌ 查詢時發生錯誤: {e}")
-            print(f"Error in _show_command: {e}")
+            log.exception("Error in _show_command: %s", e)
 
     async def _show_list_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """顯示目前追蹤標的與上下限清單"""
@@ -416,7 +585,7 @@ class Notifier:
                 await update.message.reply_text(msg, parse_mode='Markdown')
         except Exception as e:
             await update.message.reply_text(f"❌ 查詢清單時發生錯誤: {e}")
-            print(f"Error in _show_list_command: {e}")
+            log.exception("Error in _show_list_command: %s", e)
 
     async def _test_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """手動觸發測試報告"""
@@ -443,31 +612,82 @@ class Notifier:
             # 我們改用更底層的方式在外部循環中處理 updater
             from telegram.ext import ExtBot
             await self.app.updater.start_polling()
-            print("Telegram 機器人指令監聽已啟動...")
+            log.info("Telegram 機器人指令監聽已啟動...")
 
     async def send_message(self, text):
+        """發送文字訊息，回傳是否成功 (警報追蹤依此記錄結果)"""
         if not self.app or not self.chat_id:
-            print("Telegram 未設定，無法發送訊息")
-            print(f"內容: {text}")
-            return
+            log.warning("Telegram 未設定，無法發送訊息")
+            log.info("內容: %s", text)
+            return False
 
         try:
-            await self.app.bot.send_message(chat_id=self.chat_id, text=text, parse_mode='Markdown')
-            print(f"Telegram 訊息已發送 (文字)")
+            with metrics.track("telegram", method="send_message"):
+                await self.app.bot.send_message(chat_id=self.chat_id, text=text, parse_mode='Markdown')
+            log.debug("Telegram 訊息已發送 (文字)")
+            return True
         except Exception as e:
-            print(f"發送 Telegram 訊息時發生錯誤: {e}")
+            log.error("發送 Telegram 訊息時發生錯誤: %s", e)
+            return False
 
     async def send_photo(self, photo_path, caption=None):
         if not self.app or not self.chat_id:
-            print("Telegram 未設定，無法發送圖片")
+            log.warning("Telegram 未設定，無法發送圖片")
             return
 
         try:
-            with open(photo_path, 'rb') as photo:
+            with metrics.track("telegram", method="send_photo"), open(photo_path, 'rb') as photo:
                 await self.app.bot.send_photo(chat_id=self.chat_id, photo=photo, caption=caption, parse_mode='Markdown')
-            print(f"Telegram 圖片已發送: {photo_path}")
+            log.debug("Telegram 圖片已發送: %s", photo_path)
         except Exception as e:
-            print(f"發送 Telegram 圖片時發生錯誤: {e}")
+            log.error("發送 Telegram 圖片時發生錯誤: %s", e)
+
+    @staticmethod
+    def _media_chunks(photo_paths, size=10):
+        """
+        將圖片平均分組，每組 2~size 張 (sendMediaGroup 須為 2~10 張)
+        例如 11 張分為 6 + 5，不會剩下單張的一組
+        """
+        groups = -(-len(photo_paths) // size)
+        if not groups:
+            return []
+        base, extra = divmod(len(photo_paths), groups)
+        chunks, start = [], 0
+        for i in range(groups):
+            end = start + base + (1 if i < extra else 0)
+            chunks.append(photo_paths[start:end])
+            start = end
+        return chunks
+
+    async def send_media_group(self, photo_paths, caption=None):
+        """以相簿 (media group) 一次發送多張圖片 (至少 2 張)，超過 10 張時平均分成多組"""
+        if not self.app or not self.chat_id:
+            log.warning("Telegram 未設定，無法發送圖片")
+            return
+
+        from contextlib import ExitStack
+        from telegram import InputMediaPhoto
+        try:
+            for n, chunk in enumerate(self._media_chunks(photo_paths)):
+                with ExitStack() as stack:
+                    media = []
+                    for i, path in enumerate(chunk):
+                        photo = stack.enter_context(open(path, 'rb'))
+                        # 說明文字只放在第一組的第一張
+                        item_caption = caption if n == 0 and i == 0 else None
+                        media.append(InputMediaPhoto(photo, caption=item_caption, parse_mode='Markdown'))
+                    with metrics.track("telegram", method="send_media_group"):
+                        await self.app.bot.send_media_group(chat_id=self.chat_id, media=media)
+            log.debug("Telegram 相簿已發送: %s 張", len(photo_paths))
+        except Exception as e:
+            log.error("發送 Telegram 相簿時發生錯誤: %s", e)
+
+    async def send_photos(self, photo_paths, caption=None):
+        """發送一或多張圖片 (單張時使用 send_photo，多張時使用相簿)"""
+        if len(photo_paths) == 1:
+            await self.send_photo(photo_paths[0], caption=caption)
+        else:
+            await self.send_media_group(photo_paths, caption=caption)
 
     def is_stopped(self, symbol):
         return symbol.upper() in self.stopped_symbols
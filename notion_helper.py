@@ -1,42 +1,58 @@
 import os
+import logging
 from notion_client import Client
 from dotenv import load_dotenv
 
+from metrics import metrics
+
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
+# Notion API 根網址 (效能測試時指向本機的替身服務)
+NOTION_BASE_URL = os.getenv("NOTION_BASE_URL", "https://api.notion.com")
+
 class NotionHelper:
     def __init__(self):
         self.token = os.getenv("NOTION_TOKEN", "").strip()
         self.database_id = os.getenv("NOTION_DATABASE_ID", "").strip()
         if self.token:
-            self.notion = Client(auth=self.token)
+            self.notion = Client(auth=self.token, base_url=NOTION_BASE_URL)
         else:
             self.notion = None
 
-    def get_monitoring_list(self):
+    def get_monitoring_list(self, raise_on_error=False):
         """
-        從 Notion 資料庫獲取所有監控標的
+        從 Notion 資料庫獲取所有監控標的 (每次查詢最多 100 筆，依 next_cursor 分頁讀取)
+        raise_on_error: 查詢失敗時拋出例外 (預設回傳空清單)，供呼叫端區分「查詢失敗」與「清單為空」
         """
         if not self.notion:
-            print("Notion 未設定，無法讀取資料")
+            log.warning("Notion 未設定，無法讀取資料")
             return []
 
         try:
             import httpx
             results = []
-            url = f"https://api.notion.com/v1/databases/{self.database_id}/query"
+            url = f"{NOTION_BASE_URL}/v1/databases/{self.database_id}/query"
             headers = {
                 "Authorization": f"Bearer {self.token}",
                 "Notion-Version": "2022-06-28",
                 "Content-Type": "application/json"
             }
             
-            with httpx.Client() as client:
-                resp = client.post(url, headers=headers)
-                resp.raise_for_status()
-                query = resp.json()
-
-            for page in query.get("results", []):
+            pages = []
+            body = {"page_size": 100}
+            with metrics.track("notion", op="query"), httpx.Client() as client:
+                while True:
+                    resp = client.post(url, headers=headers, json=body)
+                    resp.raise_for_status()
+                    query = resp.json()
+                    pages.extend(query.get("results", []))
+                    if not query.get("has_more") or not query.get("next_cursor"):
+                        break
+                    body = {"page_size": 100, "start_cursor": query["next_cursor"]}
+
+            for page in pages:
                 props = page.get("properties", {})
                 
                 # 提取欄位內容
@@ -60,28 +76,33 @@ class NotionHelper:
                     })
             return results
         except Exception as e:
-            print(f"查詢 Notion 資料庫時發生錯誤: {e}")
+            log.error("查詢 Notion 資料庫時發生錯誤: %s", e)
+            if raise_on_error:
+                raise
             return []
 
     def update_price_and_status(self, page_id, current_price, status_name):
         """
-        更新 Notion 頁面的當前價格與狀態
+        更新 Notion 頁面的當前價格與狀態，回傳是否成功
         """
         if not self.notion:
-            return
+            return False
 
         try:
             # 根據 dump_notion_schema.py 的結果，'狀態' 是 status 類型
-            self.notion.pages.update(
-                page_id=page_id,
-                properties={
-                    "當前價格": {"number": current_price},
-                    "狀態": {"status": {"name": status_name}},
-                    "更新時間": {"date": {"start": self._get_now_iso()}}
-                }
-            )
+            with metrics.track("notion", op="update_price"):
+                self.notion.pages.update(
+                    page_id=page_id,
+                    properties={
+                        "當前價格": {"number": current_price},
+                        "狀態": {"status": {"name": status_name}},
+                        "更新時間": {"date": {"start": self._get_now_iso()}}
+                    }
+                )
+            return True
         except Exception as e:
-            print(f"更新 Notion 頁面 {page_id} 時發生錯誤: {e}")
+            log.error("更新 Notion 頁面 %s 時發生錯誤: %s", page_id, e)
+            return False
 
     def _get_title(self, props, name):
         title_obj = props.get(name, {}).get("title", [])
@@ -124,13 +145,14 @@ class NotionHelper:
             return
 
         try:
-            self.notion.pages.update(
-                page_id=page_id,
-                properties=properties
-            )
-            print(f"成功更新 Notion 警戒值: {properties}")
+            with metrics.track("notion", op="update_alert"):
+                self.notion.pages.update(
+                    page_id=page_id,
+                    properties=properties
+                )
+            log.info("成功更新 Notion 警戒值: %s", properties)
         except Exception as e:
-            print(f"更新 Notion 警戒值時發生錯誤: {e}")
+            log.error("更新 Notion 警戒值時發生錯誤: %s", e)
 
 if __name__ == "__main__":
     # 簡單測試
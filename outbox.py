@@ -0,0 +1,184 @@
+import os
+import time
+import asyncio
+import contextvars
+import logging
+from collections import OrderedDict
+
+from metrics import metrics
+
+log = logging.getLogger(__name__)
+
+# 價格檢查的對外寫出佇列 (Notion 價格/狀態寫入、Telegram 警報訊息)
+# - 檢查流程只負責排入，由背景工作依各服務的速率限制寫出，檢查週期不再被逐筆的外部呼叫拖慢
+# - 同一頁面 / 同一標的尚未寫出時只保留最新一筆 (後到者覆蓋)，積壓量最多為監控清單檔數
+# - 排入時的 context 會隨工作保存，剖析中排入的寫出仍記錄在該次剖析的階段樹內
+# - 警報追蹤 (tracing.AlertTrace) 隨項目排入，寫出後補上 {佇列} queue 與寫出區段；
+#   被新項目取代的舊項目以 superseded 結束 (每個待寫出項目最多一筆追蹤，積壓時不會累積)
+
+
+class _Outbox:
+    """依鍵值合併的待寫出佇列與背景工作 (工作於首次排入時在目前的事件迴圈上啟動)"""
+    name = "outbox"
+    span_name = "write"
+
+    def __init__(self, workers):
+        self.workers = max(1, workers)
+        self._pending = OrderedDict() # 格式: {key: (payload, 排入時間, context, 追蹤, 排入時間 unix 秒)}
+        self._inflight = 0
+        self._tasks = []
+        self._loop = None
+        self._ready = None
+        self.submitted = 0
+        self.coalesced = 0
+        self.completed = 0
+
+    @property
+    def pending(self):
+        """尚未寫出的筆數 (不含寫出中)"""
+        return len(self._pending)
+
+    @property
+    def idle(self):
+        return not self._pending and not self._inflight
+
+    def _submit(self, key, payload, trace=None):
+        now = time.time()
+        if key in self._pending:
+            # 保留原排入時間與順序，佇列延遲反映最早一筆等待的時間
+            _, submitted_at, _, replaced, replaced_at = self._pending[key]
+            self.coalesced += 1
+            metrics.inc("outbox_coalesced_total", queue=self.name)
+            if replaced is not None:
+                replaced.span(f"{self.name} queue", replaced_at, now)
+                replaced.close(self.name, "superseded")
+        else:
+            submitted_at = time.perf_counter()
+        if trace is not None:
+            trace.expect(self.name)
+        self._pending[key] = (payload, submitted_at, contextvars.copy_context(), trace, now)
+        self.submitted += 1
+        self._ensure_workers()
+        self._ready.set()
+
+    def _ensure_workers(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._tasks:
+            return
+        # 事件迴圈更換時 (例如單次模式與測試各自 asyncio.run) 重新建立工作
+        self._loop = loop
+        self._ready = asyncio.Event()
+        self._tasks = [loop.create_task(self._worker(), name=f"{self.name}-{i}") for i in range(self.workers)]
+
+    async def _worker(self):
+        while True:
+            if not self._pending:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            key, (payload, submitted_at, ctx, trace, trace_submitted) = self._pending.popitem(last=False)
+            self._inflight += 1
+            dequeued = started = time.time()
+            outcome = "skipped"
+            try:
+                metrics.observe("outbox_delay_seconds", time.perf_counter() - submitted_at, queue=self.name)
+                if await self._wait_turn(key):
+                    started = time.time()
+                    outcome = "ok" if await self._deliver(key, payload, ctx) is not False else "error"
+                    self.completed += 1
+            except Exception as e:
+                outcome = "error"
+                log.error("%s 寫出 %s 時發生錯誤: %s", self.name, key, e)
+            finally:
+                self._inflight -= 1
+                if trace is not None:
+                    self._close_trace(trace, trace_submitted, dequeued, started, time.time(), outcome)
+
+    def _close_trace(self, trace, submitted, dequeued, started, done, outcome):
+        trace.span(f"{self.name} queue", submitted, dequeued)
+        if started > dequeued:
+            trace.span(f"{self.name} rate limit", dequeued, started)
+        if outcome != "skipped":
+            trace.span(self.span_name, started, done)
+        trace.close(self.name, outcome)
+
+    async def _wait_turn(self, key):
+        """寫出前的等待 (速率限制)；回傳 False 時略過此項目"""
+        return True
+
+    async def _deliver(self, key, payload, ctx):
+        """寫出一個項目；回傳 False 表示失敗 (寫出端自行處理例外時)"""
+        raise NotImplementedError
+
+    async def flush(self, timeout=None):
+        """等待佇列寫完 (單次模式結束前、剖析時使用)，逾時回傳 False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.idle:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.01)
+        return True
+
+
+class NotionWriter(_Outbox):
+    """
+    Notion 價格與狀態寫入佇列
+    以 NOTION_WRITE_CONCURRENCY 個背景工作 (預設 3，約為 Notion API 的平均速率上限) 在執行緒中寫入
+    """
+    name = "notion"
+    span_name = "notion write"
+
+    def __init__(self, notion, workers=None):
+        super().__init__(workers or int(os.getenv("NOTION_WRITE_CONCURRENCY", 3)))
+        self.notion = notion
+
+    def submit(self, page_id, price, status, trace=None):
+        self._submit(page_id, (price, status), trace)
+
+    async def _deliver(self, page_id, payload, ctx):
+        price, status = payload
+        return await asyncio.to_thread(ctx.run, self.notion.update_price_and_status, page_id, price, status)
+
+
+class TelegramQueue(_Outbox):
+    """
+    Telegram 警報訊息佇列
+    依 TELEGRAM_RATE_PER_SECOND (預設每秒 1 則) 發送，可短暫爆發 TELEGRAM_BURST 則 (預設 20)，避免大量觸發時被限流
+    同一標的只保留最新的警報內容；發送前標的已被 /stop 暫停時略過
+    """
+    name = "telegram"
+    span_name = "telegram send"
+
+    def __init__(self, notifier, rate=None, burst=None):
+        super().__init__(1)
+        self.notifier = notifier
+        self.rate = rate or float(os.getenv("TELEGRAM_RATE_PER_SECOND", 1))
+        self.burst = burst or int(os.getenv("TELEGRAM_BURST", 20))
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        self.skipped = 0
+
+    def submit(self, text, key=None, trace=None):
+        """排入訊息；key (通常為代碼) 相同且尚未發送時以新內容取代"""
+        self._submit(key if key is not None else object(), text, trace)
+
+    async def _acquire(self):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+            self._refilled = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def _wait_turn(self, key):
+        if isinstance(key, str) and self.notifier.is_stopped(key):
+            self.skipped += 1
+            return False
+        await self._acquire()
+        return True
+
+    async def _deliver(self, key, text, ctx):
+        # 在排入時的 context 中建立發送 task (Python 3.10 的 create_task 尚無 context 參數)
+        return await ctx.run(asyncio.ensure_future, self.notifier.send_message(text))
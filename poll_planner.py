@@ -0,0 +1,131 @@
+import os
+import math
+import time
+
+
+class SymbolState:
+    """單一標的的輪詢狀態"""
+    __slots__ = ("symbol", "next_due", "last_price", "last_time", "variance", "interval")
+
+    def __init__(self, symbol, now):
+        self.symbol = symbol
+        self.next_due = now
+        self.last_price = None
+        self.last_time = None
+        self.variance = None # 每秒對數報酬的變異數 (EWMA)
+        self.interval = None # 最近一次排定的輪詢間隔 (秒)
+
+
+class PollPlanner:
+    """
+    依「與警戒值的距離」與「近期波動度」決定每檔標的的下次檢查時間
+    - 預期觸及警戒值所需時間 ≈ (距離 / 每秒波動)^2，取其一部分作為輪詢間隔
+    - 接近警戒值的標的每數秒檢查一次，距離遠的標的以最長間隔檢查
+    - 以 token bucket 限制全域每分鐘請求數
+    """
+    # 尚無波動資料時的預設日波動 (2%)，換算為每秒 (台股一日約 4.5 小時)
+    DEFAULT_DAILY_VOL = 0.02
+    SESSION_SECONDS = 4.5 * 3600
+
+    def __init__(self, min_interval=None, max_interval=None, budget_per_minute=None):
+        self.min_interval = min_interval or int(os.getenv("POLL_MIN_SECONDS", 5))
+        self.max_interval = max_interval or int(os.getenv("CHECK_INTERVAL_SECONDS", 600))
+        self.budget_per_minute = budget_per_minute or int(os.getenv("POLL_BUDGET_PER_MINUTE", 60))
+        # 間隔 = 預期觸及時間 * safety (越小越保守)
+        self.safety = float(os.getenv("POLL_SAFETY_FACTOR", 0.25))
+        # EWMA 衰減係數
+        self.decay = 0.9
+
+        self.states = {}
+        self._tokens = float(self.budget_per_minute)
+        self._last_refill = time.time()
+
+    def sync(self, symbols):
+        """依目前監控清單新增 (立即到期) 或移除標的"""
+        now = time.time()
+        symbols = set(symbols)
+        for symbol in symbols:
+            if symbol not in self.states:
+                self.states[symbol] = SymbolState(symbol, now)
+        for symbol in list(self.states):
+            if symbol not in symbols:
+                del self.states[symbol]
+
+    def _refill(self, now):
+        rate = self.budget_per_minute / 60.0
+        self._tokens = min(float(self.budget_per_minute), self._tokens + (now - self._last_refill) * rate)
+        self._last_refill = now
+
+    def take_due(self, now=None):
+        """取出已到期的標的 (依到期先後排序，受請求預算限制)"""
+        now = now or time.time()
+        self._refill(now)
+        due = sorted((s for s in self.states.values() if s.next_due <= now), key=lambda s: s.next_due)
+        allowed = min(len(due), int(self._tokens))
+        self._tokens -= allowed
+        return [s.symbol for s in due[:allowed]]
+
+    def next_due_time(self, now=None):
+        """回傳下一次有標的到期且有預算可用的時間 (unix 秒)，無標的時回傳 None"""
+        if not self.states:
+            return None
+        now = now or time.time()
+        earliest = min(s.next_due for s in self.states.values())
+        if earliest <= now:
+            self._refill(now)
+            if self._tokens < 1:
+                return now + (1 - self._tokens) * 60.0 / self.budget_per_minute
+        return earliest
+
+    def _sigma(self, state):
+        """每秒波動 (標準差)"""
+        if state.variance:
+            return math.sqrt(state.variance)
+        return self.DEFAULT_DAILY_VOL / math.sqrt(self.SESSION_SECONDS)
+
+    def record(self, symbol, price, high_alert=None, low_alert=None, now=None):
+        """記錄最新價格，更新波動度並排定下次檢查時間；回傳排定的間隔秒數"""
+        now = now or time.time()
+        state = self.states.get(symbol)
+        if state is None:
+            state = self.states[symbol] = SymbolState(symbol, now)
+
+        # 更新 EWMA 波動 (以經過時間正規化為每秒)
+        if state.last_price and price and state.last_time and now > state.last_time:
+            r = math.log(price / state.last_price)
+            sample = r * r / (now - state.last_time)
+            state.variance = sample if state.variance is None else self.decay * state.variance + (1 - self.decay) * sample
+        state.last_price = price
+        state.last_time = now
+
+        interval = self._interval_for(state, price, high_alert, low_alert)
+        state.interval = interval
+        state.next_due = now + interval
+        return interval
+
+    def defer(self, symbol, now=None):
+        """市場未開盤等情況下略過的標的，以最長間隔延後"""
+        now = now or time.time()
+        state = self.states.get(symbol)
+        if state:
+            state.next_due = now + self.max_interval
+
+    def _interval_for(self, state, price, high_alert, low_alert):
+        if not price:
+            return self.max_interval
+
+        distances = []
+        if high_alert:
+            distances.append((high_alert - price) / price)
+        if low_alert:
+            distances.append((price - low_alert) / price)
+        if not distances:
+            return self.max_interval
+
+        distance = min(distances)
+        # 已在警戒範圍內：依一般間隔重複提醒即可
+        if distance <= 0:
+            return self.max_interval
+
+        expected = (distance / self._sigma(state)) ** 2
+        return max(self.min_interval, min(self.max_interval, expected * self.safety))
@@ -1,144 +1,255 @@
 import os
+import time
+import asyncio
+import logging
 import requests
 from FinMind.data import DataLoader
 from dotenv import load_dotenv
+import numpy as np
 import pandas as pd
 import yfinance as yf
 
+from async_providers import AsyncProviderClient, parse_fugle_candles, FUGLE_BASE_URL, FINMIND_USER_INFO_URL
+from quote_store import QuoteStore, HistoryStore, HistoryRecord
+from indicators import IndicatorEngine, compute_indicators
+from history_db import HistoryDatabase
+from sentiment_feed import SentimentFeed
+from market_sessions import MarketCalendar
+from metrics import metrics
+
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
 class PriceFetcher:
+    # 報告統計、五日數據與技術指標共用的日曆天數 (約 80 個交易日，足以計算 MA60 與 MACD)
+    # 盤前暖機以此長度預載歷史，各功能共用同一份快取
+    HISTORY_DAYS = 120
+
     def __init__(self):
         self.api_token = os.getenv("FINMIND_TOKEN", "").strip()
         # 支援多種可能的環境變數名稱，以相容 Railway 上的設定
         self.fugle_token = (os.getenv("FUGLE_API_TOKEN") or 
                             os.getenv("富果API KEY") or 
                             os.getenv("富果API_KEY") or "").strip()
-        self.loader = DataLoader()
-        if self.api_token:
-            print("正在使用 Token 登入 FinMind...")
-            self.loader.login_by_token(api_token=self.api_token)
-        else:
-            print("警告: 未設定 FINMIND_TOKEN，可能導致 API 存取受限或失敗")
+        if not self.api_token:
+            log.warning("未設定 FINMIND_TOKEN，可能導致 API 存取受限或失敗")
+        self._loader = None # FinMind DataLoader (同步查詢使用，首次使用時才建立)
         
         # 快取機制設定
-        self.price_cache = {} # 格式: {symbol: {"price": float, "time": datetime, "full_stats": dict}}
+        self.quotes = QuoteStore() # 最新報價 (欄位式陣列)
         self.cache_duration = int(os.getenv("CACHE_DURATION_SECONDS", 300))
 
+        # 日 K 歷史快取 (盤前暖機預先載入，開盤後的報告與均線計算直接沿用)
+        self.history = HistoryStore(max_age=int(os.getenv("HISTORY_CACHE_SECONDS", 3600)))
+        # 本地日 K 資料庫 (回補作業與每次抓取的結果)，快取失效時只需向資料來源補抓最後幾天
+        self.history_db = HistoryDatabase()
+        # 整份監控清單共用的技術指標 (依歷史快取批次計算)
+        self.indicators = IndicatorEngine(self.history, window=self.HISTORY_DAYS)
+
+        # 台股代碼主檔 (判斷上市/上櫃)，每日更新一次
+        self.symbol_master = {} # 格式: {stock_id: {"name": str, "type": "twse"/"tpex"/...}}
+        self._symbol_master_date = None
+
+        # 非同步用戶端 (aget_* 系列方法使用)
+        self.async_client = AsyncProviderClient(self.api_token, self.fugle_token)
+        # 全市場委託成交統計 (增量更新的盤中序列)
+        # 交易日行事曆 (本地歷史完整性檢查、市場氣氛資料流與監控排程共用)
+        self.calendar = MarketCalendar()
+        self.sentiment = SentimentFeed(self.async_client, self._get_taipei_now, calendar=self.calendar)
+
+    @property
+    def loader(self):
+        """
+        FinMind DataLoader；建立時會向 FinMind 查詢帳號資訊，因此延後到第一次同步查詢時才建立
+        (檢查與報告走非同步用戶端，啟動時不需連線)
+        """
+        if self._loader is None:
+            loader = DataLoader()
+            if self.api_token:
+                log.info("正在使用 Token 登入 FinMind...")
+                loader.login_by_token(api_token=self.api_token)
+            self._loader = loader
+        return self._loader
+
     def _get_taipei_now(self):
         """獲取台北時區的當前時間"""
         from datetime import datetime, timezone, timedelta
         tz = timezone(timedelta(hours=8))
         return datetime.now(tz)
 
-    def get_last_price(self, symbol):
+    def get_cached_quote(self, symbol, max_age):
+        """
+        回傳快取中 max_age 秒內抓取的報價 (不發出任何 API 請求)
+        回傳格式同 get_last_price，無可用快取時回傳 None
+        """
+        record = self.quotes.get_fresh(symbol, max_age)
+        metrics.cache("quote", record is not None)
+        return self._cached_result(record)
+
+    def _cached_result(self, record):
+        if record is None:
+            return None
+        from datetime import datetime
+        return {
+            "price": record.price,
+            "time": datetime.fromtimestamp(record.time, self._get_taipei_now().tzinfo).strftime("%H:%M:%S"),
+            "is_cached": True,
+            "received_at": record.time # 報價寫入快取的時間 (警報延遲追蹤的起點)
+        }
+
+    def get_last_price(self, symbol, max_age=None):
         """
         獲取股票或權證的最新成交價 (支援快取)
+        max_age: 可接受的快取秒數 (預設為 CACHE_DURATION_SECONDS)
         回傳: {"price": float, "time": str, "is_cached": bool} 或 None
         """
-        from datetime import datetime, timedelta
-        
         # 檢查快取
         now = self._get_taipei_now()
-        if symbol in self.price_cache:
-            cache_data = self.price_cache[symbol]
-            if now.replace(tzinfo=None) - cache_data['time'].replace(tzinfo=None) < timedelta(seconds=self.cache_duration):
-                return {
-                    "price": cache_data['price'],
-                    "time": cache_data['time'].strftime("%H:%M:%S"),
-                    "is_cached": True
-                }
+        cached = self._get_fresh_cached_price(symbol, now, max_age)
+        if cached:
+            return cached
 
         try:
             # 辨識是否為美股 (純字母代碼且不含點)
             # 特殊處理：TAIEX 應視為台股加權指數，不應進入美股判斷
-            is_us_stock = symbol.isalpha() and "." not in symbol and symbol.upper() != "TAIEX"
-            
-            if is_us_stock:
-                print(f"[{symbol}] 偵測為美股代碼，使用 yfinance 抓取即時價格...")
+            if self._is_us_symbol(symbol):
+                log.debug("偵測為美股代碼，使用 yfinance 抓取即時價格...", extra={"symbol": symbol})
                 yf_price = self._get_yfinance_price_for_us(symbol)
                 if yf_price:
-                    self.price_cache[symbol] = {
-                        "price": yf_price,
-                        "time": now
-                    }
-                    return {
-                        "price": yf_price,
-                        "time": now.strftime("%H:%M:%S"),
-                        "is_cached": False,
-                        "source": "yfinance (US)"
-                    }
+                    return self._remember_price(symbol, yf_price, now, "yfinance (US)")
 
             # 1. 優先嘗試富果 (台股)
 
             # 2. 如果富果未設定或失敗，嘗試 FinMind
-            # 取得最近幾天的資料以確保能拿到最後一筆成交價 (擴大到 14 天以應對長假)
-            end_date = now.strftime("%Y-%m-%d")
-            start_date = (now - timedelta(days=14)).strftime("%Y-%m-%d")
+            start_date, end_date = self._last_price_window(now)
+            with metrics.track("provider", provider="finmind", endpoint="TaiwanStockPrice"):
+                df = self.loader.taiwan_stock_daily(
+                    stock_id=symbol,
+                    start_date=start_date,
+                    end_date=end_date
+                )
             
-            df = self.loader.taiwan_stock_daily(
-                stock_id=symbol,
-                start_date=start_date,
-                end_date=end_date
-            )
-            
-            if df is not None and not df.empty:
-                df.columns = [c.lower() for c in df.columns]
-                if 'close' in df.columns:
-                    non_nan_df = df.dropna(subset=['close'])
-                    if not non_nan_df.empty:
-                        last_row = non_nan_df.iloc[-1]
-                        price = float(last_row['close'])
-                        date_str = str(last_row.get('date', ''))
-                        
-                        # 如果 FinMind 的最新日期不是今天，且現在是交易時間，嘗試用 yfinance 抓更即時的值
-                        today_str = now.strftime("%Y-%m-%d")
-                        if date_str != today_str and now.hour >= 9:
-                            print(f"[{symbol}] FinMind 資料僅更新至 {date_str}，嘗試使用 yfinance 獲取今日即時價...")
-                            yf_price = self._get_yfinance_price(symbol)
-                            if yf_price:
-                                price = yf_price
-                                date_str = today_str # 標記為今日
-
-                        # 更新快取
-                        self.price_cache[symbol] = {
-                            "price": price,
-                            "time": now
-                        }
-                        return {
-                            "price": price,
-                            "time": now.strftime("%H:%M:%S"),
-                            "is_cached": False,
-                            "source": "FinMind/yF"
-                        }
+            last = self._last_close(df)
+            if last:
+                price, date_str = last
+                if self._needs_intraday_price(date_str, now):
+                    log.debug("FinMind 資料僅更新至 %s，嘗試使用 yfinance 獲取今日即時價...", date_str, extra={"symbol": symbol})
+                    metrics.fallback("finmind", "yfinance")
+                    price = self._get_yfinance_price(symbol) or price
+                return self._remember_price(symbol, price, now, "FinMind/yF")
             
             # 3. 最後備援：直接用 yfinance
-            # TAIEX 符號特殊處理，對應到 yfinance 的 ^TWII
-            yf_symbol = symbol
-            if symbol.upper() == "TAIEX" or symbol.upper() == "加權指數":
-                yf_symbol = "^TWII"
-                
-            yf_price = self._get_yfinance_price(yf_symbol)
+            metrics.fallback("finmind", "yfinance")
+            yf_price = self._get_yfinance_price(self._yfinance_fallback_symbol(symbol))
             if yf_price:
-                return {
-                    "price": yf_price,
-                    "time": now.strftime("%H:%M:%S"),
-                    "is_cached": False,
-                    "source": "yfinance"
-                }
+                return self._price_result(yf_price, now, "yfinance")
 
-            print(f"[{symbol}] 所有來源與備援 yfinance 均未回傳資料。")
+            log.warning("所有來源與備援 yfinance 均未回傳資料。", extra={"symbol": symbol})
             return None
         except KeyError as e:
-            if str(e) == "'data'":
-                print(f"[{symbol}] 獲取失敗: API 回傳格式錯誤 (KeyError: 'data')。這通常是因為未設定 FINMIND_TOKEN 或已達 API 使用上限。")
-            else:
-                print(f"獲取價格時發生 KeyError: {e}")
+            self._report_key_error(symbol, e, "獲取價格")
             return None
         except Exception as e:
-            print(f"獲取價格時發生錯誤: {e}")
+            log.error("獲取價格時發生錯誤: %s", e, extra={"symbol": symbol})
             return None
 
+    async def aget_last_price(self, symbol, max_age=None):
+        """get_last_price 的非同步版本 (FinMind 走共用連線池，yfinance 於執行緒中執行)"""
+        now = self._get_taipei_now()
+        cached = self._get_fresh_cached_price(symbol, now, max_age)
+        if cached:
+            return cached
+
+        try:
+            if self._is_us_symbol(symbol):
+                yf_price = await asyncio.to_thread(self._get_yfinance_price_for_us, symbol)
+                if yf_price:
+                    return self._remember_price(symbol, yf_price, now, "yfinance (US)")
+
+            start_date, end_date = self._last_price_window(now)
+            df = await self.async_client.taiwan_stock_daily(symbol, start_date, end_date)
+
+            last = self._last_close(df)
+            if last:
+                price, date_str = last
+                if self._needs_intraday_price(date_str, now):
+                    metrics.fallback("finmind", "yfinance")
+                    price = await asyncio.to_thread(self._get_yfinance_price, symbol) or price
+                return self._remember_price(symbol, price, now, "FinMind/yF")
+
+            metrics.fallback("finmind", "yfinance")
+            yf_price = await asyncio.to_thread(self._get_yfinance_price, self._yfinance_fallback_symbol(symbol))
+            if yf_price:
+                return self._price_result(yf_price, now, "yfinance")
+
+            log.warning("所有來源與備援 yfinance 均未回傳資料。", extra={"symbol": symbol})
+            return None
+        except KeyError as e:
+            self._report_key_error(symbol, e, "獲取價格")
+            return None
+        except Exception as e:
+            log.error("獲取價格時發生錯誤: %s", e, extra={"symbol": symbol})
+            return None
+
+    @staticmethod
+    def _is_us_symbol(symbol):
+        return symbol.isalpha() and "." not in symbol and symbol.upper() != "TAIEX"
+
+    @staticmethod
+    def _yfinance_fallback_symbol(symbol):
+        # TAIEX 符號特殊處理，對應到 yfinance 的 ^TWII
+        if symbol.upper() == "TAIEX" or symbol.upper() == "加權指數":
+            return "^TWII"
+        return symbol
+
+    @staticmethod
+    def _last_price_window(now):
+        # 取得最近幾天的資料以確保能拿到最後一筆成交價 (擴大到 14 天以應對長假)
+        from datetime import timedelta
+        return (now - timedelta(days=14)).strftime("%Y-%m-%d"), now.strftime("%Y-%m-%d")
+
+    @staticmethod
+    def _last_close(df):
+        """回傳日 K 最後一筆有效收盤價 (price, date_str)，無資料時回傳 None"""
+        record = HistoryRecord.from_frame(None, df)
+        if record is None:
+            return None
+        return float(record.close[-1]), record.date_str(-1)
+
+    @staticmethod
+    def _needs_intraday_price(date_str, now):
+        # 如果 FinMind 的最新日期不是今天，且現在是交易時間，需以 yfinance 抓更即時的值
+        return date_str != now.strftime("%Y-%m-%d") and now.hour >= 9
+
+    def _get_fresh_cached_price(self, symbol, now, max_age):
+        cache_seconds = self.cache_duration if max_age is None else min(max_age, self.cache_duration)
+        record = self.quotes.get_fresh(symbol, cache_seconds, now.timestamp())
+        metrics.cache("quote", record is not None)
+        return self._cached_result(record)
+
+    @staticmethod
+    def _price_result(price, now, source):
+        return {
+            "price": price,
+            "time": now.strftime("%H:%M:%S"),
+            "is_cached": False,
+            "source": source,
+            "received_at": time.time()
+        }
+
+    def _remember_price(self, symbol, price, now, source):
+        """更新報價快取並回傳報價結果"""
+        self.quotes.set(symbol, price, now.timestamp())
+        return self._price_result(price, now, source)
+
+    @staticmethod
+    def _report_key_error(symbol, e, action):
+        if str(e) == "'data'":
+            log.warning("獲取失敗: API 回傳格式錯誤 (KeyError: 'data')。這通常是因為未設定 FINMIND_TOKEN 或已達 API 使用上限。", extra={"symbol": symbol})
+        else:
+            log.error("%s時發生 KeyError: %s", action, e)
+
     def _get_fugle_snapshot(self, symbol):
         """
         使用富果 Fugle API 作為備用方案獲取最新行情
@@ -147,15 +258,19 @@ class PriceFetcher:
             return None
         
         try:
-            url = f"https://api.fugle.tw/marketdata/v1.0/stock/snapshot/{symbol}"
+            url = f"{FUGLE_BASE_URL}/stock/snapshot/{symbol}"
             headers = {"X-API-KEY": self.fugle_token}
-            response = requests.get(url, headers=headers, timeout=10)
+            with metrics.track("provider", provider="fugle", endpoint="snapshot") as call:
+                response = requests.get(url, headers=headers, timeout=10)
+                if response.status_code != 200:
+                    call["outcome"] = f"http_{response.status_code}"
             if response.status_code == 200:
                 data = response.json()
                 # 富果 API v1.0 使用 camelCase: closePrice, lastPrice, openPrice...
                 price = data.get('lastPrice') or data.get('closePrice') or data.get('last_price') or data.get('close')
                 
-                print(f"🔍 [DEBUG] Fugle Snapshot ({symbol}): 獲取到價格={price} (API原始資料: {data})")
+                # 原始資料只在 debug 層級開啟時才會格式化
+                log.debug("Fugle Snapshot 獲取到價格=%s (API原始資料: %s)", price, data, extra={"symbol": symbol})
                 
                 if price:
                     return {
@@ -166,7 +281,7 @@ class PriceFetcher:
                     }
             return None
         except Exception as e:
-            print(f"[{symbol}] Fugle Snapshot 備援失敗: {e}")
+            log.warning("Fugle Snapshot 備援失敗: %s", e, extra={"symbol": symbol})
             return None
 
     def _get_yfinance_price_for_us(self, symbol):
@@ -174,16 +289,17 @@ class PriceFetcher:
         獲取美股即時價格
         """
         try:
-            ticker = yf.Ticker(symbol)
-            info = ticker.fast_info
-            if hasattr(info, 'last_price') and info.last_price:
-                return float(info.last_price)
-            hist = ticker.history(period="1d", interval="1m")
+            with metrics.track("provider", provider="yfinance", endpoint="quote"):
+                ticker = yf.Ticker(symbol)
+                info = ticker.fast_info
+                if hasattr(info, 'last_price') and info.last_price:
+                    return float(info.last_price)
+                hist = ticker.history(period="1d", interval="1m")
             if not hist.empty:
                 return float(hist.iloc[-1]['Close'])
             return None
         except Exception as e:
-            print(f"[{symbol}] yfinance 美股獲取失敗: {e}")
+            log.warning("yfinance 美股獲取失敗: %s", e, extra={"symbol": symbol})
             return None
 
     def _get_yfinance_price(self, symbol):
@@ -196,26 +312,56 @@ class PriceFetcher:
             if symbol.upper() == "TAIEX" or symbol == "^TWII":
                 ticker_symbol = "^TWII"
             elif symbol.isdigit() or (len(symbol) >= 4 and symbol[:4].isdigit()):
-                ticker_symbol = f"{symbol}.TW"
-                if len(symbol) == 4 and symbol.startswith('6'): # 簡略判定上櫃
-                    ticker_symbol = f"{symbol}.TWO"
+                ticker_symbol = f"{symbol}{self._yfinance_suffix(symbol)}"
                 
-            ticker = yf.Ticker(ticker_symbol)
-            # 取得即時報價資訊
-            info = ticker.fast_info
-            if hasattr(info, 'last_price') and info.last_price and not pd.isna(info.last_price):
-                return float(info.last_price)
-            
-            # 如果 fast_info 失敗，嘗試 history
-            hist = ticker.history(period="1d", interval="1m")
+            with metrics.track("provider", provider="yfinance", endpoint="quote"):
+                ticker = yf.Ticker(ticker_symbol)
+                # 取得即時報價資訊
+                info = ticker.fast_info
+                if hasattr(info, 'last_price') and info.last_price and not pd.isna(info.last_price):
+                    return float(info.last_price)
+
+                # 如果 fast_info 失敗，嘗試 history
+                hist = ticker.history(period="1d", interval="1m")
             if not hist.empty:
                 return float(hist.iloc[-1]['Close'])
             
             return None
         except Exception as e:
-            print(f"[{symbol}] yfinance 獲取失敗: {e}")
+            log.warning("yfinance 獲取失敗: %s", e, extra={"symbol": symbol})
             return None
 
+    def get_symbol_master(self):
+        """
+        取得台股代碼主檔 (FinMind TaiwanStockInfo)，每日最多抓取一次
+        回傳: {stock_id: {"name": str, "type": str}}，失敗時回傳目前已有的資料
+        """
+        today_str = self._get_taipei_now().strftime("%Y-%m-%d")
+        if self._symbol_master_date == today_str:
+            return self.symbol_master
+        # 失敗時同樣記錄日期，避免每次報價都重試
+        self._symbol_master_date = today_str
+        try:
+            with metrics.track("provider", provider="finmind", endpoint="TaiwanStockInfo"):
+                df = self.loader.taiwan_stock_info()
+            if df is not None and not df.empty:
+                self.symbol_master = {
+                    str(stock_id): {"name": name, "type": market_type}
+                    for stock_id, name, market_type in zip(df['stock_id'], df['stock_name'], df['type'])
+                }
+                log.info("✅ 已載入台股代碼主檔 (%s 檔)", len(self.symbol_master))
+        except Exception as e:
+            log.warning("載入台股代碼主檔失敗: %s", e)
+        return self.symbol_master
+
+    def _yfinance_suffix(self, symbol):
+        """依代碼主檔決定 yfinance 的市場後綴 (上櫃 .TWO，其餘 .TW)"""
+        info = self.get_symbol_master().get(symbol)
+        if info:
+            return ".TWO" if info['type'] == "tpex" else ".TW"
+        # 主檔無資料時沿用簡略判定
+        return ".TWO" if len(symbol) == 4 and symbol.startswith('6') else ".TW"
+
     def _get_fugle_historical(self, symbol, start_date, end_date):
         """
         使用富果 Fugle API 獲取歷史 K 線資料，並轉換為 DataFrame 格式
@@ -224,229 +370,356 @@ class PriceFetcher:
             return None
         
         try:
-            url = f"https://api.fugle.tw/marketdata/v1.0/stock/historical/candles/{symbol}"
+            url = f"{FUGLE_BASE_URL}/stock/historical/candles/{symbol}"
             params = {"from": start_date, "to": end_date, "fields": "open,high,low,close,volume"}
             headers = {"X-API-KEY": self.fugle_token}
-            response = requests.get(url, params=params, headers=headers, timeout=10)
-            
+            with metrics.track("provider", provider="fugle", endpoint="candles") as call:
+                response = requests.get(url, params=params, headers=headers, timeout=10)
+                if response.status_code != 200:
+                    call["outcome"] = f"http_{response.status_code}"
+
             if response.status_code == 200:
-                data = response.json()
-                candles = data.get('candles', [])
-                if not candles:
-                    return None
-                
-                df = pd.DataFrame(candles)
-                # 重新命名欄位以符合後續邏輯 (Fugle: date, open, high, low, close, volume)
-                df = df.rename(columns={'volume': 'trading_volume'})
-                df.columns = [c.lower() for c in df.columns]
-                # Fugle 的資料通常是從新到舊，需翻轉
-                df = df.iloc[::-1].reset_index(drop=True)
-                return df
+                return parse_fugle_candles(response.json())
             return None
         except Exception as e:
-            print(f"[{symbol}] Fugle Historical 備援發生錯誤: {e}")
+            log.warning("Fugle Historical 備援發生錯誤: %s", e, extra={"symbol": symbol})
             return None
 
-    def get_five_day_stats(self, symbol):
+    def _fetch_history_df(self, symbol, start_date_str, end_date_str):
         """
-        獲取股票最近五個交易日的詳細數據 (含 MA5, MA20)
+        依市場選擇資料來源抓取日 K 歷史資料 (美股: yfinance，台股: 富果 -> FinMind)
+        回傳: (DataFrame 或 None, 來源標籤)
         """
-        try:
-            from datetime import datetime, timedelta
-            # 獲取約 40 天的資料以確保計算出 MA20
-            end_date_str = datetime.now().strftime("%Y-%m-%d")
-            start_date_str = (datetime.now() - timedelta(days=40)).strftime("%Y-%m-%d")
-            
-            # 辨識是否為美股
-            is_us_stock = symbol.isalpha() and "." not in symbol
-            
-            df = None
-            if is_us_stock:
-                print(f"[{symbol}] 偵測為美股代碼，使用 yfinance 獲取歷史數據...")
-                ticker = yf.Ticker(symbol)
-                df = ticker.history(start=start_date_str, end=end_date_str)
+        # 辨識是否為美股
+        is_us_stock = symbol.isalpha() and "." not in symbol
+
+        df = None
+        source_tag = None
+        if is_us_stock:
+            log.debug("偵測為美股代碼，使用 yfinance 獲取歷史數據...", extra={"symbol": symbol})
+            with metrics.track("provider", provider="yfinance", endpoint="history"):
+                df = yf.Ticker(symbol).history(start=start_date_str, end=end_date_str)
+            if df is not None and not df.empty:
+                df.columns = [c.lower() for c in df.columns]
+                # yfinance 的日期在索引
+                df = df.reset_index()
+                df = df.rename(columns={'Date': 'date', 'Volume': 'trading_volume'})
+                source_tag = "yfinance (US)"
+        else:
+            # 1. 優先嘗試富果 (台股)
+            if self.fugle_token:
+                df = self._get_fugle_historical(symbol, start_date_str, end_date_str)
                 if df is not None and not df.empty:
-                    df.columns = [c.lower() for c in df.columns]
-                    # yfinance 的日期在索引
-                    df = df.reset_index()
-                    df = df.rename(columns={'Date': 'date', 'Volume': 'trading_volume'})
-                    source_tag = "yfinance (US)"
-            else:
-                # 1. 優先嘗試富果 (台股)
+                     source_tag = "Fugle"
+
+            # 2. 如果富果失敗或未設定，嘗試 FinMind
+            if df is None or df.empty:
                 if self.fugle_token:
-                    df = self._get_fugle_historical(symbol, start_date_str, end_date_str)
-                    if df is not None and not df.empty:
-                         source_tag = "Fugle"
-                
-                # 2. 如果富果失敗或未設定，嘗試 FinMind
-                if df is None or df.empty:
+                    metrics.fallback("fugle", "finmind")
+                with metrics.track("provider", provider="finmind", endpoint="TaiwanStockPrice"):
                     df = self.loader.taiwan_stock_daily(
                         stock_id=symbol,
                         start_date=start_date_str,
                         end_date=end_date_str
                     )
-                    source_tag = "FinMind"
+                source_tag = "FinMind"
 
-            if df is not None and not df.empty:
-                # 統一欄位名稱為小寫
-                df.columns = [c.lower() for c in df.columns]
-                
-                # 計算 MA5 與 MA20
-                df['ma5'] = df['close'].rolling(window=5).mean()
-                df['ma20'] = df['close'].rolling(window=20).mean()
-                
-                # 取得最後 5 筆
-                last_5_days = df.tail(5).copy()
-                
-                stats_list = []
-                cols = df.columns.tolist()
-                
-                for _, row in last_5_days.iterrows():
-                    high_val = row.get('max') if 'max' in cols else row.get('high', 0)
-                    low_val = row.get('min') if 'min' in cols else row.get('low', 0)
-                    
-                    stats_list.append({
-                        "date": row.get('date', '未知'),
-                        "open": float(row.get('open', 0)),
-                        "close": float(row.get('close', 0)),
-                        "high": float(high_val),
-                        "low": float(low_val),
-                        "volume": int(row.get('trading_volume', 0)),
-                        "ma5": round(float(row.get('ma5', 0)), 2) if not pd.isna(row.get('ma5')) else None,
-                        "ma20": round(float(row.get('ma20', 0)), 2) if not pd.isna(row.get('ma20')) else None,
-                        "fetch_time": datetime.now().strftime("%H:%M:%S")
-                    })
-                
-                return stats_list
+        return df, source_tag
+
+    def get_daily_history(self, symbol, calendar_days):
+        """
+        取得最近 calendar_days 個日曆天的日 K 資料 (優先使用歷史快取)
+        快取範圍較大時直接沿用，多出的前段資料不影響均線計算
+        快取失效時若本地資料庫已涵蓋查詢起點，只向資料來源補抓資料庫最後一日之後的資料
+        回傳: HistoryRecord (唯讀，快取中的陣列不可修改) 或 None
+        """
+        from datetime import timedelta
+        now = self._get_taipei_now()
+        start_date_str = (now - timedelta(days=calendar_days)).strftime("%Y-%m-%d")
+        record = self.history.get(symbol, start_date_str)
+        metrics.cache("history", record is not None)
+        if record is not None:
+            return record
+
+        stored = self._load_stored_history(symbol, start_date_str)
+        fetch_start = stored.date_str(-1) if stored else start_date_str
+        df, source_tag = self._fetch_history_df(symbol, fetch_start, now.strftime("%Y-%m-%d"))
+        fetched = HistoryRecord.from_frame(symbol, df, start=fetch_start, source=source_tag)
+        self._persist_history(fetched)
+        return self._store_daily_history(symbol, fetched, stored, start_date_str)
+
+    async def aget_daily_history(self, symbol, calendar_days):
+        """get_daily_history 的非同步版本 (本地資料庫讀寫於執行緒中執行)"""
+        from datetime import timedelta
+        now = self._get_taipei_now()
+        start_date_str = (now - timedelta(days=calendar_days)).strftime("%Y-%m-%d")
+        record = self.history.get(symbol, start_date_str)
+        metrics.cache("history", record is not None)
+        if record is not None:
+            return record
+
+        stored = await asyncio.to_thread(self._load_stored_history, symbol, start_date_str)
+        fetch_start = stored.date_str(-1) if stored else start_date_str
+        df, source_tag = await self.afetch_history_df(symbol, fetch_start, now.strftime("%Y-%m-%d"))
+        fetched = HistoryRecord.from_frame(symbol, df, start=fetch_start, source=source_tag)
+        await asyncio.to_thread(self._persist_history, fetched)
+        return self._store_daily_history(symbol, fetched, stored, start_date_str)
+
+    async def afetch_history_df(self, symbol, start_date_str, end_date_str):
+        """_fetch_history_df 的非同步版本 (台股: 富果 -> FinMind；美股 yfinance 於執行緒中執行)"""
+        if symbol.isalpha() and "." not in symbol:
+            return await asyncio.to_thread(self._fetch_history_df, symbol, start_date_str, end_date_str)
+
+        if self.fugle_token:
+            try:
+                df = await self.async_client.fugle_candles(symbol, start_date_str, end_date_str)
+                if df is not None and not df.empty:
+                    return df, "Fugle"
+            except Exception as e:
+                log.warning("Fugle Historical 備援發生錯誤: %s", e, extra={"symbol": symbol})
+            metrics.fallback("fugle", "finmind")
+        df = await self.async_client.taiwan_stock_daily(symbol, start_date_str, end_date_str)
+        return df, "FinMind"
+
+    def _load_stored_history(self, symbol, start_date_str):
+        """
+        本地資料庫中涵蓋查詢起點的歷史，未回補 (或資料庫無法讀取) 時回傳 None
+        資料筆數少於區間內的交易日數 (中間有缺漏) 時，只回傳第一個缺漏日之前的部分，由呼叫端自該處補抓
+        """
+        try:
+            stored = self.history_db.record(symbol, start_date_str)
+        except Exception as e:
+            log.warning("讀取本地歷史資料庫失敗: %s", e, extra={"symbol": symbol})
+            return None
+        # 第一筆須在查詢起點後一週內 (容許長假)，否則視為資料庫未涵蓋此區間
+        if stored is None or stored.dates[0] - np.datetime64(start_date_str) > np.timedelta64(7, 'D'):
+            stored = None
+        else:
+            gap = self._first_missing_day(symbol, stored)
+            if gap is not None:
+                log.debug("本地歷史自 %s 起有缺漏，補抓缺漏區間", gap, extra={"symbol": symbol})
+                stored = stored.before(gap)
+        metrics.cache("history_db", stored is not None)
+        return stored
+
+    def _first_missing_day(self, symbol, record):
+        """
+        紀錄首尾之間第一個缺少資料的交易日 (datetime64[D])，沒有缺漏時回傳 None
+        只檢查行事曆確知休市安排的日期 (未載入該年度台股休市日時不檢查，避免把國定假日當成缺漏而重複補抓)
+        """
+        from datetime import timedelta
+        market = self.calendar.market_for_symbol(symbol)
+        first, last = record.dates[0].item(), record.dates[-1].item()
+        have = set(record.dates.tolist())
+        for i in range((last - first).days + 1):
+            d = first + timedelta(days=i)
+            if d not in have and self.calendar.covers(market, d) and self.calendar.is_trading_day(market, d):
+                return np.datetime64(d, 'D')
+        return None
+
+    def _persist_history(self, record):
+        """將抓取結果寫入本地資料庫 (失敗不影響查詢)"""
+        if record is None:
+            return
+        try:
+            self.history_db.upsert_record(record)
+        except Exception as e:
+            log.warning("寫入本地歷史資料庫失敗: %s", e, extra={"symbol": record.symbol})
+
+    def _store_daily_history(self, symbol, fetched, stored, start_date_str):
+        """合併本地資料庫與新抓取的紀錄並寫入歷史快取"""
+        record = stored.merged(fetched) if stored is not None and fetched is not None else (fetched or stored)
+        if record is not None:
+            record.start = start_date_str
+            self.history.put(record)
+        return record
+
+    def get_price_history(self, symbol, days=120):
+        """
+        獲取最近 N 個交易日的日 K 資料 (供長週期 K 線圖使用)
+        回傳: {"dates": [str], "open"/"high"/"low"/"close"/"volume": np.ndarray} 或 None
+        均線需要前置資料，因此會多抓 60 個交易日，並以 "start" 標示顯示區間起點
+        """
+        try:
+            warmup = 60
+            # 交易日約為日曆日的 0.68 倍，多抓一些以應對長假
+            calendar_days = int((days + warmup) * 1.5) + 10
+
+            record = self.get_daily_history(symbol, calendar_days)
+            if record is None:
+                return None
+
+            return {
+                "dates": record.dates.astype(str).tolist(),
+                "open": record.open,
+                "high": record.high,
+                "low": record.low,
+                "close": record.close,
+                "volume": record.volume,
+                "start": max(0, len(record) - days),
+                "source": record.source
+            }
+        except Exception as e:
+            log.error("獲取 %s 日歷史資料時發生錯誤: %s", days, e, extra={"symbol": symbol})
+            return None
+
+    def get_five_day_stats(self, symbol):
+        """
+        獲取股票最近五個交易日的詳細數據 (含 MA5, MA20)
+        """
+        try:
+            record = self.get_daily_history(symbol, self.HISTORY_DAYS)
+            if record is not None:
+                return self._five_day_stats(record)
             return None
         except KeyError as e:
-            if str(e) == "'data'":
-                print(f"[{symbol}] 獲取失敗: API 回傳格式錯誤 (KeyError: 'data')。這通常是因為未設定 FINMIND_TOKEN 或已達 API 使用上限。")
-            else:
-                print(f"獲取 5 日統計資料時發生 KeyError: {e}")
+            self._report_key_error(symbol, e, "獲取 5 日統計資料")
             return None
         except Exception as e:
-            print(f"獲取 5 日統計資料時發生錯誤: {e}")
+            log.error("獲取 5 日統計資料時發生錯誤: %s", e)
             return None
 
-    def get_full_stats(self, symbol, offset=0):
+    async def aget_five_day_stats(self, symbol):
+        """get_five_day_stats 的非同步版本"""
+        try:
+            record = await self.aget_daily_history(symbol, self.HISTORY_DAYS)
+            if record is not None:
+                return self._five_day_stats(record)
+            return None
+        except KeyError as e:
+            self._report_key_error(symbol, e, "獲取 5 日統計資料")
+            return None
+        except Exception as e:
+            log.error("獲取 5 日統計資料時發生錯誤: %s", e)
+            return None
+
+    @staticmethod
+    def _round_or_none(value):
+        return None if np.isnan(value) else round(float(value), 2)
+
+    def _five_day_stats(self, record):
+        from datetime import datetime
+        # MA5 與 MA20 取自共用指標結果，取得最後 5 筆；共用結果不是這份歷史算出的則單獨計算，確保與日期對齊
+        tail = slice(max(0, len(record) - 5), len(record))
+        indicator_set = self.get_indicator_set([record.symbol])
+        if indicator_set is None or not indicator_set.is_current(record):
+            indicator_set = compute_indicators([record], self.HISTORY_DAYS) if len(record) else None
+        if indicator_set is not None:
+            ma5 = indicator_set.values(record.symbol, "ma5", last=5)
+            ma20 = indicator_set.values(record.symbol, "ma20", last=5)
+        else:
+            ma5 = ma20 = np.full(tail.stop - tail.start, np.nan)
+        fetch_time = datetime.now().strftime("%H:%M:%S")
+
+        return [
+            {
+                "date": date,
+                "open": float(o),
+                "close": float(c),
+                "high": float(h),
+                "low": float(l),
+                "volume": int(v),
+                "ma5": self._round_or_none(m5),
+                "ma20": self._round_or_none(m20),
+                "fetch_time": fetch_time
+            }
+            for date, o, c, h, l, v, m5, m20 in zip(
+                record.dates[tail].astype(str).tolist(), record.open[tail], record.close[tail],
+                record.high[tail], record.low[tail], record.volume[tail], ma5, ma20
+            )
+        ]
+
+    def get_full_stats(self, symbol, offset=0, latest=None):
         """
         獲取股票的完整統計資訊：開盤、收盤、最高、最低、MA20
         offset=0 為最新資料 (當日), offset=1 為前一日資料
+        latest: 本輪已取得的即時報價 (提供時不再另外呼叫 get_last_price)
         """
         try:
-            from datetime import datetime, timedelta
             now = self._get_taipei_now()
-            # 獲取約 60 天的資料以確保計算出 MA20
-            end_date_str = now.strftime("%Y-%m-%d")
-            start_date_str = (now - timedelta(days=65)).strftime("%Y-%m-%d")
-            
-            # 1. 優先嘗試富果
-            df = None
-            if self.fugle_token:
-                df = self._get_fugle_historical(symbol, start_date_str, end_date_str)
-            
-            # 2. 如果富果失敗或未設定，嘗試 FinMind
-            if df is None or df.empty:
-                df = self.loader.taiwan_stock_daily(
-                    stock_id=symbol,
-                    start_date=start_date_str,
-                    end_date=end_date_str
-                )
+            # 富果 -> FinMind，優先使用歷史快取
+            record = self.get_daily_history(symbol, self.HISTORY_DAYS)
             
-            if df is not None and not df.empty:
-                # 統一欄位名稱為小寫
-                df.columns = [c.lower() for c in df.columns]
-                cols = df.columns.tolist()
-                
-                # 確保必要欄位存在
-                if 'close' not in cols:
-                    print(f"[{symbol}] 缺乏 'close' 欄位。可用欄位: {cols}")
-                    return None
-
-                # --- [強制更新今日即時數據] ---
-                today_str = now.strftime("%Y-%m-%d")
-                
-                # 如果現在是台北時間 09:00 後，嘗試補齊或更新今日數據
-                if now.hour >= 9:
+            if record is not None:
+                # 如果現在是台北時間 09:00 後，需以即時報價補齊或更新今日數據
+                if now.hour >= 9 and latest is None:
                     latest = self.get_last_price(symbol)
-                    if latest:
-                        history_last_date = str(df.iloc[-1].get('date', ''))
-                        
-                        if history_last_date != today_str:
-                            # 情境 A: 歷史資料還沒今天的列，補一個新列
-                            patch_row = df.iloc[-1].copy()
-                            patch_row['date'] = today_str
-                            patch_row['close'] = latest['price']
-                            patch_row['open'] = latest['price']
-                            patch_row['high'] = latest['price']
-                            patch_row['low'] = latest['price']
-                            patch_row['volume'] = 0
-                            
-                            new_row_df = pd.DataFrame([patch_row])
-                            df = pd.concat([df, new_row_df], ignore_index=True)
-                            print(f"[{symbol}] 歷史資料無今日紀錄，已補齊 {today_str} 快訊價: {latest['price']}")
-                        else:
-                            # 情境 B: 歷史資料已有今日列 (但可能是舊的或預開盤價)，強制蓋掉 close
-                            # 這是修正「報告顯示 1820 但實時 1805」的關鍵
-                            idx_last = df.index[-1]
-                            old_close = df.at[idx_last, 'close']
-                            df.at[idx_last, 'close'] = latest['price']
-                            # 同步更新今日最高最低
-                            df.at[idx_last, 'high'] = max(df.at[idx_last, 'high'], latest['price'])
-                            df.at[idx_last, 'low'] = min(df.at[idx_last, 'low'], latest['price']) if df.at[idx_last, 'low'] > 0 else latest['price']
-                            print(f"[{symbol}] 歷史紀錄已含今日，強制將收盤價從 {old_close} 更新為快訊價: {latest['price']}")
-
-                # 計算 MA20 (在補齊/更新後計算)
-                df['ma20'] = df['close'].rolling(window=20).mean()
-                
-                if len(df) <= offset:
-                    print(f"[{symbol}] 資料不足以計算 offset={offset}。總列數: {len(df)}")
-                    return None
-                    
-                # 取得指定 offset 的資料 (最後一筆是 -1, 前一筆是 -2)
-                idx = -1 - offset
-                last_row = df.iloc[idx]
-                date_str = str(last_row.get('date', '未知日期'))
-                
-                # 處理漲跌幅 (始終與前一筆比較)
-                change_pct = None
-                if idx - 1 >= -len(df):
-                    try:
-                        prev_close = float(df.iloc[idx - 1]['close'])
-                        current_close = float(last_row['close'])
-                        if prev_close != 0:
-                            change_pct = round(((current_close - prev_close) / prev_close) * 100, 2)
-                    except:
-                        pass
-                
-                # 處理最高/最低欄位
-                high_val = last_row.get('max') if 'max' in cols else last_row.get('high', 0)
-                low_val = last_row.get('min') if 'min' in cols else last_row.get('low', 0)
-                
-                return {
-                    "date": date_str,
-                    "open": float(last_row.get('open', 0)),
-                    "close": float(last_row['close']),
-                    "high": float(high_val),
-                    "low": float(low_val),
-                    "volume": int(last_row.get('trading_volume', 0)) if 'trading_volume' in last_row else int(last_row.get('volume', 0)),
-                    "ma20": round(float(last_row.get('ma20', 0)), 2) if not pd.isna(last_row.get('ma20')) else None,
-                    "change_pct": change_pct
-                }
-            else:
-                print(f"[{symbol}] API 未回傳有效資料或資料為空")
+                return self._full_stats(symbol, record, offset, latest, now)
+            log.warning("API 未回傳有效資料或資料為空", extra={"symbol": symbol})
             return None
         except KeyError as e:
-            if str(e) == "'data'":
-                print(f"[{symbol}] 獲取失敗: API 回傳格式錯誤 (KeyError: 'data')。這通常是因為未設定 FINMIND_TOKEN 或已達 API 使用上限。")
-            else:
-                print(f"獲取詳細統計資料時發生 KeyError: {e}")
+            self._report_key_error(symbol, e, "獲取詳細統計資料")
             return None
         except Exception as e:
-            print(f"獲取詳細統計資料時發生錯誤: {e}")
+            log.error("獲取詳細統計資料時發生錯誤: %s", e)
             return None
 
+    async def aget_full_stats(self, symbol, offset=0, latest=None):
+        """get_full_stats 的非同步版本"""
+        try:
+            now = self._get_taipei_now()
+            record = await self.aget_daily_history(symbol, self.HISTORY_DAYS)
+            if record is not None:
+                if now.hour >= 9 and latest is None:
+                    latest = await self.aget_last_price(symbol)
+                return self._full_stats(symbol, record, offset, latest, now)
+            log.warning("API 未回傳有效資料或資料為空", extra={"symbol": symbol})
+            return None
+        except KeyError as e:
+            self._report_key_error(symbol, e, "獲取詳細統計資料")
+            return None
+        except Exception as e:
+            log.error("獲取詳細統計資料時發生錯誤: %s", e)
+            return None
+
+    def _full_stats(self, symbol, record, offset, latest, now):
+        """由日 K 紀錄計算指定 offset 的統計 (latest 為今日即時報價，用於補齊或更新今日列)"""
+        # --- [強制更新今日即時數據] ---
+        # 如果現在是台北時間 09:00 後，補齊或更新今日數據 (產生新紀錄，不修改快取)
+        if now.hour >= 9 and latest:
+            today_str = now.strftime("%Y-%m-%d")
+            old_close = record.close[-1]
+            record, appended = record.with_quote(today_str, latest['price'])
+            if appended:
+                # 情境 A: 歷史資料還沒今天的列，補一個新列
+                log.debug("歷史資料無今日紀錄，已補齊 %s 快訊價: %s", today_str, latest['price'], extra={"symbol": symbol})
+            else:
+                # 情境 B: 歷史資料已有今日列 (但可能是舊的或預開盤價)，強制蓋掉 close
+                # 這是修正「報告顯示 1820 但實時 1805」的關鍵
+                log.debug("歷史紀錄已含今日，強制將收盤價從 %s 更新為快訊價: %s", old_close, latest['price'], extra={"symbol": symbol})
+
+        if len(record) <= offset:
+            log.warning("資料不足以計算 offset=%s。總列數: %s", offset, len(record), extra={"symbol": symbol})
+            return None
+
+        # 取得指定 offset 的資料 (最後一筆是 -1, 前一筆是 -2)
+        i = len(record) - 1 - offset
+        close = float(record.close[i])
+
+        # 計算 MA20 (在補齊/更新後計算)
+        ma20 = float(record.close[i - 19:i + 1].mean()) if i >= 19 else np.nan
+
+        # 處理漲跌幅 (始終與前一筆比較)
+        change_pct = None
+        if i >= 1 and record.close[i - 1] != 0:
+            prev_close = float(record.close[i - 1])
+            change_pct = round(((close - prev_close) / prev_close) * 100, 2)
+
+        return {
+            "date": record.date_str(i),
+            "open": float(record.open[i]),
+            "close": close,
+            "high": float(record.high[i]),
+            "low": float(record.low[i]),
+            "volume": int(record.volume[i]),
+            "ma20": self._round_or_none(ma20),
+            "change_pct": change_pct
+        }
+
+    def get_indicator_set(self, symbols=None):
+        """目前歷史快取中標的的技術指標 (IndicatorSet，每個交易日建立一份，新載入的標的補算後附加)"""
+        return self.indicators.get(self._get_taipei_now().strftime("%Y-%m-%d"), symbols)
+
     def get_api_usage(self):
         """
         獲取 FinMind API 的使用次數與上限
@@ -455,20 +728,32 @@ class PriceFetcher:
             return None
             
         try:
-            url = "https://api.web.finmindtrade.com/v2/user_info"
-            response = requests.get(url, params={"token": self.api_token})
-            data = response.json()
-            
-            if data.get("msg") == "success":
-                return {
-                    "user_count": data.get("user_count"),
-                    "api_request_limit": data.get("api_request_limit")
-                }
+            with metrics.track("provider", provider="finmind", endpoint="user_info"):
+                response = requests.get(FINMIND_USER_INFO_URL, params={"token": self.api_token})
+            return self._parse_user_info(response.json())
+        except Exception as e:
+            log.error("獲取 API 使用量時發生錯誤: %s", e)
             return None
+
+    async def aget_api_usage(self):
+        """get_api_usage 的非同步版本"""
+        if not self.api_token:
+            return None
+        try:
+            return self._parse_user_info(await self.async_client.user_info())
         except Exception as e:
-            print(f"獲取 API 使用量時發生錯誤: {e}")
+            log.error("獲取 API 使用量時發生錯誤: %s", e)
             return None
 
+    @staticmethod
+    def _parse_user_info(data):
+        if data.get("msg") == "success":
+            return {
+                "user_count": data.get("user_count"),
+                "api_request_limit": data.get("api_request_limit")
+            }
+        return None
+
     def get_ticker_ma(self, symbol, window=20):
         """
         獲取特定代碼的移動平均線 (優先使用 Fugle)
@@ -492,8 +777,10 @@ class PriceFetcher:
             
             # 2. 備援使用 yfinance
             if df is None or df.empty:
-                ticker = yf.Ticker(symbol)
-                df = ticker.history(period="60d")
+                if self.fugle_token:
+                    metrics.fallback("fugle", "yfinance")
+                with metrics.track("provider", provider="yfinance", endpoint="history"):
+                    df = yf.Ticker(symbol).history(period="60d")
                 if not df.empty:
                     df.columns = [c.lower() for c in df.columns]
 
@@ -508,7 +795,7 @@ class PriceFetcher:
             
             return round(float(last_price), 2), round(float(last_ma), 2)
         except Exception as e:
-            print(f"獲取 {symbol} MA 時發生錯誤: {e}")
+            log.error("獲取 %s MA 時發生錯誤: %s", symbol, e, extra={"symbol": symbol})
             return None, None
 
     def get_market_order_stats(self):
@@ -526,35 +813,61 @@ class PriceFetcher:
             for _ in range(5):
                 try:
                     target_date = date_to_try.strftime("%Y-%m-%d")
-                    df = self.loader.get_data(
-                        dataset="TaiwanStockStatisticsOfOrderBookAndTrade",
-                        start_date=target_date,
-                        end_date=target_date
-                    )
+                    with metrics.track("provider", provider="finmind", endpoint="TaiwanStockStatisticsOfOrderBookAndTrade"):
+                        df = self.loader.get_data(
+                            dataset="TaiwanStockStatisticsOfOrderBookAndTrade",
+                            start_date=target_date,
+                            end_date=target_date
+                        )
                     if df is not None and not df.empty:
                         break
                 except:
                     pass
                 date_to_try -= timedelta(days=1)
             
-            if df is not None and not df.empty:
-                # 統一欄位名稱為小寫
-                df.columns = [c.lower() for c in df.columns]
-                # 取得最後一筆 (最新可用資料)
-                last_row = df.iloc[-1]
-                return {
-                    "time": last_row.get("time", "---"),
-                    "date": last_row.get("date", "---"),
-                    "total_buy_order": int(last_row.get("totalbuyorder", 0)),
-                    "total_sell_order": int(last_row.get("totalsellorder", 0)),
-                    "total_buy_volume": int(last_row.get("totalbuyvolume", 0)),
-                    "total_sell_volume": int(last_row.get("totalsellvolume", 0)),
-                    "total_deal_volume": int(last_row.get("totaldealvolume", 0)),
-                }
+            return self._order_stats_from_df(df)
+        except Exception as e:
+            log.error("獲取市場買賣力道時發生錯誤: %s", e)
+            return None
+
+    async def aget_market_order_stats(self):
+        """get_market_order_stats 的非同步版本 (由增量序列提供，不重複解析已處理的資料列)"""
+        try:
+            series = await self.sentiment.latest_series()
+            return series.latest() if series is not None else None
+        except Exception as e:
+            log.error("獲取市場買賣力道時發生錯誤: %s", e)
             return None
+
+    async def aget_market_sentiment(self):
+        """
+        今日 (或最近一個交易日) 的市場氣氛摘要
+        回傳: {date, time, sentiment, diff_vol, overheat_index, imbalance} 或 None
+        """
+        try:
+            series = await self.sentiment.latest_series()
+            return self.sentiment.summarize(series) if series is not None else None
         except Exception as e:
-            print(f"獲取市場買賣力道時發生錯誤: {e}")
+            log.error("獲取市場買賣力道時發生錯誤: %s", e)
+            return None
+
+    @staticmethod
+    def _order_stats_from_df(df):
+        if df is None or df.empty:
             return None
+        # 統一欄位名稱為小寫
+        df.columns = [c.lower() for c in df.columns]
+        # 取得最後一筆 (最新可用資料)
+        last_row = df.iloc[-1]
+        return {
+            "time": last_row.get("time", "---"),
+            "date": last_row.get("date", "---"),
+            "total_buy_order": int(last_row.get("totalbuyorder", 0)),
+            "total_sell_order": int(last_row.get("totalsellorder", 0)),
+            "total_buy_volume": int(last_row.get("totalbuyvolume", 0)),
+            "total_sell_volume": int(last_row.get("totalsellvolume", 0)),
+            "total_deal_volume": int(last_row.get("totaldealvolume", 0)),
+        }
 
     def get_market_indices(self):
         """
@@ -589,17 +902,19 @@ class PriceFetcher:
             
             # 使用 yfinance 批量抓取最新資料 (只抓最近一天的歷史數據來獲取收盤與前收)
             # 這樣可以確保拿到漲跌幅
-            data = yf.download(symbols, period="1d", interval="1m", progress=False)
+            with metrics.track("provider", provider="yfinance", endpoint="download"):
+                data = yf.download(symbols, period="1d", interval="1m", progress=False)
             # 獲取前一日收盤價 (用於計算漲跌)
             # 註: 有些代碼可能不在同一時區，抓取較複雜，這裡簡化處理
             
             for name, symbol in tickers_map.items():
                 try:
-                    ticker = yf.Ticker(symbol)
-                    # 優先使用 fast_info 獲取即時價格
-                    info = ticker.fast_info
-                    price = info.last_price
-                    prev_close = info.previous_close
+                    with metrics.track("provider", provider="yfinance", endpoint="quote"):
+                        ticker = yf.Ticker(symbol)
+                        # 優先使用 fast_info 獲取即時價格
+                        info = ticker.fast_info
+                        price = info.last_price
+                        prev_close = info.previous_close
                     
                     if price and prev_close:
                         change_pct = ((price - prev_close) / prev_close) * 100
@@ -629,13 +944,13 @@ class PriceFetcher:
                             data_list.append({"name": name, "price": 0, "change_pct": 0, "emoji": "⚠️"})
                         
                 except Exception as ex:
-                    print(f"抓取 {name} ({symbol}) 失敗: {ex}")
+                    log.warning("抓取 %s (%s) 失敗: %s", name, symbol, ex, extra={"symbol": symbol})
                     data_list.append({"name": name, "price": 0, "change_pct": 0, "emoji": "❌"})
             
             return data_list
             
         except Exception as e:
-            print(f"獲取市場指數時發生錯誤: {e}")
+            log.error("獲取市場指數時發生錯誤: %s", e)
             return []
 
 if __name__ == "__main__":
@@ -0,0 +1,195 @@
+import os
+import sys
+import time
+import cProfile
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+# 單次作業 (價格檢查、報告) 的分段效能剖析
+# - stage(): 標記作業中的一個階段；只有在 Profile.run() 內 (同一個 context，含 to_thread 執行緒) 才會記錄，平時幾乎無成本
+# - 外部呼叫 (metrics.track) 與圖片繪製 (metrics.timer) 會自動成為階段，因此每檔標的的抓取會細分到各資料來源
+# - 可選擇另外輸出 cProfile 檔 (.prof)、取樣堆疊檔 (.folded) 與階段樹 (.stages.folded)
+#   後兩者為 collapsed stack 格式，可用 flamegraph.pl / speedscope 繪製火焰圖
+
+_current = contextvars.ContextVar("profile_stage", default=None) # 格式: (Profile, 階段路徑 tuple)
+
+
+def active():
+    """目前是否在剖析中的作業內"""
+    return _current.get() is not None
+
+
+@contextmanager
+def stage(name):
+    """標記一個階段 (可巢狀，並行的 task / 執行緒各自記錄)"""
+    current = _current.get()
+    if current is None:
+        yield
+        return
+    profile, path = current
+    path = path + (name,)
+    token = _current.set((profile, path))
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _current.reset(token)
+        profile.record(path, started, time.perf_counter())
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    背景執行緒定期取樣事件迴圈執行緒與 to_thread 工作執行緒的呼叫堆疊
+    輸出 collapsed stack 格式 (每行 "執行緒;外層;...;內層 次數")
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.counts = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._target_ids = set()
+
+    def start(self):
+        self._target_ids = {threading.get_ident()}
+        self._thread = threading.Thread(target=self._loop, name="profile-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, "")
+                # 只取樣事件迴圈與 asyncio 預設執行緒池 (to_thread) 的工作執行緒
+                if ident not in self._target_ids and not name.startswith("asyncio_"):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                # 執行緒池中閒置 (等待工作) 的執行緒不列入
+                if any(label.startswith("_worker ") for label in stack) and not any(label.startswith("run ") for label in stack):
+                    continue
+                key = ";".join([name or str(ident)] + stack)
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for key, count in sorted(self.counts.items()):
+                f.write(f"{key} {count}\n")
+
+
+class Profile:
+    """
+    一次作業的剖析結果
+    spans 記錄每個階段的 (路徑, 開始, 結束)；format_report() 依路徑彙總為階段耗時樹
+    dump=True 時同時以 cProfile 剖析事件迴圈執行緒並取樣呼叫堆疊，結束後寫入 PROFILE_DIR
+    """
+    def __init__(self, label, dump=False, output_dir=None):
+        self.label = label
+        self.dump = dump
+        self.output_dir = output_dir or os.getenv("PROFILE_DIR", "profiles")
+        self.sample_interval = float(os.getenv("PROFILE_SAMPLE_MS", 5)) / 1000
+        self.spans = []
+        self.files = []
+        self.started = None
+        self.elapsed = None
+        self._lock = threading.Lock()
+
+    def record(self, path, started, ended):
+        with self._lock:
+            self.spans.append((path, started, ended))
+
+    async def run(self, awaitable):
+        """在剖析狀態下執行 awaitable 並回傳其結果"""
+        profiler = sampler = None
+        if self.dump:
+            profiler = cProfile.Profile()
+            sampler = StackSampler(self.sample_interval)
+            sampler.start()
+            profiler.enable()
+        token = _current.set((self, (self.label,)))
+        self.started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            ended = time.perf_counter()
+            _current.reset(token)
+            self.elapsed = ended - self.started
+            self.record((self.label,), self.started, ended)
+            if self.dump:
+                profiler.disable()
+                sampler.stop()
+                self._write_dumps(profiler, sampler)
+
+    def _write_dumps(self, profiler, sampler):
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, f"{self.label}-{time.strftime('%Y%m%d-%H%M%S')}")
+        profiler.dump_stats(base + ".prof")
+        sampler.write(base + ".folded")
+        self.write_folded_stages(base + ".stages.folded")
+        self.files = [base + ".prof", base + ".folded", base + ".stages.folded"]
+        log.info("剖析檔已寫入: %s", ', '.join(self.files))
+
+    def stages(self):
+        """
+        依階段路徑彙總 (父階段在前，同層依首次開始時間排序)
+        回傳: [(路徑 tuple, 次數, 總耗時秒, 最長單次秒)]
+        """
+        with self._lock:
+            spans = list(self.spans)
+        summary = {}
+        for path, started, ended in spans:
+            entry = summary.setdefault(path, [0, 0.0, 0.0, started])
+            entry[0] += 1
+            entry[1] += ended - started
+            entry[2] = max(entry[2], ended - started)
+            entry[3] = min(entry[3], started)
+        first_start = {path: entry[3] for path, entry in summary.items()}
+        order = lambda path: tuple(first_start.get(path[:i + 1], 0) for i in range(len(path)))
+        return [(path, *summary[path][:3]) for path in sorted(summary, key=order)]
+
+    def format_report(self, limit=None):
+        """
+        階段耗時樹 (文字)
+        並行執行的子階段 (例如各標的抓取) 總和可能超過父階段的實際耗時
+        """
+        lines = [f"⏱ **效能剖析：{self.label}** (總耗時 {self.elapsed or 0:.2f}s)\n"]
+        rows = self.stages()
+        shown = rows if limit is None else rows[:limit]
+        for path, count, total, longest in shown:
+            indent = "  " * (len(path) - 1)
+            count_text = f" (×{count}，最長 {longest * 1000:.0f}ms)" if count > 1 else ""
+            lines.append(f"{indent}• `{path[-1]}`: {total * 1000:.0f}ms{count_text}")
+        if len(rows) > len(shown):
+            lines.append(f"…其餘 {len(rows) - len(shown)} 個階段")
+        if self.files:
+            lines.append("\n剖析檔: " + ", ".join(f"`{os.path.basename(path)}`" for path in self.files))
+        return "\n".join(lines)
+
+    def write_folded_stages(self, path):
+        """以階段樹輸出 collapsed stack 格式 (自身耗時，單位微秒)"""
+        rows = self.stages()
+        totals = {row[0]: row[2] for row in rows}
+        child_total = {}
+        for row in rows:
+            if len(row[0]) > 1:
+                child_total[row[0][:-1]] = child_total.get(row[0][:-1], 0) + row[2]
+        with open(path, "w", encoding="utf-8") as f:
+            for stage_path, total in totals.items():
+                self_time = max(0.0, total - child_total.get(stage_path, 0))
+                if self_time > 0:
+                    f.write(f"{';'.join(stage_path)} {int(self_time * 1e6)}\n")
@@ -0,0 +1,230 @@
+import time
+import numpy as np
+
+
+class QuoteRecord:
+    """單一標的的最新報價 (QuoteStore 對外回傳的唯讀紀錄)"""
+    __slots__ = ("symbol", "price", "time")
+
+    def __init__(self, symbol, price, time):
+        self.symbol = symbol
+        self.price = price
+        self.time = time # unix 秒
+
+
+class HistoryRecord:
+    """
+    單一標的的日 K 歷史 (欄位為等長的 NumPy 陣列，由舊到新)
+    dates 為 datetime64[D]，價格與成交量為 float64
+    """
+    __slots__ = ("symbol", "dates", "open", "high", "low", "close", "volume", "start", "source", "fetched_at")
+
+    def __init__(self, symbol, dates, open_, high, low, close, volume, start=None, source=None, fetched_at=None):
+        self.symbol = symbol
+        self.dates = dates
+        self.open = open_
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.start = start # 抓取區間起點 (YYYY-MM-DD)，用於判斷快取是否涵蓋查詢範圍
+        self.source = source
+        self.fetched_at = fetched_at or time.time()
+
+    def __len__(self):
+        return len(self.close)
+
+    @classmethod
+    def from_frame(cls, symbol, df, start=None, source=None):
+        """
+        由資料來源回傳的 DataFrame 建立紀錄 (相容 FinMind max/min/Trading_Volume 與富果/yfinance 欄位)
+        收盤價缺值的列會被略過，無有效資料時回傳 None
+        """
+        if df is None or df.empty:
+            return None
+        columns = {c.lower(): c for c in df.columns}
+        if 'close' not in columns or 'date' not in columns:
+            return None
+
+        def column(*names):
+            for name in names:
+                if name in columns:
+                    return df[columns[name]].to_numpy(dtype=np.float64, na_value=np.nan)
+            return np.zeros(len(df))
+
+        close = column('close')
+        valid = ~np.isnan(close)
+        if not valid.any():
+            return None
+        dates = np.array(df[columns['date']].astype(str).str[:10], dtype='datetime64[D]')
+        return cls(
+            symbol,
+            dates[valid],
+            column('open')[valid],
+            column('max', 'high')[valid],
+            column('min', 'low')[valid],
+            close[valid],
+            column('trading_volume', 'volume')[valid],
+            start=start,
+            source=source,
+        )
+
+    def date_str(self, i):
+        return str(self.dates[i])
+
+    def with_quote(self, date, price):
+        """
+        以即時報價補齊或更新指定日期 (今日) 的 K 棒，回傳新紀錄 (不修改快取中的陣列)
+        回傳: (紀錄, 是否為新增列)
+        """
+        date = np.datetime64(date, 'D')
+        if len(self) and self.dates[-1] == date:
+            high, low, close = self.high.copy(), self.low.copy(), self.close.copy()
+            close[-1] = price
+            high[-1] = max(high[-1], price)
+            low[-1] = min(low[-1], price) if low[-1] > 0 else price
+            return HistoryRecord(self.symbol, self.dates, self.open, high, low, close, self.volume,
+                                 self.start, self.source, self.fetched_at), False
+
+        return HistoryRecord(
+            self.symbol,
+            np.append(self.dates, date),
+            np.append(self.open, price),
+            np.append(self.high, price),
+            np.append(self.low, price),
+            np.append(self.close, price),
+            np.append(self.volume, 0.0),
+            self.start, self.source, self.fetched_at
+        ), True
+
+    def before(self, date):
+        """只保留指定日期 (datetime64[D]) 之前的資料，回傳新紀錄；無資料時回傳 None"""
+        keep = self.dates < date
+        if not keep.any():
+            return None
+        return HistoryRecord(
+            self.symbol, self.dates[keep], self.open[keep], self.high[keep], self.low[keep],
+            self.close[keep], self.volume[keep], self.start, self.source, self.fetched_at
+        )
+
+    def merged(self, newer):
+        """
+        以較新的紀錄 (例如只補抓最後幾天) 覆蓋自其第一天起的資料，回傳合併後的新紀錄
+        """
+        keep = self.dates < newer.dates[0]
+        column = lambda name: np.concatenate([getattr(self, name)[keep], getattr(newer, name)])
+        return HistoryRecord(
+            self.symbol, column("dates"), column("open"), column("high"), column("low"),
+            column("close"), column("volume"), self.start, newer.source, newer.fetched_at
+        )
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in ("dates", "open", "high", "low", "close", "volume"))
+
+
+class QuoteStore:
+    """
+    以欄位式陣列保存所有標的的最新報價 (symbol -> 列索引)
+    每檔標的只佔兩個 float64 欄位，整份監控清單的新鮮度判斷可一次向量化完成
+    """
+    def __init__(self, capacity=64):
+        self._index = {}
+        self._symbols = []
+        self.price = np.full(capacity, np.nan)
+        self.time = np.zeros(capacity) # unix 秒，0 表示尚無報價
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, symbol):
+        row = self._index.get(symbol)
+        return row is not None and self.time[row] > 0
+
+    def _row(self, symbol):
+        row = self._index.get(symbol)
+        if row is None:
+            row = len(self._symbols)
+            if row >= len(self.price):
+                # 容量不足時倍增
+                self.price = np.concatenate([self.price, np.full(len(self.price), np.nan)])
+                self.time = np.concatenate([self.time, np.zeros(len(self.time))])
+            self._index[symbol] = row
+            self._symbols.append(symbol)
+        return row
+
+    def set(self, symbol, price, ts=None):
+        row = self._row(symbol)
+        self.price[row] = price
+        self.time[row] = ts if ts is not None else time.time()
+
+    def get(self, symbol):
+        """回傳 QuoteRecord，尚無報價時回傳 None"""
+        row = self._index.get(symbol)
+        if row is None or self.time[row] == 0:
+            return None
+        return QuoteRecord(symbol, float(self.price[row]), float(self.time[row]))
+
+    def get_fresh(self, symbol, max_age, now=None):
+        """回傳 max_age 秒內的報價，否則回傳 None"""
+        record = self.get(symbol)
+        if record is None or (now or time.time()) - record.time >= max_age:
+            return None
+        return record
+
+    def _rows(self, symbols):
+        return np.array([self._index.get(s, -1) for s in symbols], dtype=np.intp)
+
+    def prices(self, symbols):
+        """依序回傳多檔標的的最新價格陣列 (無報價者為 NaN)"""
+        rows = self._rows(symbols)
+        result = np.full(len(rows), np.nan)
+        known = rows >= 0
+        result[known] = self.price[rows[known]]
+        return result
+
+    def fresh_mask(self, symbols, max_age, now=None):
+        """依序回傳多檔標的是否有 max_age 秒內的報價 (布林陣列)"""
+        rows = self._rows(symbols)
+        ages = np.full(len(rows), np.inf)
+        known = rows >= 0
+        ages[known] = (now or time.time()) - self.time[rows[known]]
+        return ages < max_age
+
+    @property
+    def nbytes(self):
+        return self.price.nbytes + self.time.nbytes
+
+
+class HistoryStore:
+    """日 K 歷史快取 (symbol -> HistoryRecord)，超過 max_age 秒或範圍不足時視為失效"""
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self._records = {}
+
+    def get(self, symbol, start=None):
+        record = self._records.get(symbol)
+        if record is None:
+            return None
+        if start is not None and (record.start is None or record.start > start):
+            return None
+        if time.time() - record.fetched_at > self.max_age:
+            return None
+        return record
+
+    def put(self, record):
+        self._records[record.symbol] = record
+
+    def symbols(self):
+        return list(self._records)
+
+    def records(self):
+        """所有標的的歷史紀錄 (含已超過 max_age 者)"""
+        return list(self._records.values())
+
+    def __len__(self):
+        return len(self._records)
+
+    @property
+    def nbytes(self):
+        return sum(record.nbytes for record in self._records.values())
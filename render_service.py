@@ -0,0 +1,257 @@
+import os
+import json
+import asyncio
+import uuid
+import hashlib
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from report_generator import ReportGenerator
+from metrics import metrics
+
+log = logging.getLogger(__name__)
+
+# 每個工作行程各自持有一個 ReportGenerator (於 initializer 中建立)
+_worker_generator = None
+
+
+def _init_worker():
+    """工作行程初始化：建立行程內共用的 ReportGenerator"""
+    global _worker_generator
+    _worker_generator = ReportGenerator()
+
+
+def _render_job(method, args, kwargs):
+    """於工作行程中執行指定的繪圖方法並回傳輸出路徑"""
+    if _worker_generator is None:
+        _init_worker()
+    return getattr(_worker_generator, method)(*args, **kwargs)
+
+
+class RenderCache:
+    """
+    圖表繪製快取 (LRU)，鍵值為 (symbol, chart_type, 輸入資料雜湊)
+    超過容量時淘汰最久未使用的項目並刪除其圖片檔
+    """
+    # 不影響圖面的欄位，不納入雜湊
+    IGNORED_FIELDS = ("fetch_time",)
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or int(os.getenv("RENDER_CACHE_SIZE", 64))
+        self._entries = OrderedDict() # 格式: {(symbol, chart_type, digest): path}
+
+    @classmethod
+    def fingerprint(cls, data):
+        """計算輸入資料的雜湊值"""
+        if isinstance(data, dict):
+            # 欄位為 NumPy 陣列的資料 (如長週期歷史) 直接以位元組計算
+            digest = hashlib.sha1()
+            for key in sorted(data):
+                value = data[key]
+                digest.update(key.encode("utf-8"))
+                if hasattr(value, "tobytes"):
+                    digest.update(value.tobytes())
+                else:
+                    digest.update(json.dumps(value, default=str, ensure_ascii=False).encode("utf-8"))
+            return digest.hexdigest()
+        if isinstance(data, list):
+            data = [
+                {k: v for k, v in row.items() if k not in cls.IGNORED_FIELDS} if isinstance(row, dict) else row
+                for row in data
+            ]
+        payload = json.dumps(data, sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        path = self._entries.get(key)
+        if path is not None and not os.path.exists(path):
+            del self._entries[key]
+            path = None
+        metrics.cache("render", path is not None)
+        if path is None:
+            return None
+        self._entries.move_to_end(key)
+        return path
+
+    def put(self, key, path):
+        self._entries[key] = path
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            _, old_path = self._entries.popitem(last=False)
+            if old_path != path and old_path not in self._entries.values():
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RenderService:
+    """
+    以行程池執行 ReportGenerator 的 CPU 密集繪圖工作，避免阻塞 Bot 事件迴圈
+    佇列有上限，超過上限的請求會等待空位 (背壓)，不會無限制堆積
+    """
+    def __init__(self, workers=None, queue_size=None, output_dir=None):
+        self.workers = workers or int(os.getenv("RENDER_WORKERS", 0)) or (os.cpu_count() or 2)
+        self.queue_size = queue_size or int(os.getenv("RENDER_QUEUE_SIZE", 32))
+        self.output_dir = output_dir or os.getenv("REPORT_OUTPUT_DIR", "reports")
+        # 盤後報告每頁列數，清單超過此數量時改為分頁輸出 (每頁高度固定)
+        self.rows_per_page = int(os.getenv("REPORT_ROWS_PER_PAGE", 20))
+        # 保留最近幾次盤後報告的圖片，更早的檔案於新報告產生時刪除
+        self.report_keep = int(os.getenv("REPORT_KEEP", 8))
+        self._reports = deque()
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        self.cache = RenderCache()
+
+        self._pool = None
+        self._slots = None
+        self.pending = 0 # 目前排隊中 + 執行中的工作數
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+            log.info("🖼️ 繪圖行程池已啟動 (workers=%s, queue=%s)", self.workers, self.queue_size)
+        return self._pool
+
+    def _get_slots(self):
+        # Semaphore 需於事件迴圈內建立
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.queue_size)
+        return self._slots
+
+    def output_path(self, name):
+        """回傳輸出目錄下的檔案路徑"""
+        return os.path.join(self.output_dir, name)
+
+    async def render(self, method, *args, **kwargs):
+        """將單一繪圖工作送入行程池，回傳輸出路徑"""
+        async with self._get_slots():
+            self.pending += 1
+            try:
+                loop = asyncio.get_running_loop()
+                with metrics.timer("render_seconds", method=method):
+                    return await loop.run_in_executor(self._get_pool(), _render_job, method, args, kwargs)
+            finally:
+                self.pending -= 1
+
+    async def render_many(self, jobs):
+        """
+        平行執行多個繪圖工作
+        jobs: list of (method, args, kwargs)
+        回傳與 jobs 同順序的結果列表，失敗的項目為 None
+        """
+        results = await asyncio.gather(
+            *(self.render(method, *args, **kwargs) for method, args, kwargs in jobs),
+            return_exceptions=True
+        )
+        paths = []
+        for (method, args, _), result in zip(jobs, results):
+            if isinstance(result, Exception):
+                log.error("繪圖工作 %s 失敗: %s", method, result)
+                paths.append(None)
+            else:
+                paths.append(result)
+        return paths
+
+    async def closing_report(self, sentiment_data, stock_list, name="closing_report.png"):
+        """產生盤後綜合報告圖片"""
+        return await self.render("generate_closing_report", sentiment_data, stock_list,
+                                 output_path=self.output_path(name))
+
+    async def closing_report_pages(self, sentiment_data, stock_list, name="closing_report"):
+        """
+        產生盤後綜合報告，清單較長時切分為固定大小的頁面並平行繪製
+        每個工作行程只處理一頁，記憶體用量與清單長度無關
+        每次呼叫的檔名帶有唯一前綴，同時進行的 /show、盤後報告與快照不會覆蓋彼此的圖片
+        回傳: 依頁碼排序的圖片路徑列表
+        """
+        name = f"{name}_{uuid.uuid4().hex[:8]}"
+        rows = self.rows_per_page
+        pages = [stock_list[i:i + rows] for i in range(0, len(stock_list), rows)] or [[]]
+        if len(pages) == 1:
+            paths = [await self.closing_report(sentiment_data, stock_list, name=f"{name}.png")]
+        else:
+            total = len(pages)
+            jobs = [
+                ("generate_closing_report", (sentiment_data, page_rows),
+                 {"output_path": self.output_path(f"{name}_p{i}.png"), "page": i, "total_pages": total})
+                for i, page_rows in enumerate(pages, start=1)
+            ]
+            paths = await self.render_many(jobs)
+            if any(p is None for p in paths):
+                self._remove_files(p for p in paths if p)
+                raise RuntimeError("部分報告頁面繪製失敗")
+        self._remember_report(paths)
+        return paths
+
+    def _remember_report(self, paths):
+        """記錄新產生的報告圖片，超過 report_keep 次時刪除最舊一次的檔案"""
+        self._reports.append(paths)
+        while len(self._reports) > self.report_keep:
+            self._remove_files(self._reports.popleft())
+
+    @staticmethod
+    def _remove_files(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    async def sentiment_timeline(self, timeline, name="sentiment_timeline.png"):
+        """產生盤中市場氣氛時間軸圖片 (timeline: SentimentFeed.timeline 的回傳值)"""
+        return await self.render("generate_sentiment_timeline", timeline, output_path=self.output_path(name))
+
+    def _chart_job(self, symbol, stats_list):
+        """建立 K 線圖工作與其快取鍵值 (檔名包含資料雜湊，快取中的檔案不會被覆蓋)"""
+        digest = RenderCache.fingerprint(stats_list)
+        key = (symbol, "stock_history_chart", digest)
+        output_path = self.output_path(f"stock_history_chart_{symbol}_{digest[:12]}.png")
+        job = ("generate_stock_history_chart", (symbol, stats_list), {"output_path": output_path})
+        return key, job
+
+    async def stock_chart(self, symbol, stats_list):
+        """產生單一標的五日 K 線圖 (資料未變動時直接回傳快取)"""
+        return (await self.stock_charts([(symbol, stats_list)]))[0]
+
+    async def stock_charts(self, charts):
+        """
+        平行產生多檔標的 K 線圖，已快取的項目不重新繪製
+        charts: list of (symbol, stats_list)
+        """
+        keys, jobs, paths = [], [], []
+        for symbol, stats_list in charts:
+            key, job = self._chart_job(symbol, stats_list)
+            keys.append(key)
+            jobs.append(job)
+            paths.append(self.cache.get(key))
+
+        missing = [i for i, path in enumerate(paths) if path is None]
+        if missing:
+            rendered = await self.render_many([jobs[i] for i in missing])
+            for i, path in zip(missing, rendered):
+                paths[i] = path
+                if path:
+                    self.cache.put(keys[i], path)
+        return paths
+
+    async def long_chart(self, symbol, history):
+        """產生長週期 K 線圖 (資料未變動時直接回傳快取)"""
+        digest = RenderCache.fingerprint(history)
+        key = (symbol, "long_history_chart", digest)
+        path = self.cache.get(key)
+        if path is None:
+            path = await self.render("generate_long_history_chart", symbol, history,
+                                     output_path=self.output_path(f"long_history_chart_{symbol}_{digest[:12]}.png"))
+            self.cache.put(key, path)
+        return path
+
+    def shutdown(self):
+        """關閉行程池"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
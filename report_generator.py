@@ -1,8 +1,110 @@
 import os
+import io
+import logging
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont
+import numpy as np
 import pandas as pd
 from datetime import datetime
 
+log = logging.getLogger(__name__)
+
+# 版面常數 (靜態圖層與動態內容共用)
+CLOSING_HEADER_HEIGHT = 680
+CLOSING_FOOTER_HEIGHT = 120
+CHART_TABLE_Y = 830
+# 長週期 K 線圖每根 K 棒最少佔用的像素寬度 (資料多於此密度時降採樣)
+CANDLE_MIN_PX = 4
+
+# 預先繪製的靜態背景圖層，格式: {(kind, font_path): Image}
+_STATIC_LAYERS = {}
+
+# 優先順序: 1. 專案路徑下的字體 2. 系統字體
+POTENTIAL_FONTS = [
+    # 專案本地字體 (建議使用者上傳一個字體到此路徑以確保不同環境一致)
+    "assets/fonts/msjh.ttc",
+    "assets/fonts/NotoSansTC-Regular.otf",
+    "assets/fonts/font.ttc",
+    "assets/fonts/font.ttf",
+
+    # Windows 字體
+    "C:/Windows/Fonts/msjh.ttc",  # Microsoft JhengHei
+    "C:/Windows/Fonts/msjh.ttf",
+    "C:/Windows/Fonts/msjhl.ttc",
+    "C:/Windows/Fonts/mingliu.ttc",
+
+    # Linux (Railway) 常用字體路徑
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
+    "/usr/share/fonts/truetype/droid/DroidSansFallback.ttf",
+    "/usr/share/fonts/truetype/arphic/uming.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+]
+
+
+@lru_cache(maxsize=1)
+def find_font_path():
+    """尋找支援中文的字體 (每個行程只探測一次)"""
+    for f in POTENTIAL_FONTS:
+        # 檢查絕對路徑或相對路徑
+        target = f if os.path.isabs(f) else os.path.join(os.getcwd(), f)
+        if os.path.exists(target):
+            log.info("✅ 已找到字體庫: %s", target)
+            return target
+
+    log.warning("⚠️ 系統找不到中文字體，圖片中的中文將顯示為亂碼。"
+                "請下載一個支援中文的字體檔 (如 NotoSansTC-Regular.otf) 並放至 assets/fonts/ 資料夾下。")
+    return None
+
+
+@lru_cache(maxsize=None)
+def get_font(path, size):
+    """以 (path, size) 為鍵快取字體物件，避免每次繪圖重新解析數 MB 的 .ttc 檔"""
+    if not path:
+        return ImageFont.load_default()
+    try:
+        return ImageFont.truetype(path, size)
+    except Exception:
+        return ImageFont.load_default()
+
+
+def moving_average(values, window):
+    """以累加和計算簡單移動平均，前 window-1 筆為 NaN"""
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(values.shape, np.nan)
+    if len(values) >= window:
+        csum = np.cumsum(np.insert(values, 0, 0.0))
+        result[window - 1:] = (csum[window:] - csum[:-window]) / window
+    return result
+
+
+def downsample_ohlc(open_, high, low, close, volume, n_buckets, extra=None):
+    """
+    將 K 棒依序聚合為 n_buckets 組 (開=首筆開、高=最高、低=最低、收=末筆收、量=加總)
+    extra: 其他需要跟著降採樣的序列 (如均線)，取每組最後一筆
+    回傳: (open, high, low, close, volume, extra, 每組起點索引)
+    """
+    n = len(close)
+    if n_buckets >= n:
+        starts = np.arange(n)
+        return open_, high, low, close, volume, extra or [], starts
+
+    starts = np.linspace(0, n, n_buckets, endpoint=False).astype(np.int64)
+    ends = np.append(starts[1:], n) - 1
+    extra = [np.asarray(series)[ends] for series in (extra or [])]
+    return (
+        open_[starts],
+        np.maximum.reduceat(high, starts),
+        np.minimum.reduceat(low, starts),
+        close[ends],
+        np.add.reduceat(volume, starts),
+        extra,
+        starts,
+    )
+
+
 class ReportGenerator:
     def __init__(self):
         self.bg_color = "#121212"
@@ -14,80 +116,142 @@ class ReportGenerator:
         self.ma5_color = "#FFD700"  # Yellow for MA5
         self.ma20_color = "#00FFFF" # Cyan for MA20
         
-        # Try to find a font that supports Chinese. 
-        self.font_path = None
-        
-        # 優先順序: 1. 專案路徑下的字體 2. 系統字體
-        potential_fonts = [
-            # 專案本地字體 (建議使用者上傳一個字體到此路徑以確保不同環境一致)
-            "assets/fonts/msjh.ttc",
-            "assets/fonts/NotoSansTC-Regular.otf",
-            "assets/fonts/font.ttc",
-            "assets/fonts/font.ttf",
-            
-            # Windows 字體
-            "C:/Windows/Fonts/msjh.ttc",  # Microsoft JhengHei
-            "C:/Windows/Fonts/msjh.ttf",
-            "C:/Windows/Fonts/msjhl.ttc",
-            "C:/Windows/Fonts/mingliu.ttc",
-            
-            # Linux (Railway) 常用字體路徑
-            "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
-            "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",
-            "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
-            "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
-            "/usr/share/fonts/truetype/droid/DroidSansFallback.ttf",
-            "/usr/share/fonts/truetype/arphic/uming.ttc",
-            "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
-        ]
-        
-        for f in potential_fonts:
-            # 檢查絕對路徑或相對路徑
-            target = f if os.path.isabs(f) else os.path.join(os.getcwd(), f)
-            if os.path.exists(target):
-                self.font_path = target
-                print(f"✅ 已找到字體庫: {self.font_path}")
-                break
-        
-        if not self.font_path:
-            print("⚠️ 警告: 系統找不到中文字體，圖片中的中文將顯示為亂碼。")
-            print("💡 建議: 請下載一個支援中文的字體檔 (如 NotoSansTC-Regular.otf) 並放至 assets/fonts/ 資料夾下。")
+        # 字體探測每個行程只執行一次 (結果快取於模組層級)
+        self.font_path = find_font_path()
+
+        # 輸出編碼: png / png8 (調色盤量化) / webp / jpeg / auto (依大小自動挑選)
+        self.image_format = os.getenv("REPORT_IMAGE_FORMAT", "png").lower()
+        self.image_quality = int(os.getenv("REPORT_IMAGE_QUALITY", 85))
+        self.palette_colors = int(os.getenv("REPORT_PNG_COLORS", 64))
+        # 位元組預算 (> 0 時自動挑選不超過預算、畫質最高的編碼)
+        self.max_bytes = int(os.getenv("REPORT_IMAGE_MAX_BYTES", 0))
+
+    def _encode(self, img, fmt, quality):
+        """將圖片編碼為指定格式，回傳 (bytes, 副檔名)"""
+        buf = io.BytesIO()
+        if fmt == "png8":
+            # 報告以大面積純色為主，量化為調色盤後體積可大幅縮小
+            img.quantize(colors=self.palette_colors, method=Image.Quantize.FASTOCTREE).save(buf, format="PNG", optimize=True)
+            return buf.getvalue(), ".png"
+        if fmt == "webp":
+            img.save(buf, format="WEBP", quality=quality, method=4)
+            return buf.getvalue(), ".webp"
+        if fmt == "jpeg":
+            # 關閉色度抽樣以保持彩色文字清晰
+            img.save(buf, format="JPEG", quality=quality, optimize=True, subsampling=0)
+            return buf.getvalue(), ".jpg"
+        img.save(buf, format="PNG")
+        return buf.getvalue(), ".png"
 
-    def generate_closing_report(self, sentiment_data, stock_list, output_path="closing_report.png"):
+    def _encode_within_budget(self, img):
         """
-        sentiment_data: {date, sentiment, diff_vol, overheat_index}
-        stock_list: list of {name, symbol, close, change_pct, ma20_status}
+        依序嘗試由高至低畫質的候選編碼，回傳第一個不超過預算者，皆超過時回傳最小者
+        未設定預算 (auto 模式) 時，以設定畫質比較各編碼並取最小者
         """
-        # Canvas size - dynamic height
-        row_height = 100
-        header_height = 680
-        canvas_height = max(1200, header_height + (len(stock_list) * row_height) + 120)
-        
+        candidates = [("png8", None)]
+        qualities = (90, 80, 70, 60, 50, 40) if self.max_bytes else (self.image_quality,)
+        for quality in qualities:
+            candidates.append(("webp", quality))
+            candidates.append(("jpeg", quality))
+
+        smallest = None
+        for fmt, quality in candidates:
+            data, ext = self._encode(img, fmt, quality)
+            if self.max_bytes and len(data) <= self.max_bytes:
+                return data, ext
+            if smallest is None or len(data) < len(smallest[0]):
+                smallest = (data, ext)
+        return smallest
+
+    def save_image(self, img, output_path):
+        """依設定的編碼輸出圖片，回傳實際檔案路徑 (副檔名會隨編碼調整)"""
+        if self.max_bytes > 0 or self.image_format == "auto":
+            data, ext = self._encode_within_budget(img)
+        else:
+            data, ext = self._encode(img, self.image_format, self.image_quality)
+
+        path = os.path.splitext(output_path)[0] + ext
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def _fonts(self, sizes):
+        """依序回傳快取中的字體物件"""
+        return [get_font(self.font_path, size) for size in sizes]
+
+    def _static_layer(self, kind, builder):
+        """取得預先繪製好的靜態背景圖層 (每個行程每種圖層只繪製一次)"""
+        key = (kind, self.font_path)
+        layer = _STATIC_LAYERS.get(key)
+        if layer is None:
+            layer = builder()
+            _STATIC_LAYERS[key] = layer
+        return layer
+
+    def _build_closing_header(self):
+        """盤後報告靜態頁首：標題、氣氛卡片外框、表格標題列"""
         width = 1200
-        img = Image.new('RGB', (width, canvas_height), color=self.bg_color)
+        img = Image.new('RGB', (width, CLOSING_HEADER_HEIGHT), color=self.bg_color)
         draw = ImageDraw.Draw(img)
-        
-        # Load fonts - Further Increased sizes
-        try:
-            title_font = ImageFont.truetype(self.font_path, 72) if self.font_path else ImageFont.load_default()
-            subtitle_font = ImageFont.truetype(self.font_path, 42) if self.font_path else ImageFont.load_default()
-            body_font = ImageFont.truetype(self.font_path, 36) if self.font_path else ImageFont.load_default()
-            small_font = ImageFont.truetype(self.font_path, 28) if self.font_path else ImageFont.load_default()
-        except:
-            title_font = subtitle_font = body_font = small_font = ImageFont.load_default()
+        title_font, subtitle_font, body_font = self._fonts((72, 42, 36))
 
         # Header
         draw.text((40, 40), f"台股每日盤後綜合報告", font=title_font, fill=self.accent_color)
-        # Date info moved down to avoid overlap (Title is size 72)
-        draw.text((40, 130), f"日期: {sentiment_data.get('date', '---')} | 生成時間: {datetime.now().strftime('%H:%M')}", font=small_font, fill="#AAAAAA")
-        
+
         # --- Market Sentiment Card ---
-        # Shifted down following the date info
         draw.rounded_rectangle([40, 190, width-60, 460], radius=15, fill=self.card_color)
         draw.text((70, 215), "市場氣氛與買賣力道", font=subtitle_font, fill=self.text_color)
+
+        # --- Stock List Title ---
+        list_start_y = 500
+        draw.text((40, list_start_y), "監控標的盤後統計", font=subtitle_font, fill=self.text_color)
+
+        # Table Header
+        header_y = list_start_y + 80
+        draw.text((60, header_y), "股票名稱", font=body_font, fill="#AAAAAA")
+        draw.text((380, header_y), "收盤", font=body_font, fill="#AAAAAA")
+        draw.text((550, header_y), "漲跌", font=body_font, fill="#AAAAAA")
+        draw.text((750, header_y), "MA20 狀態", font=body_font, fill="#AAAAAA")
+        draw.text((1000, header_y), "成交量", font=body_font, fill="#AAAAAA")
+
+        draw.line([60, header_y+60, width-60, header_y+60], fill="#333333", width=2)
+        return img
+
+    def _build_closing_footer(self):
+        """盤後報告靜態頁尾"""
+        width = 1200
+        img = Image.new('RGB', (width, CLOSING_FOOTER_HEIGHT), color=self.bg_color)
+        draw = ImageDraw.Draw(img)
+        small_font, = self._fonts((28,))
+        draw.text((width//2 - 150, CLOSING_FOOTER_HEIGHT - 60), "Antigravity Stock Monitor v2.1", font=small_font, fill="#555555")
+        return img
+
+    def generate_closing_report(self, sentiment_data, stock_list, output_path="closing_report.png", page=1, total_pages=1):
+        """
+        sentiment_data: {date, sentiment, diff_vol, overheat_index, imbalance (可選)}
+        stock_list: list of {name, symbol, close, change_pct, ma20_status}
+        page/total_pages: 分頁模式下的頁碼 (stock_list 僅為該頁的資料列)
+        """
+        # Canvas size - dynamic height
+        row_height = 100
+        header_height = CLOSING_HEADER_HEIGHT
+        canvas_height = max(1200, header_height + (len(stock_list) * row_height) + CLOSING_FOOTER_HEIGHT)
         
+        width = 1200
+        img = Image.new('RGB', (width, canvas_height), color=self.bg_color)
+        # 貼上預先繪製的靜態頁首與頁尾，以下只繪製動態內容
+        img.paste(self._static_layer("closing_header", self._build_closing_header), (0, 0))
+        img.paste(self._static_layer("closing_footer", self._build_closing_footer), (0, canvas_height - CLOSING_FOOTER_HEIGHT))
+        draw = ImageDraw.Draw(img)
+        
+        body_font, small_font = self._fonts((36, 28))
+
         if not sentiment_data:
             sentiment_data = {"date": "---", "sentiment": "---", "diff_vol": 0, "overheat_index": 0}
+
+        # Date info
+        page_info = f" | 第 {page}/{total_pages} 頁" if total_pages > 1 else ""
+        draw.text((40, 130), f"日期: {sentiment_data.get('date', '---')} | 生成時間: {datetime.now().strftime('%H:%M')}{page_info}", font=small_font, fill="#AAAAAA")
         
         # Sentiment Info
         sent = sentiment_data.get('sentiment', '---')
@@ -99,23 +263,13 @@ class ReportGenerator:
         draw.text((70, 280), f"市場氣分: {sent}", font=body_font, fill=sent_color)
         draw.text((70, 335), f"買賣量差: {diff_vol:+,}", font=body_font, fill=self.text_color)
         draw.text((70, 390), f"過熱指數: {overheat:.2f}%", font=body_font, fill=self.accent_color)
-        
-        # --- Stock List Title ---
-        list_start_y = 500
-        draw.text((40, list_start_y), "監控標的盤後統計", font=subtitle_font, fill=self.text_color)
-        
-        # Table Header
-        header_y = list_start_y + 80
-        draw.text((60, header_y), "股票名稱", font=body_font, fill="#AAAAAA")
-        draw.text((380, header_y), "收盤", font=body_font, fill="#AAAAAA")
-        draw.text((550, header_y), "漲跌", font=body_font, fill="#AAAAAA")
-        draw.text((750, header_y), "MA20 狀態", font=body_font, fill="#AAAAAA")
-        draw.text((1000, header_y), "成交量", font=body_font, fill="#AAAAAA")
-        
-        draw.line([60, header_y+60, width-60, header_y+60], fill="#333333", width=2)
+        if sentiment_data.get('imbalance') is not None:
+            imbalance = sentiment_data['imbalance']
+            imb_color = self.up_color if imbalance > 0 else self.down_color if imbalance < 0 else self.text_color
+            draw.text((620, 335), f"近期買賣失衡: {imbalance:+.1%}", font=body_font, fill=imb_color)
         
         # Render Rows
-        curr_y = header_y + 100
+        curr_y = header_height
         for stock in stock_list:
             color = self.up_color if stock['change_pct'] > 0 else self.down_color if stock['change_pct'] < 0 else self.text_color
             
@@ -141,12 +295,40 @@ class ReportGenerator:
             
             curr_y += row_height
             draw.line([60, curr_y-20, width-60, curr_y-20], fill="#222222", width=1)
-            
-        # Footer
-        draw.text((width//2 - 150, canvas_height - 60), "Antigravity Stock Monitor v2.1", font=small_font, fill="#555555")
         
-        img.save(output_path)
-        return output_path
+        return self.save_image(img, output_path)
+
+    def _build_chart_layer(self):
+        """K 線圖靜態背景：格線、均線圖例、資料表標題列"""
+        width, height = 1100, 1000
+        img = Image.new('RGB', (width, height), color=self.bg_color)
+        draw = ImageDraw.Draw(img)
+        small_font, = self._fonts((18,))
+
+        # Grid Lines (位置固定，只有刻度數值隨資料變動)
+        chart_x, chart_y = 120, 160
+        chart_w, chart_h = 850, 420
+        for i in range(5):
+            y = chart_y + chart_h - (chart_h * i / 4)
+            draw.line([chart_x, y, chart_x + chart_w, y], fill="#333333", width=1)
+
+        # Legend for MA lines - Moved below title
+        draw.line([width - 280, 110, width - 230, 110], fill=self.ma5_color, width=4)
+        draw.text((width - 220, 95), "MA5", font=small_font, fill=self.text_color)
+        draw.line([width - 150, 110, width - 100, 110], fill=self.ma20_color, width=4)
+        draw.text((width - 90, 95), "MA20", font=small_font, fill=self.text_color)
+
+        # Footer Data Table Header
+        curr_y = CHART_TABLE_Y
+        draw.line([40, curr_y, width - 40, curr_y], fill="#444444", width=2)
+        curr_y += 15
+        draw.text((60, curr_y), "日期", font=small_font, fill="#888888")
+        draw.text((220, curr_y), "開盤", font=small_font, fill="#888888")
+        draw.text((380, curr_y), "最高", font=small_font, fill="#888888")
+        draw.text((540, curr_y), "最低", font=small_font, fill="#888888")
+        draw.text((700, curr_y), "收盤", font=small_font, fill="#888888")
+        draw.text((860, curr_y), "MA20", font=small_font, fill="#888888")
+        return img
 
     def generate_stock_history_chart(self, symbol, stats_list, output_path="stock_history_chart.png"):
         """
@@ -157,17 +339,10 @@ class ReportGenerator:
         # Sort by date ascending for chart
         stats_list = sorted(stats_list, key=lambda x: x['date'])
         
-        width, height = 1100, 1000
-        img = Image.new('RGB', (width, height), color=self.bg_color)
+        img = self._static_layer("stock_chart", self._build_chart_layer).copy()
         draw = ImageDraw.Draw(img)
         
-        try:
-            title_font = ImageFont.truetype(self.font_path, 48) if self.font_path else ImageFont.load_default()
-            subtitle_font = ImageFont.truetype(self.font_path, 32) if self.font_path else ImageFont.load_default()
-            body_font = ImageFont.truetype(self.font_path, 24) if self.font_path else ImageFont.load_default()
-            small_font = ImageFont.truetype(self.font_path, 18) if self.font_path else ImageFont.load_default()
-        except:
-            title_font = subtitle_font = body_font = small_font = ImageFont.load_default()
+        title_font, subtitle_font, small_font = self._fonts((48, 32, 18))
 
         # Header
         draw.text((40, 30), f"📈 {symbol} 五日 K 線數據變化", font=title_font, fill=self.accent_color)
@@ -188,11 +363,10 @@ class ReportGenerator:
         
         def get_y(p): return chart_y + chart_h - ((p - min_p) / p_range * chart_h)
 
-        # Draw Grid Lines
+        # Grid labels (格線已在靜態圖層)
         for i in range(5):
             val = min_p + (p_range * i / 4)
             y = get_y(val)
-            draw.line([chart_x, y, chart_x + chart_w, y], fill="#333333", width=1)
             draw.text((20, y - 10), f"{val:.1f}", font=small_font, fill="#888888")
 
         # Draw Candlesticks
@@ -228,16 +402,10 @@ class ReportGenerator:
         if len(ma20_points) > 1:
             draw.line(ma20_points, fill=self.ma20_color, width=2)
             
-        # Legend for MA lines - Moved below title
-        draw.line([width - 280, 110, width - 230, 110], fill=self.ma5_color, width=4)
-        draw.text((width - 220, 95), "MA5", font=small_font, fill=self.text_color)
-        draw.line([width - 150, 110, width - 100, 110], fill=self.ma20_color, width=4)
-        draw.text((width - 90, 95), "MA20", font=small_font, fill=self.text_color)
-            
         # --- Volume Bar Chart ---
         vol_y = 650
         vol_h = 130
-        max_vol = max([s['volume'] for s in stats_list])
+        max_vol = max([s['volume'] for s in stats_list]) or 1
         
         draw.text((40, vol_y - 45), f"成交量 (Max: {max_vol:,})", font=subtitle_font, fill="#FFFFFF")
         
@@ -247,17 +415,8 @@ class ReportGenerator:
             color = self.up_color if s['close'] >= s['open'] else self.down_color
             draw.rectangle([cx - bar_w/2, vol_y + vol_h - vh, cx + bar_w/2, vol_y + vol_h], fill=color, outline="#222222")
             
-        # Footer Data Table
-        curr_y = vol_y + vol_h + 50
-        draw.line([40, curr_y, width - 40, curr_y], fill="#444444", width=2)
-        curr_y += 15
-        draw.text((60, curr_y), "日期", font=small_font, fill="#888888")
-        draw.text((220, curr_y), "開盤", font=small_font, fill="#888888")
-        draw.text((380, curr_y), "最高", font=small_font, fill="#888888")
-        draw.text((540, curr_y), "最低", font=small_font, fill="#888888")
-        draw.text((700, curr_y), "收盤", font=small_font, fill="#888888")
-        draw.text((860, curr_y), "MA20", font=small_font, fill="#888888")
-        
+        # Footer Data Table (標題列已在靜態圖層)
+        curr_y = CHART_TABLE_Y + 15
         for i, s in enumerate(reversed(stats_list)):
             curr_y += 35
             if i >= 5: break
@@ -269,8 +428,177 @@ class ReportGenerator:
             draw.text((700, curr_y), f"{s['close']}", font=small_font, fill=color)
             draw.text((860, curr_y), f"{s.get('ma20', '---')}", font=small_font, fill="#FFFFFF")
 
-        img.save(output_path)
-        return output_path
+        return self.save_image(img, output_path)
+
+    def generate_long_history_chart(self, symbol, history, output_path="long_history_chart.png"):
+        """
+        長週期 (60/120/250 日或多年) K 線圖
+        history: PriceFetcher.get_price_history 的回傳值 (欄位為 NumPy 陣列)
+        所有座標以陣列運算求得，資料量超過像素寬度時先以 OHLC 分組降採樣，
+        因此繪圖成本與資料長度無關
+        """
+        close_all = np.asarray(history['close'], dtype=np.float64)
+        if close_all.size == 0: return None
+
+        # 均線以完整資料計算 (含前置資料)，再擷取顯示區間
+        start = history.get('start', 0)
+        ma_windows = (5, 20, 60)
+        mas = [moving_average(close_all, w)[start:] for w in ma_windows]
+        dates = history['dates'][start:]
+        o = np.asarray(history['open'], dtype=np.float64)[start:]
+        h = np.asarray(history['high'], dtype=np.float64)[start:]
+        l = np.asarray(history['low'], dtype=np.float64)[start:]
+        c = close_all[start:]
+        v = np.asarray(history['volume'], dtype=np.float64)[start:]
+        days = len(c)
+
+        width, height = 1100, 1000
+        chart_x, chart_y = 120, 160
+        chart_w, chart_h = 850, 480
+        vol_y, vol_h = 760, 150
+
+        n_buckets = max(1, min(days, chart_w // CANDLE_MIN_PX))
+        o, h, l, c, v, mas, starts = downsample_ohlc(o, h, l, c, v, n_buckets, extra=mas)
+        n = len(c)
+
+        img = Image.new('RGB', (width, height), color=self.bg_color)
+        draw = ImageDraw.Draw(img)
+        title_font, subtitle_font, small_font = self._fonts((48, 32, 18))
+
+        draw.text((40, 30), f"📈 {symbol} {days} 日 K 線", font=title_font, fill=self.accent_color)
+        if n < days:
+            draw.text((40, 100), f"每根 K 棒 ≈ {days / n:.1f} 個交易日", font=small_font, fill="#888888")
+
+        # --- 價格座標 (向量化) ---
+        ma_stack = np.vstack(mas) if mas else np.empty((0, n))
+        finite_ma = ma_stack[np.isfinite(ma_stack)]
+        min_p = min(l.min(), finite_ma.min() if finite_ma.size else l.min()) * 0.98
+        max_p = max(h.max(), finite_ma.max() if finite_ma.size else h.max()) * 1.02
+        p_range = (max_p - min_p) or 1.0
+        scale = chart_h / p_range
+        base = chart_y + chart_h
+
+        spacing = chart_w / n
+        cx = chart_x + spacing * (np.arange(n) + 0.5)
+        half_w = max(spacing * 0.35, 0.5)
+        y_high = base - (h - min_p) * scale
+        y_low = base - (l - min_p) * scale
+        y_top = base - (np.maximum(o, c) - min_p) * scale
+        y_bottom = np.maximum(base - (np.minimum(o, c) - min_p) * scale, y_top + 1)
+        is_up = c >= o
+
+        max_vol = v.max() or 1.0
+        vol_top = vol_y + vol_h - (v / max_vol) * vol_h
+
+        # Grid Lines
+        for i in range(5):
+            val = min_p + (p_range * i / 4)
+            y = base - (val - min_p) * scale
+            draw.line([chart_x, y, chart_x + chart_w, y], fill="#333333", width=1)
+            draw.text((20, y - 10), f"{val:.1f}", font=small_font, fill="#888888")
+
+        # Candlesticks & Volume
+        for i in range(n):
+            color = self.up_color if is_up[i] else self.down_color
+            x = cx[i]
+            draw.line([x, y_high[i], x, y_low[i]], fill=color, width=1)
+            draw.rectangle([x - half_w, y_top[i], x + half_w, y_bottom[i]], fill=color)
+            draw.rectangle([x - half_w, vol_top[i], x + half_w, vol_y + vol_h], fill=color)
+
+        # MA Lines (略過前置不足的 NaN 區段)
+        ma_colors = (self.ma5_color, self.ma20_color, "#FF8C00")
+        for series, color in zip(mas, ma_colors):
+            mask = np.isfinite(series)
+            if mask.sum() > 1:
+                ys = base - (series[mask] - min_p) * scale
+                draw.line(list(zip(cx[mask].tolist(), ys.tolist())), fill=color, width=2)
+
+        # Legend
+        legend_x = width - 400
+        for w, color in zip(ma_windows, ma_colors):
+            draw.line([legend_x, 110, legend_x + 40, 110], fill=color, width=4)
+            draw.text((legend_x + 50, 95), f"MA{w}", font=small_font, fill=self.text_color)
+            legend_x += 130
+
+        # X 軸日期刻度 (最多 6 個)
+        tick_count = min(6, n)
+        for idx in np.linspace(0, n - 1, tick_count).astype(np.int64):
+            draw.text((cx[idx] - 45, chart_y + chart_h + 10), dates[starts[idx]], font=small_font, fill="#AAAAAA")
+
+        draw.text((40, vol_y - 45), f"成交量 (Max: {int(max_vol):,})", font=subtitle_font, fill="#FFFFFF")
+
+        # 最新收盤摘要
+        last_close = float(c[-1])
+        first_close = float(close_all[start])
+        change = (last_close - first_close) / first_close * 100 if first_close else 0
+        color = self.up_color if change > 0 else self.down_color if change < 0 else self.text_color
+        draw.text((40, vol_y + vol_h + 30), f"區間: {dates[0]} ~ {dates[-1]}", font=small_font, fill="#AAAAAA")
+        draw.text((500, vol_y + vol_h + 30), f"收盤 {last_close:,.2f}  區間漲跌 {change:+.2f}%", font=small_font, fill=color)
+
+        return self.save_image(img, output_path)
+
+    def generate_sentiment_timeline(self, timeline, output_path="sentiment_timeline.png"):
+        """
+        盤中市場氣氛時間軸：上方為滾動買賣失衡 (柱狀，偏多紅、偏空綠)，下方為過熱指數走勢
+        timeline: SentimentFeed.timeline 的回傳值 (每分鐘一筆)
+        """
+        imbalance = np.asarray(timeline['imbalance'], dtype=np.float64)
+        overheat = np.asarray(timeline['overheat'], dtype=np.float64)
+        times = timeline['times']
+        n = len(imbalance)
+        if n == 0: return None
+
+        width, height = 1100, 900
+        chart_x, chart_w = 120, 900
+        imb_y, imb_h = 170, 300
+        heat_y, heat_h = 580, 220
+
+        img = Image.new('RGB', (width, height), color=self.bg_color)
+        draw = ImageDraw.Draw(img)
+        title_font, subtitle_font, small_font = self._fonts((44, 28, 18))
+
+        draw.text((40, 30), f"📊 盤中市場氣氛 {timeline.get('date', '')}", font=title_font, fill=self.accent_color)
+        draw.text((40, 95), f"委買 - 委賣 (近 {timeline.get('window_minutes', 5)} 分鐘) / 新增委託量", font=small_font, fill="#888888")
+
+        spacing = chart_w / n
+        cx = chart_x + spacing * (np.arange(n) + 0.5)
+        half_w = max(spacing * 0.4, 0.5)
+
+        # --- 買賣失衡 (以 0 為中線，上下對稱) ---
+        limit = max(float(np.abs(imbalance).max()), 0.05)
+        mid = imb_y + imb_h / 2
+        bar_top = mid - imbalance / limit * (imb_h / 2)
+        draw.text((40, imb_y - 40), "買賣失衡", font=subtitle_font, fill=self.text_color)
+        for value in (limit, 0.0, -limit):
+            y = mid - value / limit * (imb_h / 2)
+            draw.line([chart_x, y, chart_x + chart_w, y], fill="#555555" if value == 0 else "#333333", width=1)
+            draw.text((20, y - 10), f"{value:+.0%}", font=small_font, fill="#888888")
+        for i in range(n):
+            color = self.up_color if imbalance[i] >= 0 else self.down_color
+            top, bottom = sorted((bar_top[i], mid))
+            draw.rectangle([cx[i] - half_w, top, cx[i] + half_w, max(bottom, top + 1)], fill=color)
+
+        # --- 過熱指數 ---
+        min_h, max_h = float(overheat.min()), float(overheat.max())
+        h_range = (max_h - min_h) or 1.0
+        ys = heat_y + heat_h - (overheat - min_h) / h_range * heat_h
+        draw.text((40, heat_y - 45), f"過熱指數 (收 {overheat[-1]:.2f}%)", font=subtitle_font, fill=self.text_color)
+        for i in range(3):
+            val = min_h + h_range * i / 2
+            y = heat_y + heat_h - (val - min_h) / h_range * heat_h
+            draw.line([chart_x, y, chart_x + chart_w, y], fill="#333333", width=1)
+            draw.text((20, y - 10), f"{val:.1f}%", font=small_font, fill="#888888")
+        if n > 1:
+            draw.line(list(zip(cx.tolist(), ys.tolist())), fill=self.accent_color, width=2)
+        else:
+            draw.ellipse([cx[0] - 3, ys[0] - 3, cx[0] + 3, ys[0] + 3], fill=self.accent_color)
+
+        # X 軸時間刻度 (最多 6 個)
+        for idx in np.linspace(0, n - 1, min(6, n)).astype(np.int64):
+            draw.text((cx[idx] - 25, heat_y + heat_h + 15), times[idx], font=small_font, fill="#AAAAAA")
+
+        return self.save_image(img, output_path)
+
 
 if __name__ == "__main__":
     # Test
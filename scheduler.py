@@ -0,0 +1,153 @@
+import heapq
+import asyncio
+import itertools
+import logging
+from datetime import datetime, timedelta, time as dt_time
+
+from metrics import metrics
+
+log = logging.getLogger(__name__)
+
+
+class Job:
+    """排程工作：name 為唯一名稱，func 為 async 函式，next_fire(now, job) 回傳下次執行時間 (aware datetime) 或 None"""
+    def __init__(self, name, func, next_fire):
+        self.name = name
+        self.func = func
+        self.next_fire = next_fire
+        self.generation = 0 # 每次重新排程遞增，用於作廢 heap 中的舊項目
+        self.running = False
+        self.last_run = None # 上次開始執行的時間
+        self.last_run_date = None
+        self.last_result = None # 上次執行的回傳值 (發生例外時為 False)
+
+
+class Scheduler:
+    """
+    以 min-heap 管理各工作的下次觸發時間，精準睡眠到最近的工作
+    - 工作執行完畢後才計算下一次觸發時間，因此同一工作不會重疊執行
+    - 設定變更時呼叫 reschedule() 立即重新計算並喚醒
+    """
+    def __init__(self, tz):
+        self.tz = tz
+        self.jobs = {}
+        self._heap = [] # 格式: (timestamp, seq, name, generation)
+        self._seq = itertools.count()
+        self._wake = None
+        self._tasks = set() # 執行中工作的 Task (保留參考避免被回收，完成後移除)
+
+    def now(self):
+        return datetime.now(self.tz)
+
+    def add_job(self, name, func, next_fire):
+        self.jobs[name] = Job(name, func, next_fire)
+
+    def _schedule(self, job):
+        """計算並推入工作的下次觸發時間"""
+        job.generation += 1
+        fire_at = job.next_fire(self.now(), job)
+        if fire_at is not None:
+            heapq.heappush(self._heap, (fire_at.timestamp(), next(self._seq), job.name, job.generation))
+
+    def reschedule(self, name=None):
+        """重新計算指定工作 (或全部工作) 的觸發時間；執行中的工作會在結束後自動重新排程"""
+        names = [name] if name else list(self.jobs)
+        for n in names:
+            job = self.jobs.get(n)
+            if job and not job.running:
+                self._schedule(job)
+        if self._wake:
+            self._wake.set()
+
+    def next_runs(self):
+        """回傳各工作的下次觸發時間 (供狀態顯示)"""
+        latest = {}
+        for ts, _, name, gen in self._heap:
+            job = self.jobs[name]
+            if gen == job.generation:
+                latest[name] = datetime.fromtimestamp(ts, self.tz)
+        return latest
+
+    async def _run_job(self, job):
+        job.last_run = self.now()
+        job.last_run_date = job.last_run.date()
+        try:
+            with metrics.track("scheduler_job", job=job.name):
+                job.last_result = await job.func()
+        except Exception as e:
+            job.last_result = False
+            log.exception("排程工作 %s 發生錯誤: %s", job.name, e)
+        finally:
+            job.running = False
+            self._schedule(job)
+            if self._wake:
+                self._wake.set()
+
+    async def run(self):
+        """排程主迴圈"""
+        self._wake = asyncio.Event()
+        for job in self.jobs.values():
+            self._schedule(job)
+
+        while True:
+            # 丟棄已作廢 (重新排程過) 的項目
+            while self._heap:
+                _, _, name, gen = self._heap[0]
+                if gen == self.jobs[name].generation and not self.jobs[name].running:
+                    break
+                heapq.heappop(self._heap)
+
+            timeout = None
+            if self._heap:
+                timeout = max(0.0, self._heap[0][0] - self.now().timestamp())
+                if timeout == 0.0:
+                    _, _, name, _ = heapq.heappop(self._heap)
+                    job = self.jobs[name]
+                    # 建立 Task 前即標記執行中，避免 Task 尚未開始時 reschedule() 重複排入
+                    job.running = True
+                    task = asyncio.create_task(self._run_job(job))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                    continue
+
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+def daily_at(hour, minute, weekdays=range(0, 5), grace_minutes=0, day_filter=None, retry_seconds=0):
+    """
+    產生「每日固定時間」的 next_fire 函式
+    weekdays: 允許執行的星期 (0=Mon)
+    grace_minutes: 啟動時若已錯過今日時間但仍在寬限內且今日尚未執行，立即執行
+    day_filter: 額外的日期條件 (如是否為交易日)，回傳 False 的日期不執行
+    retry_seconds: 工作回傳 False (或發生例外) 時，於寬限時間內每隔幾秒重試 (0 為不重試)
+    """
+    weekdays = set(weekdays)
+    target = dt_time(hour, minute)
+
+    def allowed(d):
+        return d.weekday() in weekdays and (day_filter is None or day_filter(d))
+
+    def next_fire(now, job):
+        today_fire = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        deadline = today_fire + timedelta(minutes=grace_minutes)
+        if retry_seconds and job.last_run_date == now.date() and job.last_result is False:
+            retry_at = job.last_run + timedelta(seconds=retry_seconds)
+            if retry_at < deadline:
+                return max(now, retry_at)
+        if allowed(now.date()) and job.last_run_date != now.date():
+            if now < today_fire:
+                return today_fire
+            if now < deadline:
+                return now
+        # 往後找 (涵蓋連續長假)
+        for days in range(1, 31):
+            candidate = datetime.combine(now.date() + timedelta(days=days), target, tzinfo=now.tzinfo)
+            if allowed(candidate.date()):
+                return candidate
+        return None
+
+    return next_fire
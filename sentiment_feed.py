@@ -0,0 +1,217 @@
+import os
+import time
+import logging
+from datetime import date
+
+import numpy as np
+
+from metrics import metrics
+
+log = logging.getLogger(__name__)
+
+# 全市場委託成交統計 (FinMind TaiwanStockStatisticsOfOrderBookAndTrade) 欄位 -> 序列名稱
+# 各欄位皆為開盤至該時點的累計值
+ORDER_BOOK_FIELDS = {
+    "TotalBuyOrder": "buy_order",
+    "TotalSellOrder": "sell_order",
+    "TotalBuyVolume": "buy_volume",
+    "TotalSellVolume": "sell_volume",
+    "TotalDealVolume": "deal_volume",
+}
+
+
+def _seconds(time_str):
+    """'HH:MM:SS' -> 當日秒數"""
+    h, m, s = (int(x) for x in str(time_str).split(":"))
+    return h * 3600 + m * 60 + s
+
+
+def _time_str(seconds):
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class OrderBookSeries:
+    """
+    單一交易日的委託成交統計序列 (每 5 秒一筆，欄位為 NumPy 陣列)
+    新資料以整段附加，已處理過的資料列不會重新解析
+    """
+    def __init__(self, date_str):
+        self.date = date_str
+        self.times = np.zeros(0, dtype=np.int64) # 當日秒數
+        self.columns = {name: np.zeros(0) for name in ORDER_BOOK_FIELDS.values()}
+        self.fetched_at = 0   # 上次向資料來源查詢的時間 (unix 秒)
+        self.complete = False # 已取得收盤後的最後一筆，不再查詢
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def last_seconds(self):
+        return int(self.times[-1]) if len(self.times) else -1
+
+    def append_rows(self, rows):
+        """
+        附加資料來源回傳的原始資料列，只解析時間晚於目前最後一筆者
+        回傳新增筆數
+        """
+        last = self.last_seconds
+        known = len(self.times)
+        # 資料列依時間排序且只會往後增加：已處理的前 known 筆未變動時直接跳過
+        if known and len(rows) >= known and _seconds(rows[known - 1]["Time"]) == last:
+            rows = rows[known:]
+        new_rows = [row for row in rows if _seconds(row["Time"]) > last]
+        if not new_rows:
+            return 0
+        self.times = np.concatenate([self.times, np.array([_seconds(row["Time"]) for row in new_rows], dtype=np.int64)])
+        for field, name in ORDER_BOOK_FIELDS.items():
+            values = np.array([row.get(field, 0) or 0 for row in new_rows], dtype=np.float64)
+            self.columns[name] = np.concatenate([self.columns[name], values])
+        return len(new_rows)
+
+    def latest(self):
+        """最新一筆統計 (格式同 PriceFetcher.get_market_order_stats)，無資料時回傳 None"""
+        if not len(self):
+            return None
+        return {
+            "time": _time_str(self.last_seconds),
+            "date": self.date,
+            "total_buy_order": int(self.columns["buy_order"][-1]),
+            "total_sell_order": int(self.columns["sell_order"][-1]),
+            "total_buy_volume": int(self.columns["buy_volume"][-1]),
+            "total_sell_volume": int(self.columns["sell_volume"][-1]),
+            "total_deal_volume": int(self.columns["deal_volume"][-1]),
+        }
+
+    def overheat(self):
+        """過熱指數序列 (累計成交量 / 累計委買量 × 100)"""
+        buy, deal = self.columns["buy_volume"], self.columns["deal_volume"]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(buy > 0, deal / buy * 100, 0.0)
+
+    def imbalance(self, window_seconds):
+        """
+        滾動買賣力道失衡序列：最近 window_seconds 秒內 (新增委買 - 新增委賣) / (新增委買 + 新增委賣)
+        介於 -1 (全為賣方) 與 1 (全為買方)，視窗內無新增委託時為 0
+        """
+        buy, sell = self.columns["buy_volume"], self.columns["sell_volume"]
+        # 視窗外 (時間 <= t - window) 最後一筆的累計量；開盤初期視窗外無資料，以 0 為基準
+        outside = np.searchsorted(self.times, self.times - window_seconds, side="right")
+        d_buy = buy - np.concatenate([[0.0], buy])[outside]
+        d_sell = sell - np.concatenate([[0.0], sell])[outside]
+        total = d_buy + d_sell
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(total > 0, (d_buy - d_sell) / total, 0.0)
+
+    def timeline(self, window_seconds, step_seconds=60):
+        """
+        盤中氣氛時間軸 (每 step_seconds 取最後一筆，供繪圖)
+        回傳: {"date", "times": ["HH:MM"], "imbalance": [float], "overheat": [float], "diff_vol": [int]}
+        """
+        if not len(self):
+            return None
+        buckets = self.times // step_seconds
+        # 每個時間區段的最後一筆
+        last_in_bucket = np.flatnonzero(np.append(buckets[1:] != buckets[:-1], True))
+        imbalance = self.imbalance(window_seconds)[last_in_bucket]
+        overheat = self.overheat()[last_in_bucket]
+        diff_vol = (self.columns["buy_volume"] - self.columns["sell_volume"])[last_in_bucket]
+        return {
+            "date": self.date,
+            "times": [_time_str(int(t))[:5] for t in self.times[last_in_bucket]],
+            "imbalance": np.round(imbalance, 4).tolist(),
+            "overheat": np.round(overheat, 2).tolist(),
+            "diff_vol": diff_vol.astype(np.int64).tolist(),
+            "window_minutes": window_seconds // 60,
+        }
+
+
+class SentimentFeed:
+    """
+    增量的全市場買賣力道資料流
+    - 資料來源無時間篩選參數，每次查詢仍回傳當日全部資料列；本資料流只解析新於最後一筆的資料列並附加至序列
+    - 同一交易日在 SENTIMENT_REFRESH_SECONDS 內的重複查詢直接使用記憶體中的序列
+    - 取得收盤後的資料、過去交易日取得資料後，或行事曆確認為休市日時視為完整，不再查詢
+    """
+    def __init__(self, client, clock, calendar=None):
+        self.client = client
+        self.clock = clock # 回傳台北時間 datetime 的函式
+        self.calendar = calendar # MarketCalendar (未設定時僅以週末判斷休市)
+        self.refresh_seconds = int(os.getenv("SENTIMENT_REFRESH_SECONDS", 60))
+        self.window_seconds = int(os.getenv("SENTIMENT_WINDOW_SECONDS", 300))
+        self.close_seconds = _seconds(os.getenv("SENTIMENT_CLOSE_TIME", "13:30:00"))
+        self.max_days = 3
+        self._days = {} # 格式: {date_str: OrderBookSeries}
+
+    def series(self, date_str):
+        """記憶體中的指定交易日序列 (不發出請求)，無資料時回傳 None"""
+        series = self._days.get(date_str)
+        return series if series is not None and len(series) else None
+
+    async def update(self, date_str):
+        """
+        視需要向資料來源查詢並附加新資料，回傳該日的 OrderBookSeries (可能為空)
+        """
+        series = self._days.get(date_str)
+        if series is None:
+            series = OrderBookSeries(date_str)
+            self._days[date_str] = series
+            # 只保留最近幾個交易日
+            for old in sorted(self._days)[:-self.max_days]:
+                del self._days[old]
+
+        now = time.time()
+        cached = series.complete or now - series.fetched_at < self.refresh_seconds
+        metrics.cache("order_book", cached)
+        if cached:
+            return series
+
+        series.fetched_at = now
+        rows = await self.client.order_book_rows(date_str)
+        added = series.append_rows(rows)
+        is_past = date_str < self.clock().strftime("%Y-%m-%d")
+        # 過去的交易日資料不會再變動；空回應只有在確認為休市日時才視為完整 (否則可能是資料來源暫時異常)
+        if series.last_seconds >= self.close_seconds or (is_past and (len(series) or not self._is_trading_day(date_str))):
+            series.complete = True
+        if added:
+            log.debug("📊 委託成交統計 %s 新增 %s 筆 (累計 %s 筆，至 %s)", date_str, added, len(series), _time_str(series.last_seconds))
+        return series
+
+    def _is_trading_day(self, date_str):
+        d = date.fromisoformat(date_str)
+        return self.calendar.is_trading_day("TW", d) if self.calendar else d.weekday() < 5
+
+    async def latest_series(self, days_back=5):
+        """今日或最近一個有資料的交易日序列，皆無資料時回傳 None"""
+        from datetime import timedelta
+        date_to_try = self.clock()
+        for _ in range(days_back):
+            date_str = date_to_try.strftime("%Y-%m-%d")
+            try:
+                series = await self.update(date_str)
+                if len(series):
+                    return series
+            except Exception as e:
+                log.warning("獲取 %s 委託成交統計失敗: %s", date_str, e)
+            date_to_try -= timedelta(days=1)
+        return None
+
+    def summarize(self, series):
+        """
+        市場氣氛摘要 (報告使用)
+        回傳: {date, time, sentiment, diff_vol, overheat_index, imbalance}
+        """
+        stats = series.latest()
+        diff_vol = stats['total_buy_volume'] - stats['total_sell_volume']
+        return {
+            "date": stats['date'],
+            "time": stats['time'],
+            "sentiment": "🐂 偏多" if diff_vol > 0 else "🐻 偏空",
+            "diff_vol": diff_vol,
+            "overheat_index": float(series.overheat()[-1]),
+            "imbalance": round(float(series.imbalance(self.window_seconds)[-1]), 4),
+        }
+
+    def timeline(self, date_str):
+        """指定交易日的盤中氣氛時間軸 (記憶體中無資料時回傳 None)"""
+        series = self.series(date_str)
+        return series.timeline(self.window_seconds) if series is not None else None
@@ -0,0 +1,117 @@
+import os
+import json
+import shutil
+import logging
+from datetime import date, datetime, timezone, timedelta
+
+log = logging.getLogger(__name__)
+
+
+class SnapshotStore:
+    """
+    每個交易日的盤後快照 (各標的摘要、市場氣氛與報告圖片)
+    目錄結構: {base_dir}/{YYYY-MM-DD}/snapshot.json 與圖片檔
+    offset >= 1 的查詢直接讀取快照，不需重新呼叫任何 API
+    calendar: MarketCalendar，提供時依台股交易日確認快照日期連續 (缺漏的交易日不以更早的快照替代)
+    """
+    def __init__(self, base_dir=None, retention_days=None, calendar=None):
+        self.base_dir = base_dir or os.getenv("SNAPSHOT_DIR", "snapshots")
+        self.retention_days = retention_days or int(os.getenv("SNAPSHOT_RETENTION_DAYS", 30))
+        self.calendar = calendar
+        os.makedirs(self.base_dir, exist_ok=True)
+
+    def _day_dir(self, date_str):
+        return os.path.join(self.base_dir, date_str)
+
+    def save(self, report_data, image_paths=None):
+        """
+        將報告資料 (get_report_data 的回傳值) 與圖片寫入該交易日的快照
+        回傳快照內容，資料日期無效時回傳 None
+        """
+        date_str = report_data.get('date')
+        if not date_str or date_str == "---":
+            log.warning("快照資料日期無效，略過儲存。")
+            return None
+
+        day_dir = self._day_dir(date_str)
+        os.makedirs(day_dir, exist_ok=True)
+
+        # 圖片複製到快照目錄，避免被之後的即時報告覆蓋
+        images = []
+        for path in image_paths or []:
+            if path and os.path.exists(path):
+                target = os.path.join(day_dir, os.path.basename(path))
+                shutil.copyfile(path, target)
+                images.append(target)
+
+        snapshot = {
+            "date": date_str,
+            "stock_list": report_data.get('stock_list', []),
+            "sentiment": report_data.get('sentiment'),
+            "images": images,
+            "created_at": datetime.now(timezone(timedelta(hours=8))).isoformat()
+        }
+        # 先寫入暫存檔再替換，避免讀到寫到一半的快照
+        tmp_path = os.path.join(day_dir, "snapshot.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, os.path.join(day_dir, "snapshot.json"))
+
+        log.info("💾 已儲存 %s 盤後快照 (%s 檔標的, %s 張圖片)", date_str, len(snapshot['stock_list']), len(images))
+        self.prune()
+        return snapshot
+
+    def list_dates(self):
+        """回傳所有快照日期 (由新到舊)"""
+        if not os.path.isdir(self.base_dir):
+            return []
+        dates = [
+            name for name in os.listdir(self.base_dir)
+            if os.path.exists(os.path.join(self._day_dir(name), "snapshot.json"))
+        ]
+        return sorted(dates, reverse=True)
+
+    def load(self, date_str):
+        """讀取指定日期的快照，不存在時回傳 None"""
+        path = os.path.join(self._day_dir(date_str), "snapshot.json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            # 過濾已被刪除的圖片
+            snapshot['images'] = [p for p in snapshot.get('images', []) if os.path.exists(p)]
+            return snapshot
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning("讀取快照 %s 失敗: %s", date_str, e)
+            return None
+
+    def get_by_offset(self, offset, today_str):
+        """
+        取得今日之前第 offset 個交易日的快照 (offset=1 為前一交易日)
+        有行事曆時只讀取該交易日的快照，當日快照缺漏 (排程失敗或停機) 時回傳 None，由呼叫端改為即時計算
+        """
+        if offset < 1:
+            return None
+        if self.calendar is not None:
+            return self.load(self.trading_day_before(today_str, offset))
+        past_dates = [d for d in self.list_dates() if d < today_str]
+        if len(past_dates) < offset:
+            return None
+        return self.load(past_dates[offset - 1])
+
+    def trading_day_before(self, today_str, offset):
+        """今日之前第 offset 個台股交易日 (YYYY-MM-DD)"""
+        d = date.fromisoformat(today_str)
+        for _ in range(offset):
+            d -= timedelta(days=1)
+            while not self.calendar.is_trading_day("TW", d):
+                d -= timedelta(days=1)
+        return d.isoformat()
+
+    def prune(self):
+        """刪除超過保存天數的快照"""
+        cutoff = (datetime.now() - timedelta(days=self.retention_days)).strftime("%Y-%m-%d")
+        for date_str in self.list_dates():
+            if date_str < cutoff:
+                shutil.rmtree(self._day_dir(date_str), ignore_errors=True)
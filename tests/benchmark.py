@@ -0,0 +1,332 @@
+"""
+離線效能測試：以本機替身服務 (tests/fake_providers.py) 取代 FinMind、富果、Yahoo、Notion 與 Telegram，
+在不同監控清單大小下量測 check_once、get_report_data 與報告圖片繪製
+
+每個情境重複執行 --repeat 次 (每次都先清空報價、歷史、指標與圖片快取，量測冷啟動)，回報：
+  - 吞吐量 (監控清單檔數 / 耗時中位數)
+  - 每次執行耗時的 p50 / p99
+  - 峰值記憶體 (另以 tracemalloc 多跑一次取得，只含主行程；圖片繪製於工作行程中進行，不列入)
+  - 替身服務在每次執行中收到的請求數與注入的錯誤數
+結果可存成 JSON (--output)，並與先前版本的結果比較 (--baseline)，超過容許幅度時以結束碼 1 結束
+
+--replay 改以 http_recorder.py 錄製的交易日封存檔取代替身服務 (監控清單與回應皆為錄製內容，時鐘調回錄製當時)，
+--speed 控制重播延遲的倍速 (1 原始、0 不延遲)
+
+用法 (於專案根目錄執行):
+  python tests/benchmark.py
+  python tests/benchmark.py --sizes 10,100 --scenarios check,report --latency-ms 30 --error-rate 0.02
+  python tests/benchmark.py --latency notion=120 --latency telegram=80 --output bench_new.json --baseline bench_old.json
+  python tests/benchmark.py --replay session.jsonl.gz --speed 4 --baseline bench_replay_old.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import shutil
+import tempfile
+import tracemalloc
+import contextlib
+import multiprocessing
+from datetime import datetime
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_providers
+import http_recorder
+
+SCENARIOS = ("check", "report", "render")
+
+
+def _free_port():
+    import socket
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_server(port, replay=None, speed=1.0):
+    """於獨立行程啟動替身服務或重播服務 (避免與受測程式競爭 GIL)"""
+    ctx = multiprocessing.get_context("spawn")
+    ready = ctx.Event()
+    if replay:
+        process = ctx.Process(target=http_recorder.serve_replay, args=(replay, port, speed, ready), daemon=True)
+    else:
+        process = ctx.Process(target=fake_providers.serve, args=(port, None, ready), daemon=True)
+    process.start()
+    if not ready.wait(30):
+        process.terminate()
+        raise RuntimeError("替身服務啟動逾時")
+    return process
+
+
+def configure_environment(base, workdir):
+    """在匯入受測模組之前設定環境變數 (各模組於匯入時讀取 API 根網址)"""
+    os.environ.update({
+        "FINMIND_BASE_URL": f"{base}/finmind/api/v4",
+        "FINMIND_USER_INFO_URL": f"{base}/finmind/v2/user_info",
+        "FUGLE_BASE_URL": f"{base}/fugle/marketdata/v1.0",
+        "NOTION_BASE_URL": f"{base}/notion",
+        "TELEGRAM_BASE_URL": f"{base}/telegram",
+        "FINMIND_TOKEN": "bench",
+        "FUGLE_API_TOKEN": "bench",
+        "NOTION_TOKEN": "bench",
+        "NOTION_DATABASE_ID": "bench",
+        "TELEGRAM_BOT_TOKEN": "123456:bench",
+        "TELEGRAM_CHAT_ID": "1",
+        "HISTORY_DB_PATH": os.path.join(workdir, "history.db"),
+        "REPORT_OUTPUT_DIR": os.path.join(workdir, "reports"),
+        "SNAPSHOT_DIR": os.path.join(workdir, "snapshots"),
+        "BACKFILL_CHECKPOINT": os.path.join(workdir, "backfill_checkpoint.json"),
+        "METRICS_PORT": "0",
+        # 替身服務不限流，警報訊息不需依 Telegram 速率排隊
+        "TELEGRAM_RATE_PER_SECOND": "1000",
+    })
+
+
+def bench_config(args, size):
+    latency = {"default": args.latency_ms}
+    for item in args.latency:
+        provider, value = item.split("=")
+        latency[provider] = float(value)
+    return {
+        "symbols": size,
+        "latency_ms": latency,
+        "jitter_ms": args.jitter_ms,
+        "error_rate": {"default": args.error_rate},
+        "seed": args.seed,
+    }
+
+
+def server_call(base, config=None):
+    import httpx
+    if config is None:
+        return httpx.get(f"{base}/_bench/stats", timeout=10).json()
+    return httpx.post(f"{base}/_bench/config", json=config, timeout=10).json()
+
+
+class Bench:
+    def __init__(self, base, workdir):
+        from monitor import MarketMonitor
+        self.base = base
+        self.workdir = workdir
+        self.monitor = MarketMonitor()
+        # 不受實際交易時段影響 (週末或盤後也照常檢查)
+        self.monitor._is_session_open = lambda market: True
+        # yfinance 套件無法指定 API 網址，改由替身服務的 chart 端點提供報價
+        self.monitor.fetcher._get_yfinance_price = self._yahoo_price
+        self.monitor.fetcher._get_yfinance_price_for_us = self._yahoo_price
+        self.runs = 0
+        self.report_data = None
+
+    def shift_clock(self, moment):
+        """將受測程式的台北時間調到 moment (之後照實際時間前進)，讓日期參數與錄製當日相同"""
+        offset = moment - datetime.now(http_recorder.TAIPEI)
+        now = lambda: datetime.now(http_recorder.TAIPEI) + offset
+        self.monitor._get_now_taipei = now
+        self.monitor.fetcher._get_taipei_now = now
+        self.monitor.fetcher.sentiment.clock = now
+
+    def _yahoo_price(self, symbol):
+        import httpx
+        from metrics import metrics
+        try:
+            with metrics.track("provider", provider="yfinance", endpoint="quote"):
+                response = httpx.get(f"{self.base}/yahoo/v8/finance/chart/{symbol}", timeout=10)
+            return float(response.json()["chart"]["result"][0]["meta"]["regularMarketPrice"])
+        except Exception:
+            return None
+
+    def reset_caches(self):
+        """清空所有記憶體與本地快取，讓每次執行都從資料來源重新抓取"""
+        from quote_store import QuoteStore, HistoryStore
+        from indicators import IndicatorEngine
+        from history_db import HistoryDatabase
+        from render_service import RenderCache
+        fetcher = self.monitor.fetcher
+        self.runs += 1
+        fetcher.quotes = QuoteStore()
+        fetcher.history = HistoryStore(max_age=fetcher.history.max_age)
+        fetcher.indicators = IndicatorEngine(fetcher.history, window=fetcher.HISTORY_DAYS)
+        fetcher.history_db = HistoryDatabase(os.path.join(self.workdir, f"history-{self.runs}.db"))
+        fetcher.sentiment._days.clear()
+        self.monitor._watchlist = None
+        self.monitor.renderer.cache = RenderCache()
+
+    async def run(self, scenario):
+        """執行一次情境，回傳處理的檔數"""
+        if scenario == "check":
+            # 含背景佇列中的 Notion 寫入與警報發送
+            success, fail = await self.monitor._check_and_flush()
+            return success + fail
+        if scenario == "report":
+            self.report_data = await self.monitor.get_report_data(offset=0)
+            return len(self.report_data['stock_list'])
+        if scenario == "render":
+            await self.monitor.renderer.closing_report_pages(self.report_data['sentiment'], self.report_data['stock_list'])
+            return len(self.report_data['stock_list'])
+        raise ValueError(f"未知的情境: {scenario}")
+
+    async def measure(self, scenario, size, repeat, warmup=1, verbose=False):
+        durations = []
+        processed = []
+        with contextlib.ExitStack() as stack:
+            if not verbose:
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+            if scenario == "render" and self.report_data is None:
+                self.report_data = await self.monitor.get_report_data(offset=0)
+            # 暖機 (建立連線池與繪圖行程池)，不計時
+            for _ in range(warmup):
+                self.reset_caches()
+                await self.run(scenario)
+
+            before = server_call(self.base)
+            for _ in range(repeat):
+                self.reset_caches()
+                started = time.perf_counter()
+                processed.append(await self.run(scenario))
+                durations.append(time.perf_counter() - started)
+            after = server_call(self.base)
+
+            # 峰值記憶體另跑一次 (tracemalloc 會拖慢執行，不與計時混用)
+            self.reset_caches()
+            tracemalloc.start()
+            await self.run(scenario)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        p50, p99 = np.percentile(durations, [50, 99])
+        return {
+            "size": size,
+            # 實際處理的檔數 (注入錯誤時 Notion 查詢失敗或報價失敗會少於 size)
+            "processed": round(float(np.mean(processed)), 1),
+            "repeat": repeat,
+            "throughput": round((size or float(np.mean(processed))) / p50, 2) if p50 else None,
+            "p50_ms": round(p50 * 1000, 1),
+            "p99_ms": round(p99 * 1000, 1),
+            "peak_mb": round(peak / 2 ** 20, 2),
+            # 每次執行的平均請求數
+            "requests": {p: round((n - before["requests"].get(p, 0)) / repeat, 1) for p, n in after["requests"].items()},
+            "errors": {p: round((after["errors"].get(p, 0) - before["errors"].get(p, 0)) / repeat, 1)
+                       for p in after["requests"]},
+        }
+
+
+def compare(results, baseline, tolerance):
+    """與基準結果比較，回傳退步項目的說明列表"""
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        checks = (
+            ("p50_ms", current["p50_ms"], previous["p50_ms"], True),
+            ("p99_ms", current["p99_ms"], previous["p99_ms"], True),
+            ("peak_mb", current["peak_mb"], previous["peak_mb"], True),
+            ("throughput", current["throughput"], previous["throughput"], False),
+            # 請求數增加通常代表快取或批次查詢失效
+            ("requests", sum(current["requests"].values()), sum(previous["requests"].values()), True),
+        )
+        for name, now, before, lower_is_better in checks:
+            if not now or not before:
+                continue
+            change = now / before - 1
+            worse = change > tolerance if lower_is_better else change < -tolerance
+            if worse:
+                regressions.append(f"{key} {name}: {before} -> {now} ({change:+.0%})")
+    return regressions
+
+
+def print_table(results):
+    print(f"\n{'情境':<16}{'處理檔數':>8}{'檔/秒':>10}{'p50 ms':>10}{'p99 ms':>10}{'峰值 MB':>10}  請求 (錯誤)")
+    for key, r in results.items():
+        requests = ", ".join(f"{p}={n}" + (f"({r['errors'][p]})" if r['errors'].get(p) else "")
+                             for p, n in r["requests"].items() if n)
+        print(f"{key:<16}{r['processed']:>8}{r['throughput'] or 0:>10}{r['p50_ms']:>10}{r['p99_ms']:>10}{r['peak_mb']:>10}  {requests}")
+
+
+async def main(args):
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    server = start_fake_server(port, args.replay, args.speed)
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    configure_environment(base, workdir)
+    from logger import setup_logging
+    # 受測程式的日誌照常經過佇列與格式化，未指定 --verbose 時寫入 /dev/null
+    setup_logging(stream=None if args.verbose else open(os.devnull, "w"))
+
+    bench = Bench(base, workdir)
+    if args.replay:
+        # 監控清單大小由錄製內容決定；時鐘調到最後一筆錄製請求的時間 (收盤後的報告亦已錄製)
+        archive = http_recorder.ReplayArchive(args.replay)
+        bench.shift_clock(archive.recorded_at(archive.exchanges[-1]))
+        sizes = [None]
+    else:
+        sizes = [int(s) for s in args.sizes.split(",")]
+    results = {}
+    try:
+        for size in sizes:
+            for scenario in args.scenarios.split(","):
+                server_call(base, bench_config(args, size))
+                bench.report_data = None
+                label = size or "replay"
+                print(f"執行 {scenario} × {label} ...", flush=True)
+                results[f"{scenario}@{label}"] = await bench.measure(scenario, size, args.repeat, args.warmup, args.verbose)
+    finally:
+        bench.monitor.renderer.shutdown()
+        await bench.monitor.fetcher.async_client.aclose()
+        server.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_table(results)
+    output = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+        print(f"\n結果已寫入 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline.get("results", {}), args.tolerance)
+        if regressions:
+            print(f"\n⚠️ 與 {args.baseline} 相比退步超過 {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print(f"\n✅ 與 {args.baseline} 相比無退步 (容許 {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="離線效能測試 (本機替身服務)")
+    parser.add_argument("--sizes", default="10,100,1000,10000", help="監控清單檔數，以逗號分隔")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="check, report, render (以逗號分隔)")
+    parser.add_argument("--repeat", type=int, default=5, help="每個情境的計時次數")
+    parser.add_argument("--warmup", type=int, default=1, help="每個情境計時前的暖機次數")
+    parser.add_argument("--latency-ms", type=float, default=10, help="替身服務每個請求的延遲 (毫秒)")
+    parser.add_argument("--latency", action="append", default=[], metavar="來源=毫秒",
+                        help="個別來源的延遲，例如 notion=120 (可重複指定)")
+    parser.add_argument("--jitter-ms", type=float, default=5, help="延遲的隨機增量上限 (毫秒)")
+    parser.add_argument("--error-rate", type=float, default=0, help="注入 HTTP 500 的比例 (0~1)")
+    parser.add_argument("--seed", type=int, default=0, help="延遲與錯誤注入的亂數種子")
+    parser.add_argument("--replay", metavar="ARCHIVE", help="改用 http_recorder 錄製的封存檔重播 (忽略 --sizes 與延遲設定)")
+    parser.add_argument("--speed", type=float, default=1.0, help="重播延遲倍速 (1 原始、0 不延遲)")
+    parser.add_argument("--output", help="結果 JSON 檔路徑")
+    parser.add_argument("--baseline", help="先前版本的結果 JSON，用於比較")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允許的退步幅度 (預設 20%%)")
+    parser.add_argument("--verbose", action="store_true", help="顯示受測程式的輸出")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,277 @@
+"""
+效能測試用的本機資料來源替身 (FinMind、富果、Yahoo 報價、Notion、Telegram Bot API)
+
+以單一 HTTP 服務提供，各資料來源以路徑前綴區分：
+  /finmind/api/v4/data            FinMind v4 資料集 (TaiwanStockPrice、TaiwanStockStatisticsOfOrderBookAndTrade、TaiwanStockInfo)
+  /finmind/v2/user_info           FinMind 帳號使用量
+  /fugle/marketdata/v1.0/...      富果即時行情與歷史 K 線
+  /yahoo/v8/finance/chart/<代碼>  Yahoo 報價 (yfinance 使用的 chart 端點格式)
+  /notion/v1/...                  Notion 資料庫查詢 (每頁 100 筆) 與頁面更新
+  /telegram/bot<token>/<method>   Telegram sendMessage / sendPhoto / sendMediaGroup
+
+測試資料由代碼決定 (同一代碼、同一日期永遠回傳相同價格)，不需網路
+延遲與錯誤注入、監控清單大小可在執行中以 POST /_bench/config 調整；GET /_bench/stats 回傳各來源請求數
+
+單獨執行: python tests/fake_providers.py --port 8765 --latency-ms 20 --error-rate 0.01
+"""
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+TAIPEI = timezone(timedelta(hours=8))
+PROVIDERS = ("finmind", "fugle", "yahoo", "notion", "telegram")
+
+
+def bench_symbols(count):
+    """測試用監控清單代碼：先用 4 碼 (1000-9999)，不足時以 6 碼補齊"""
+    return [str(1000 + i) if i < 9000 else str(100000 + i) for i in range(count)]
+
+
+def _seed(symbol):
+    return int(hashlib.md5(symbol.encode()).hexdigest()[:8], 16)
+
+
+def _price(symbol, d):
+    """代碼與日期決定的收盤價 (緩慢波動，並帶有逐日雜訊)"""
+    seed = _seed(symbol)
+    base = 20 + seed % 580
+    noise = (_seed(f"{symbol}{d.toordinal()}") % 1000) / 1000 - 0.5
+    return round(base * (1 + 0.08 * math.sin(d.toordinal() / 9 + seed % 7) + 0.02 * noise), 2)
+
+
+def daily_bars(symbol, start, end):
+    """區間內的平日日 K (迄日為週末時也附上一筆，模擬當日已有資料)，由舊到新"""
+    bars = []
+    d = start
+    while d <= end:
+        if d.weekday() < 5 or d == end:
+            close = _price(symbol, d)
+            prev = _price(symbol, d - timedelta(days=1))
+            bars.append({
+                "date": d.isoformat(),
+                "open": prev,
+                "high": round(max(prev, close) * 1.01, 2),
+                "low": round(min(prev, close) * 0.99, 2),
+                "close": close,
+                "volume": 1000 * (200 + _seed(f"v{symbol}{d.toordinal()}") % 5000),
+            })
+        d += timedelta(days=1)
+    return bars
+
+
+def order_book_rows(date_str, now):
+    """全市場每 5 秒委託成交統計 (09:00 起，當日只到目前時間)"""
+    end = 13 * 3600 + 30 * 60
+    if date_str == now.strftime("%Y-%m-%d"):
+        end = min(end, now.hour * 3600 + now.minute * 60 + now.second)
+    rows = []
+    buy = sell = deal = 0
+    rng = random.Random(date_str)
+    for t in range(9 * 3600, end + 1, 5):
+        buy += rng.randint(800, 1200)
+        sell += rng.randint(800, 1200)
+        deal += rng.randint(600, 900)
+        rows.append({
+            "date": date_str, "Time": f"{t // 3600:02d}:{t % 3600 // 60:02d}:{t % 60:02d}",
+            "TotalBuyOrder": buy // 3, "TotalBuyVolume": buy,
+            "TotalSellOrder": sell // 3, "TotalSellVolume": sell,
+            "TotalDealOrder": deal // 3, "TotalDealVolume": deal,
+        })
+    return rows
+
+
+class BenchState:
+    """替身服務的設定 (延遲、錯誤率、監控清單) 與請求統計"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.configure({})
+
+    def configure(self, config):
+        with self.lock:
+            self.symbols = bench_symbols(int(config.get("symbols", 10)))
+            self.latency_ms = dict(config.get("latency_ms", {}))      # 格式: {provider 或 "default": 毫秒}
+            self.jitter_ms = float(config.get("jitter_ms", 0))
+            self.error_rate = dict(config.get("error_rate", {}))      # 格式: {provider 或 "default": 0~1}
+            self.alert_every = int(config.get("alert_every", 10))     # 每 N 檔設定一檔必定觸發的警報
+            self.rng = random.Random(config.get("seed", 0))
+            self.requests = {name: 0 for name in PROVIDERS}
+            self.errors = {name: 0 for name in PROVIDERS}
+
+    def setting(self, table, provider):
+        return float(table.get(provider, table.get("default", 0)))
+
+    def begin(self, provider):
+        """記錄請求並回傳 (延遲秒數, 是否注入錯誤)"""
+        with self.lock:
+            self.requests[provider] += 1
+            delay = self.setting(self.latency_ms, provider) + self.rng.uniform(0, self.jitter_ms)
+            failed = self.rng.random() < self.setting(self.error_rate, provider)
+            if failed:
+                self.errors[provider] += 1
+        return max(0.0, delay) / 1000, failed
+
+    def stats(self):
+        with self.lock:
+            return {"requests": dict(self.requests), "errors": dict(self.errors), "symbols": len(self.symbols)}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # 保持連線 (與正式 API 相同，連線池可重複使用)
+    disable_nagle_algorithm = True # 標頭與內容分兩次寫出，避免 Nagle 與延遲 ACK 造成每個請求多 40ms
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PATCH(self):
+        self._dispatch("PATCH")
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        body = self._read_body()
+        parts = url.path.strip("/").split("/")
+        if parts[0] == "_bench":
+            if method == "POST":
+                self.state.configure(json.loads(body or b"{}"))
+            self._send_json(200, self.state.stats())
+            return
+        provider = parts[0]
+        if provider not in PROVIDERS:
+            self._send_json(404, {"msg": "not found"})
+            return
+
+        delay, failed = self.state.begin(provider)
+        if delay:
+            time.sleep(delay)
+        if failed:
+            if provider == "telegram":
+                self._send_json(500, {"ok": False, "error_code": 500, "description": "Injected error"})
+            else:
+                self._send_json(500, {"msg": "injected error", "status": 500})
+            return
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        status, payload = getattr(self, f"_{provider}")(method, parts[1:], query, body)
+        self._send_json(status, payload)
+
+    # --- 各資料來源 ---
+
+    def _finmind(self, method, parts, query, body):
+        if parts[-1] == "user_info":
+            return 200, {"user_count": 0, "api_request_limit": 1000000}
+        dataset = query.get("dataset")
+        now = datetime.now(TAIPEI)
+        if dataset == "TaiwanStockPrice":
+            start = date.fromisoformat(query["start_date"])
+            end = date.fromisoformat(query.get("end_date") or now.date().isoformat())
+            symbols = [query["data_id"]] if query.get("data_id") else self.state.symbols
+            data = [
+                {"date": bar["date"], "stock_id": symbol, "Trading_Volume": bar["volume"],
+                 "open": bar["open"], "max": bar["high"], "min": bar["low"], "close": bar["close"]}
+                for symbol in symbols for bar in daily_bars(symbol, start, end)
+            ]
+        elif dataset == "TaiwanStockStatisticsOfOrderBookAndTrade":
+            data = order_book_rows(query["start_date"], now)
+        elif dataset == "TaiwanStockInfo":
+            data = [{"stock_id": s, "stock_name": f"測試{s}", "type": "twse"} for s in self.state.symbols]
+        else:
+            data = []
+        return 200, {"msg": "success", "status": 200, "data": data}
+
+    def _fugle(self, method, parts, query, body):
+        symbol = parts[-1]
+        now = datetime.now(TAIPEI)
+        if "candles" in parts:
+            start = date.fromisoformat(query["from"])
+            end = date.fromisoformat(query["to"])
+            # 富果由新到舊
+            return 200, {"symbol": symbol, "candles": list(reversed(daily_bars(symbol, start, end)))}
+        price = _price(symbol, now.date())
+        return 200, {"date": now.date().isoformat(), "symbol": symbol, "closePrice": price,
+                     "lastUpdated": int(now.timestamp() * 1e6)}
+
+    def _yahoo(self, method, parts, query, body):
+        symbol = parts[-1]
+        price = _price(symbol.split(".")[0], datetime.now(TAIPEI).date())
+        return 200, {"chart": {"result": [{"meta": {"symbol": symbol, "regularMarketPrice": price}}], "error": None}}
+
+    def _notion(self, method, parts, query, body):
+        if parts[-1] == "query":
+            request = json.loads(body or b"{}")
+            start = int(request.get("start_cursor") or 0)
+            size = min(int(request.get("page_size", 100)), 100)
+            symbols = self.state.symbols[start:start + size]
+            today = datetime.now(TAIPEI).date()
+            results = []
+            for i, symbol in enumerate(symbols, start):
+                alert = i % self.state.alert_every == 0
+                results.append({"id": f"page-{symbol}", "properties": {
+                    "名稱": {"title": [{"plain_text": f"測試{symbol}"}]},
+                    "代碼": {"rich_text": [{"plain_text": symbol}]},
+                    "上限警戒值": {"number": 1.0 if alert else 100000.0},
+                    "下限警戒值": {"number": None},
+                    "當前價格": {"number": _price(symbol, today - timedelta(days=1))},
+                    "狀態": {"status": {"name": "正常"}},
+                }})
+            more = start + size < len(self.state.symbols)
+            return 200, {"object": "list", "results": results, "has_more": more,
+                         "next_cursor": str(start + size) if more else None}
+        return 200, {"object": "page", "id": parts[-1]}
+
+    def _telegram(self, method, parts, query, body):
+        message = {"message_id": 1, "date": int(time.time()), "chat": {"id": 1, "type": "private"}}
+        if parts[-1] == "sendMediaGroup":
+            return 200, {"ok": True, "result": [message]}
+        return 200, {"ok": True, "result": message}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 512
+
+
+def serve(port, config=None, ready=None):
+    """啟動替身服務 (阻塞)；ready 為 multiprocessing.Event 時於開始接受連線後設定"""
+    Handler.state = BenchState()
+    Handler.state.configure(config or {})
+    server = _Server(("127.0.0.1", port), Handler)
+    if ready is not None:
+        ready.set()
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="效能測試用的本機資料來源替身")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--symbols", type=int, default=10, help="Notion 監控清單檔數")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    args = parser.parse_args()
+    print(f"替身服務啟動: http://127.0.0.1:{args.port}")
+    serve(args.port, {"symbols": args.symbols, "latency_ms": {"default": args.latency_ms},
+                      "jitter_ms": args.jitter_ms, "error_rate": {"default": args.error_rate}})
@@ -0,0 +1,167 @@
+import os
+import json
+import logging
+import itertools
+import threading
+from collections import deque
+
+import numpy as np
+
+from metrics import metrics
+
+log = logging.getLogger(__name__)
+
+# 警報延遲追蹤：從收到報價到 Telegram 訊息送達 (與 Notion 寫入完成) 的每一段耗時
+# - 報價結果帶有 received_at (自資料來源收到、或模擬行情寫入價格快取的時間)，檢查流程另記錄抓取起訖
+# - 觸發警報時建立 AlertTrace，依序加入 fetch / cache、evaluate、{佇列} queue、telegram send、notion write 等區段
+# - 訊息與 Notion 寫入皆完成 (或被同一標的的新項目取代) 後結束：記錄至 alert_latency_seconds 直方圖、
+#   保留最近 TRACE_KEEP 筆，設定 TRACE_FILE 時逐筆附加為 JSON lines
+# - 警報延遲 (latency) 只計算訊息實際送達者：收到報價 → telegram send 結束
+# 時間一律為 unix 秒 (time.time())，跨執行緒與匯出後皆可比較
+
+_ids = itertools.count(1)
+
+
+class AlertTrace:
+    """一則警報的追蹤紀錄 (origin 為收到報價的時間；branches 為尚未完成的寫出目標)"""
+    __slots__ = ("trace_id", "symbol", "origin", "attrs", "spans", "branches", "outcomes", "tracer")
+
+    def __init__(self, tracer, symbol, origin, **attrs):
+        self.trace_id = next(_ids)
+        self.symbol = symbol
+        self.origin = origin
+        self.attrs = attrs
+        self.spans = []      # 格式: [(名稱, 開始, 結束)]
+        self.branches = set()
+        self.outcomes = {}   # 格式: {寫出目標: ok / error / skipped / superseded}
+        self.tracer = tracer
+
+    def span(self, name, start, end):
+        self.spans.append((name, start, end))
+
+    def expect(self, branch):
+        """標記一個需等待完成的寫出目標 (telegram、notion)"""
+        self.branches.add(branch)
+
+    def close(self, branch, outcome="ok"):
+        """寫出目標完成；全部完成時結束追蹤"""
+        if branch not in self.branches:
+            return
+        self.branches.discard(branch)
+        self.outcomes[branch] = outcome
+        if not self.branches:
+            self.tracer.finish(self)
+
+    @property
+    def ended(self):
+        return max((end for _, _, end in self.spans), default=self.origin)
+
+    def stage_seconds(self):
+        """各區段耗時 (同名區段加總)"""
+        totals = {}
+        for name, start, end in self.spans:
+            totals[name] = totals.get(name, 0.0) + max(0.0, end - start)
+        return totals
+
+    @property
+    def latency(self):
+        """收到報價至訊息送達的秒數；訊息未送達 (暫停、失敗或被取代) 時為 None"""
+        if self.outcomes.get("telegram") != "ok":
+            return None
+        return max(end for name, _, end in self.spans if name == "telegram send") - self.origin
+
+    def to_dict(self):
+        latency = self.latency
+        return {
+            "trace_id": self.trace_id,
+            "symbol": self.symbol,
+            "origin": round(self.origin, 6),
+            "latency": None if latency is None else round(latency, 6),
+            "total": round(self.ended - self.origin, 6),
+            "outcomes": self.outcomes,
+            "spans": [{"name": name, "start": round(start, 6), "end": round(end, 6),
+                       "ms": round((end - start) * 1000, 3)} for name, start, end in self.spans],
+            **self.attrs,
+        }
+
+
+class Tracer:
+    """建立與彙總警報追蹤 (全域實例 tracer)"""
+    def __init__(self, keep=None, path=None):
+        self.keep = keep or int(os.getenv("TRACE_KEEP", 2000))
+        self.path = path if path is not None else os.getenv("TRACE_FILE", "")
+        self.enabled = os.getenv("TRACE_ENABLED", "true").lower() == "true"
+        self.recent = deque(maxlen=self.keep)
+        self._lock = threading.Lock()
+        self._file = None
+
+    def start(self, symbol, origin, **attrs):
+        """建立追蹤；停用時回傳 None (呼叫端略過所有追蹤動作)"""
+        if not self.enabled:
+            return None
+        return AlertTrace(self, symbol, origin, **attrs)
+
+    def finish(self, trace):
+        record = trace.to_dict()
+        metrics.inc("alert_traces_total", telegram=trace.outcomes.get("telegram", "none"))
+        if record["latency"] is not None:
+            metrics.observe("alert_latency_seconds", record["latency"], stage="total")
+        for name, seconds in trace.stage_seconds().items():
+            metrics.observe("alert_latency_seconds", seconds, stage=name)
+        with self._lock:
+            self.recent.append(record)
+            if self.path:
+                self._write(record)
+
+    def _write(self, record):
+        try:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            log.warning("寫入追蹤檔 %s 失敗，停止輸出: %s", self.path, e)
+            self.path = ""
+
+    def export(self, path):
+        """將最近的追蹤紀錄寫成 JSON lines，回傳筆數"""
+        with self._lock:
+            records = list(self.recent)
+        with open(path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return len(records)
+
+    def summary(self):
+        """
+        最近追蹤紀錄的延遲分位數 (毫秒，依實際樣本計算)
+        回傳: {"count": int, "delivered": int, "stages": {名稱: {"p50", "p95", "p99", "max"}}}
+        total 為收到報價至訊息送達 (只含已送達的警報)
+        """
+        with self._lock:
+            records = list(self.recent)
+        stages = {"total": [r["latency"] for r in records if r["latency"] is not None]}
+        for record in records:
+            for span in record["spans"]:
+                stages.setdefault(span["name"], []).append(span["ms"] / 1000)
+        result = {}
+        for name, values in stages.items():
+            if not values:
+                continue
+            p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+            result[name] = {"p50": round(p50, 1), "p95": round(p95, 1), "p99": round(p99, 1),
+                            "max": round(max(values) * 1000, 1)}
+        return {"count": len(records), "delivered": len(stages["total"]), "stages": result}
+
+    def format_report(self):
+        """/stats 使用的警報延遲摘要"""
+        summary = self.summary()
+        if not summary["count"]:
+            return ""
+        lines = [f"\n**警報延遲** (最近 {summary['count']} 則，送達 {summary['delivered']} 則，p50 / p95 / p99)"]
+        for name, q in summary["stages"].items():
+            label = "收到報價→送達" if name == "total" else name
+            lines.append(f"• `{label}`: `{q['p50']:.0f}ms` / `{q['p95']:.0f}ms` / `{q['p99']:.0f}ms`")
+        return "\n".join(lines)
+
+
+tracer = Tracer()